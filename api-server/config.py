@@ -42,3 +42,8 @@ def parse_auth_method(login_method_str: str):
 conn_string = os.getenv("PROTODB_CONN_STRING")
 assert conn_string and len(conn_string)
 auth_method = parse_auth_method(os.getenv("PROTODB_LOGIN_METHOD"))
+db_pool_size = int(os.getenv("PROTODB_API_DB_POOL_SIZE", "8"))
+# Keep the entity caches of pooled connections between requests (see ProtocolDatabasePool)
+db_keep_cache = bool(os.getenv("PROTODB_API_KEEP_CACHE"))
+# Exports are always cached in memory; if set, also in this directory
+export_cache_dir = os.getenv("PROTODB_EXPORT_CACHE_DIR")
@@ -16,16 +16,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
 
-import threading
 import time
 from typing import Optional
 import urllib.request
 
 from flask import Flask, abort, jsonify, request, Response
 
-from protodb import connect
+from protodb import ProtocolDatabase
+from protodb.export.cache import ExportCache
+from protodb.pool import ProtocolDatabasePool
 import config
+import protodb.export.codegen
+import protodb.export.export_dbc
 import protodb.export.export_json2
+import protodb.trace
 import rbac
 
 
@@ -34,8 +38,12 @@ MIMETYPE_DBC = "application/vnd.dbc"
 app = Flask(__name__)
 
 time.sleep(3)   # FIXME: terrible work-around for issue #74
-db = connect(config.conn_string)
-db_lock = threading.Lock()
+db_pool = ProtocolDatabasePool(config.conn_string, size=config.db_pool_size, keep_cache=config.db_keep_cache)
+
+# Open the first connection right away to fail early if the database is unreachable
+db_pool.checkin(db_pool.checkout())
+
+export_cache = ExportCache(directory=config.export_cache_dir, namespace=config.conn_string)
 
 
 def defer_request(href):
@@ -54,21 +62,20 @@ def defer_request(href):
     return r
 
 
-def get_node_id(package_name, node_name) -> Optional[int]:
-    with db_lock:
-        package = db.get_package(package_name)
-        candidates = [node for node in db.get_nodes(scope=package) if node.name == node_name]
+def get_node_id(db: ProtocolDatabase, package_name, node_name) -> Optional[int]:
+    package = db.get_package(package_name)
+    candidates = [node for node in db.get_nodes(scope=package) if node.name == node_name]
 
-        if len(candidates) < 1:
-            return None
+    if len(candidates) < 1:
+        return None
 
-        return candidates[0].id
+    return candidates[0].id
 
 
 @app.route('/v1/packages')
 @rbac.requires_role(rbac.API_READ_USER_ROLE)
 def list_packages():
-    with db_lock:
+    with db_pool.connection() as db:
         packages = db.get_packages()
 
         return jsonify([dict(name=p.name) for p in packages])
@@ -77,53 +84,77 @@ def list_packages():
 @app.route("/v1/packages/<package_name>/with-relations")
 @rbac.requires_role(rbac.API_READ_USER_ROLE)
 def get_package_with_relations(package_name):
-    with db_lock:
-        package = db.get_package(package_name)
+    db = db_pool.checkout()
 
-        model = protodb.export.export_json2.export_buses_of_package(package, db)
+    try:
+        package = db.get_package(package_name)
+        body = protodb.export.export_json2.stream_buses_of_package(package, db, cache=export_cache)
+    except BaseException:
+        db_pool.checkin(db)
+        raise
 
-    return jsonify(model)
+    # The body is generated while being sent, so the connection is held until the response is closed
+    response = Response(body, mimetype="application/json")
+    response.call_on_close(lambda: db_pool.checkin(db))
+    return response
 
 
 @app.route("/v1/packages/<package_name>/buses/<bus_name>")
 @rbac.requires_role(rbac.API_READ_USER_ROLE)
 def get_bus_dbc(package_name, bus_name):
-    if request.accept_mimetypes[MIMETYPE_DBC]:
-        with db_lock:
-            package = db.get_package(package_name)
-            candidates = [bus for bus in db.get_buses(scope=package) if bus.name == bus_name]
+    if not request.accept_mimetypes[MIMETYPE_DBC]:
+        # 406 Not Acceptable
+        abort(406)
 
-            if len(candidates) < 1:
-                abort(404)
+    db = db_pool.checkout()
 
-            bus_id = candidates[0].id
+    try:
+        package = db.get_package(package_name)
+        candidates = [bus for bus in db.get_buses(scope=package) if bus.name == bus_name]
 
-        # For the moment, just proxy to the existing implementation in PHP + Python.
-        # An intermediate step could be to GET the JSON model and then call convert-to-dbc directly.
-        r = defer_request(f"/buses/{bus_id}/export-dbc")
+        if len(candidates) < 1:
+            abort(404)
 
-        body = r.read()
-        return Response(body, mimetype=MIMETYPE_DBC)
-    else:
-        # 406 Not Acceptable
-        abort(406)
+        body = protodb.export.export_dbc.stream_bus(candidates[0], db, cache=export_cache)
+    except BaseException:
+        db_pool.checkin(db)
+        raise
+
+    # The body is generated while being sent, so the connection is held until the response is closed
+    response = Response(body, mimetype=MIMETYPE_DBC)
+    response.headers["Content-Disposition"] = f'attachment; filename="{package_name}_{bus_name}.dbc"'
+    response.call_on_close(lambda: db_pool.checkin(db))
+    return response
 
 
 @app.route("/v1/packages/<package_name>/nodes/<node_name>/code-tx.zip")
 @rbac.requires_role(rbac.API_READ_USER_ROLE)
 def generate_tx_code_for_node(package_name, node_name):
-    # Resolve node ID
-    node_id = get_node_id(package_name, node_name)
+    with db_pool.connection() as db:
+        package = db.get_package(package_name)
+        candidates = [node for node in db.get_nodes(scope=package) if node.name == node_name]
 
-    if node_id is None:
-        abort(404)
+        if len(candidates) < 1:
+            abort(404)
 
-    # Proxy to the existing implementation in PHP + Python.
-    # An intermediate step could be to GET the JSON model and then call candb-codegen directly.
-    r = defer_request(f"/units/{node_id}/export-tx")
+        try:
+            body = protodb.export.codegen.generate_tx_code(candidates[0], db, cache=export_cache)
+        except protodb.export.codegen.CodeGenerationError as ex:
+            return Response(f"Code generation failed\n{ex}", status=500, mimetype="text/plain")
 
-    body = r.read()
-    return Response(body, mimetype="application/zip")
+    response = Response(body, mimetype="application/zip")
+    response.headers["Content-Disposition"] = f'attachment; filename="ProtoDB_{node_name}.zip"'
+    return response
+
+
+@app.route('/v1/stats')
+@rbac.requires_role(rbac.API_READ_USER_ROLE)
+def get_stats():
+    # Only available with PROTODB_TRACE set, see protodb/trace.py
+    if protodb.trace.global_stats is None:
+        abort(404)
+
+    return jsonify(protodb.trace.global_stats.to_dict())
 
 
 @app.route('/v1/ping')
@@ -135,7 +166,8 @@ def ping():
 @rbac.requires_role(rbac.API_READ_USER_ROLE)
 def get_node_with_relations_jsonv1(package_name, node_name):
     # Resolve node ID
-    node_id = get_node_id(package_name, node_name)
+    with db_pool.connection() as db:
+        node_id = get_node_id(db, package_name, node_name)
 
     if node_id is None:
         abort(404)
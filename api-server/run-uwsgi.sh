@@ -8,6 +8,8 @@ ARGS="--plugin /usr/lib/uwsgi/python_plugin.so \
       --manage-script-name \
       --mount /api=main:app \
       --buffer-size=16384 \
+      --enable-threads \
+      --threads ${PROTODB_API_THREADS:-8} \
       "
 
 if [ "$PROTODB_DEVELOPMENT" = "1" ]
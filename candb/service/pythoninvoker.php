@@ -37,6 +37,7 @@ final class PythonInvokerResult
 final class PythonInvoker
 {
     private const TIMEOUT_SECONDS = 10;
+    private const WORKER_TIMEOUT_SECONDS = 300;
 
     /**
      * @param string[] $command_line
@@ -48,6 +49,17 @@ final class PythonInvoker
     public function call(array $command_line, ?string $workdir = null, ?array $extra_env = null,
                          ?string $stdin = null): PythonInvokerResult
     {
+        // Prefer the long-running worker (see protodb/worker.py), if there is one
+        $worker_socket = getenv('PROTODB_WORKER_SOCKET');
+
+        if ($worker_socket) {
+            $result = $this->worker_call($worker_socket, $command_line, $workdir, $extra_env, $stdin);
+
+            if ($result !== null) {
+                return $result;
+            }
+        }
+
         if ($extra_env === null) {
             $env = null;
         }
@@ -58,6 +70,46 @@ final class PythonInvoker
         return $this->subprocess_call(['python3', ...$command_line], $workdir, $env, $stdin);
     }
 
+    /**
+     * @param string[] $command_line
+     * @param string[]|null $extra_env
+     * @return PythonInvokerResult|null null if the worker is unavailable or does not serve this command
+     */
+    private function worker_call(string $socket_path, array $command_line, ?string $workdir, ?array $extra_env,
+                                 ?string $stdin): ?PythonInvokerResult
+    {
+        $socket = @stream_socket_client('unix://' . $socket_path, $errno, $errstr, self::TIMEOUT_SECONDS);
+
+        if ($socket === false) {
+            return null;
+        }
+
+        stream_set_timeout($socket, self::WORKER_TIMEOUT_SECONDS);
+
+        $request = ['argv' => $command_line, 'env' => $extra_env, 'stdin' => $stdin, 'workdir' => $workdir];
+        fwrite($socket, json_encode($request) . "\n");
+        $line = fgets($socket);
+        $timed_out = stream_get_meta_data($socket)['timed_out'];
+        fclose($socket);
+
+        if ($line === false) {
+            if ($timed_out) {
+                // do not fall back, it would most likely time out again
+                return new PythonInvokerResult(1, '', 'Timed out waiting for protodb worker');
+            }
+
+            return null;
+        }
+
+        $response = json_decode($line, true);
+
+        if (!is_array($response) || isset($response['fallback'])) {
+            return null;
+        }
+
+        return new PythonInvokerResult($response['status'], $response['stdout'], $response['stderr']);
+    }
+
     /** @param string[] $command_line */
     private function subprocess_call(array $command_line, ?string $workdir, ?array $env,
                                      ?string $stdin): PythonInvokerResult
@@ -105,6 +105,7 @@ CREATE TABLE `message` (
   PRIMARY KEY (`id`),
   UNIQUE KEY `node_id_name` (`node_id`,`name`) USING BTREE,
   KEY `node_id` (`node_id`) USING BTREE,
+  KEY `bus_id_can_id` (`bus_id`,`can_id`),
   CONSTRAINT `message_ibfk_1` FOREIGN KEY (`node_id`) REFERENCES `node` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
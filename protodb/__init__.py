@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 from pathlib import Path
 
 from .protocoldatabase import ProtocolDatabase
@@ -23,7 +24,8 @@ from .protocoldatabase import ProtocolDatabase
 
 def connect(conn_string) -> ProtocolDatabase:
     """
-    Open a protocol database connection. For the time being, the connections are to be assumed NOT thread-safe.
+    Open a protocol database connection. For the time being, the connections are to be assumed NOT thread-safe;
+    multi-threaded applications should use a ProtocolDatabasePool (see pool.py).
 
     :param conn_string:
     :return:
@@ -31,10 +33,34 @@ def connect(conn_string) -> ProtocolDatabase:
     if conn_string.startswith('mysql:'):
         from .sqlprotocoldatabase import SqlProtocolDatabase
 
-        return SqlProtocolDatabase(conn_string[6:])
+        db = SqlProtocolDatabase(conn_string[6:])
+    elif conn_string.startswith('sqlite:'):
+        from .sqliteprotocoldatabase import SqliteProtocolDatabase
+
+        db = SqliteProtocolDatabase(conn_string[7:])
     elif Path(conn_string).exists() and conn_string.endswith('.json'):
         from .jsonprotocoldatabase import JsonProtocolDatabase
 
-        return JsonProtocolDatabase.with_path(conn_string)
+        snapshot_dir = os.environ.get('PROTODB_JSON_SNAPSHOT_DIR')
+
+        if os.environ.get('PROTODB_JSON_WATCH'):
+            db = JsonProtocolDatabase.with_path(conn_string, watch=True)
+        elif snapshot_dir:
+            db = JsonProtocolDatabase.with_path(conn_string, snapshot_dir=snapshot_dir)
+        else:
+            db = JsonProtocolDatabase.with_path(conn_string, lazy=bool(os.environ.get('PROTODB_JSON_LAZY')))
+    elif Path(conn_string).is_dir():
+        from .jsonprotocoldatabase import JsonProtocolDatabase
+
+        # one JSON file per package
+        db = JsonProtocolDatabase.with_directory(conn_string, watch=bool(os.environ.get('PROTODB_JSON_WATCH')),
+                                                 workers=int(os.environ.get('PROTODB_JSON_WORKERS') or 1))
     else:
         raise Exception('No clue how to understand connection string ' + conn_string)
+
+    if os.environ.get('PROTODB_TRACE'):
+        from .trace import instrument_from_env
+
+        instrument_from_env(db)
+
+    return db
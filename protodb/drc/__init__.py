@@ -26,11 +26,11 @@ class Check(ABC):
 
 
 class DrcOutput:
-    def __init__(self):
+    def __init__(self, stream=None):
         import csv
-        from sys import stdout
+        import sys
 
-        self.csv = csv.writer(stdout, delimiter=' ')
+        self.csv = csv.writer(stream if stream is not None else sys.stdout, delimiter=' ')
 
     def emit(self, check, severity, message, details) -> None:
         assert severity is None
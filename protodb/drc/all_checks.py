@@ -16,14 +16,16 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import re
+import sys
 import typing
 from abc import abstractmethod
 from datetime import timedelta
 
 from .. import drc
 from ..model import Bus, EnumMessageFieldType, Message, MessageField, Node, Package
-from ..protocoldatabase import InvalidScopeError
+from ..protocoldatabase import InvalidScopeError, ProtocolDatabase
 
 
 class BusCheck(drc.Check):
@@ -154,99 +156,120 @@ __all__ = [
     NameValidityCheck(),
 ]
 
-if __name__ == '__main__':
-    import configargparse
-    import sys
-
-    from . import ProtocolDatabase
-    from .. import connect
-
-
-    def parse_scope(db: ProtocolDatabase, scope_str: str):
-        if scope_str is None:
-            return db
-
-        key, value = scope_str.split('=')
-
-        if key == 'package':
-            return db.get_package(value)
-        elif key == "node" or key == 'unit':
-            return db.get_node(value)
-        else:
-            raise Exception(f'Invalid scope string "{scope_str}"')
-
-    def run_for_all_in(check, set: typing.Iterable, verbose: bool):
-        for object in set:
-            if verbose:
-                print(f'Running check {check} on {object}')
 
-            check(context, object)
+def main(argv: typing.Optional[typing.List[str]] = None, *, env: typing.Optional[typing.Mapping[str, str]] = None,
+         stdin: typing.Optional[typing.TextIO] = None, stdout: typing.Optional[typing.TextIO] = None,
+         connect: typing.Optional[typing.Callable[[str], ProtocolDatabase]] = None) -> None:
+    """ Entry point, see protodb.worker for the parameters """
+    import configargparse
 
-    def get_buses_in_scope(db, scope) -> typing.Iterable[Bus]:
-        if isinstance(scope, Bus):
-            return [scope]
-        elif isinstance(scope, Package):
-            return db.get_buses(scope=scope)
-        else:
-            return []
+    if stdout is None:
+        stdout = sys.stdout
 
-    def get_nodes_in_scope(db, scope) -> typing.Iterable[Node]:
-        if isinstance(scope, Node):
-            return [scope]
-        else:
-            try:
-                return db.get_nodes(scope=scope)
-            except InvalidScopeError:
-                return []
-
-    def get_messages_in_scope(db, scope) -> typing.Iterable[Message]:
-        if isinstance(scope, Message):
-            return [scope]
-        else:
-            try:
-                return db.get_messages(scope=scope)
-            except InvalidScopeError:
-                return []
-
-    def get_message_fields_in_scope(db, scope) -> typing.Iterable[MessageField]:
-        if isinstance(scope, MessageField):
-            return [scope]
-        else:
-            try:
-                return db.get_message_fields(scope=scope)
-            except InvalidScopeError:
-                return []
+    if connect is None:
+        from .. import connect
 
     parser = configargparse.ArgParser()
     parser.add_argument('--db', dest='conn_string', env_var='PROTODB_CONN_STRING', required=True)
     parser.add_argument('--scope')
     parser.add_argument('-v', dest='verbose', action='store_true')
-    args = parser.parse_args()
+    args = parser.parse_args(argv, env_vars=env if env is not None else os.environ)
 
     db = connect(args.conn_string)
-    scope = parse_scope(db, args.scope)
+    scope = _parse_scope(db, args.scope)
 
-    output = drc.DrcOutput()
+    if isinstance(scope, Package):
+        db.load_package_snapshot(scope)
+    elif isinstance(scope, Node):
+        db.load_package_snapshot(scope.package)
+    else:
+        db.load_all()
+
+    output = drc.DrcOutput(stdout)
     context = drc.DrcContext(db, output)
 
+    def run_for_all_in(check, set: typing.Iterable):
+        for object in set:
+            if args.verbose:
+                print(f'Running check {check} on {object}', file=stdout)
+
+            check(context, object)
+
     for check in __all__:
         handled = False
 
         if isinstance(check, BusCheck):
-            run_for_all_in(check, get_buses_in_scope(db, scope), args.verbose)
+            run_for_all_in(check, _get_buses_in_scope(db, scope))
             handled = True
 
         if isinstance(check, MessageCheck):
-            run_for_all_in(check, get_messages_in_scope(db, scope), args.verbose)
+            run_for_all_in(check, _get_messages_in_scope(db, scope))
             handled = True
 
         if isinstance(check, MessageFieldCheck):
-            run_for_all_in(check, get_message_fields_in_scope(db, scope), args.verbose)
+            run_for_all_in(check, _get_message_fields_in_scope(db, scope))
             handled = True
 
         if isinstance(check, NodeCheck) and hasattr(scope, 'get_nodes'):
-            run_for_all_in(check, get_nodes_in_scope(db, scope), args.verbose)
+            run_for_all_in(check, _get_nodes_in_scope(db, scope))
             handled = True
 
         if not handled:
             print(f'warning: Don\'t know how to apply check {check}', file=sys.stderr)
+
+
+def _parse_scope(db: ProtocolDatabase, scope_str: str):
+    if scope_str is None:
+        return db
+
+    key, value = scope_str.split('=')
+
+    if key == 'package':
+        return db.get_package(value)
+    elif key == "node" or key == 'unit':
+        return db.get_node(value)
+    else:
+        raise Exception(f'Invalid scope string "{scope_str}"')
+
+
+def _get_buses_in_scope(db, scope) -> typing.Iterable[Bus]:
+    if isinstance(scope, Bus):
+        return [scope]
+    elif isinstance(scope, Package):
+        return db.get_buses(scope=scope)
+    else:
+        return []
+
+
+def _get_nodes_in_scope(db, scope) -> typing.Iterable[Node]:
+    if isinstance(scope, Node):
+        return [scope]
+    else:
+        try:
+            return db.get_nodes(scope=scope)
+        except InvalidScopeError:
+            return []
+
+
+def _get_messages_in_scope(db, scope) -> typing.Iterable[Message]:
+    if isinstance(scope, Message):
+        return [scope]
+    else:
+        try:
+            return db.get_messages(scope=scope)
+        except InvalidScopeError:
+            return []
+
+
+def _get_message_fields_in_scope(db, scope) -> typing.Iterable[MessageField]:
+    if isinstance(scope, MessageField):
+        return [scope]
+    else:
+        try:
+            return db.get_message_fields(scope=scope)
+        except InvalidScopeError:
+            return []
+
+
+if __name__ == '__main__':
+    main()
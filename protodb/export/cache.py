@@ -0,0 +1,203 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+import hashlib
+import os
+from pathlib import Path
+import threading
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+from .. import ProtocolDatabase
+
+
+class ExportCache:
+    """
+    Serialized results of exports, keyed by what was exported and the version token of the database
+    (see ProtocolDatabase.get_version_token). Nothing is ever invalidated explicitly: once the database changes,
+    its token changes too and the old results are simply no longer asked for, until they are evicted.
+
+    The most recently used results are kept in memory. Optionally, they are also stored in a directory, which can be
+    shared by several processes; its size is kept under a limit by deleting the least recently used files.
+
+    Safe to use from multiple threads. Concurrent requests for the same missing result are all rendered.
+    """
+
+    directory: Optional[Path]
+    max_directory_size: int
+    max_memory_size: int
+    namespace: str
+
+    _lock: threading.Lock
+    _memory: 'OrderedDict[Tuple, bytes]'
+    _memory_size: int
+
+    def __init__(self, max_memory_size: int = 64 * 1024 * 1024, directory=None,
+                 max_directory_size: int = 1024 * 1024 * 1024, namespace: str = ''):
+        """
+        :param max_memory_size: in bytes
+        :param directory: if specified, results are also stored there
+        :param max_directory_size: in bytes
+        :param namespace: distinguishes databases sharing the directory (e.g. the connection string), because
+                          the version tokens of unrelated databases may coincide
+        """
+        self.directory = Path(directory) if directory is not None else None
+        self.max_directory_size = max_directory_size
+        self.max_memory_size = max_memory_size
+        self.namespace = namespace
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def get_or_render(self, key: Tuple[str, ...], db: ProtocolDatabase, render: Callable[[], bytes]) -> bytes:
+        """
+        :param key: identifies the export, e.g. ('json2', package name)
+        :param render: produces the result from the current content of `db`
+        """
+        version_token = db.get_version_token()
+
+        if version_token is None:
+            return render()
+
+        full_key = (*key, version_token)
+        data = self._lookup(full_key)
+
+        if data is None:
+            data = render()
+            self._save(full_key, data)
+
+        return data
+
+    def stream(self, key: Tuple[str, ...], db: ProtocolDatabase, render: Callable[[], Iterable[bytes]]
+               ) -> Iterator[bytes]:
+        """
+        Like get_or_render, but pass the result on in chunks while it is being rendered.
+        It is saved only once the iteration is complete.
+        """
+        version_token = db.get_version_token()
+
+        if version_token is None:
+            yield from render()
+            return
+
+        full_key = (*key, version_token)
+        data = self._lookup(full_key)
+
+        if data is not None:
+            yield data
+            return
+
+        chunks = []
+
+        for chunk in render():
+            chunks.append(chunk)
+            yield chunk
+
+        self._save(full_key, b''.join(chunks))
+
+    def _file_path(self, full_key: Tuple[str, ...]) -> Path:
+        name = hashlib.sha256(repr((self.namespace, *full_key)).encode()).hexdigest()
+        return self.directory / f'{name}.bin'
+
+    def _lookup(self, full_key: Tuple[str, ...]) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(full_key)
+
+            if data is not None:
+                self._memory.move_to_end(full_key)
+                return data
+
+        if self.directory is not None:
+            data = self._load(full_key)
+
+            if data is not None:
+                self._remember(full_key, data)
+
+        return data
+
+    def _load(self, full_key: Tuple[str, ...]) -> Optional[bytes]:
+        path = self._file_path(full_key)
+
+        try:
+            data = path.read_bytes()
+            # the modification time doubles as time of last use, see _evict_files
+            os.utime(path)
+        except FileNotFoundError:
+            # never stored, or evicted by another process in the meantime
+            return None
+
+        return data
+
+    def _remember(self, full_key: Tuple[str, ...], data: bytes) -> None:
+        if len(data) > self.max_memory_size:
+            return
+
+        with self._lock:
+            if full_key in self._memory:
+                return
+
+            self._memory[full_key] = data
+            self._memory_size += len(data)
+
+            while self._memory_size > self.max_memory_size:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _save(self, full_key: Tuple[str, ...], data: bytes) -> None:
+        if self.directory is not None:
+            self._store(full_key, data)
+
+        self._remember(full_key, data)
+
+    def _store(self, full_key: Tuple[str, ...], data: bytes) -> None:
+        path = self._file_path(full_key)
+
+        # write to a temporary file first, so that readers never see a partial result
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        self._evict_files()
+
+    def _evict_files(self) -> None:
+        files = []
+
+        for path in self.directory.glob('*.bin'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            files.append((stat.st_mtime_ns, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in files)
+
+        for _, size, path in sorted(files):
+            if total_size <= self.max_directory_size:
+                break
+
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+            total_size -= size
@@ -0,0 +1,206 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generation of C code for a node, packed in a zip archive.
+
+The code is generated by candb-codegen, which is not part of this repository; it is expected in PROTODB_CODEGEN_DIR
+(by default, candb-codegen next to the protodb package). The generator reads the JSON 1.0 model of the node, which
+used to be produced by the PHP web UI and is derived here from the JSON2 models of the messages.
+"""
+
+import io
+import json
+import os
+from pathlib import Path
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Dict, Optional
+import zipfile
+
+from .. import ProtocolDatabase
+from .cache import ExportCache
+from .export_json2 import _get_model_for_message, _get_model_for_node
+from ..model import CodeGenerationOptions, Message, Node, NodeMessageLinkType
+
+CODEGEN_DIR = Path(os.getenv('PROTODB_CODEGEN_DIR') or Path(__file__).parents[2] / 'candb-codegen')
+
+SUPPORTED_CODE_MODEL_VERSIONS = (1, 2)
+
+UNDEFINED_BUS_NAME = 'UNDEFINED'
+
+# Fixed timestamp of the archived files, so that the same code always gives the same archive
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class CodeGenerationError(Exception):
+    pass
+
+
+def _use_absolute_names(options: CodeGenerationOptions) -> bool:
+    return bool(options.advanced_options and
+                re.search(r'(^|\s)-fcodegen-unit-versions($|\s)', options.advanced_options))
+
+
+def _get_unit_name(node: Node, absolute_names: bool) -> str:
+    return f'{node.package.name}_{node.name}' if absolute_names else node.name
+
+
+def _get_json_v1_model_for_message(message: Message, db: ProtocolDatabase, absolute_names: bool):
+    message_model = _get_model_for_message(message, db, refs=())
+
+    fields = []
+
+    for field, field_model in zip(message.fields, message_model['fields']):
+        if absolute_names and field_model['type'].startswith('enum '):
+            field_model['type'] = f'enum {_get_unit_name(field.type.node, True)}_{field.type.enum}'
+
+        fields.append(dict(
+            name=field_model['name'],
+            comments=[field_model['description']],
+            type=field_model['type'],
+            bits=field_model['bits'],
+            count=field_model['count'],
+            start_bit=field_model['start_bit'] or 0,
+            unit=field_model['unit'],
+            factor=field_model['factor'],
+            factor_num=field_model['factor_num'],
+            offset=field_model['offset'],
+            min=field_model['min'],
+            max=field_model['max'],
+        ))
+
+    return dict(
+        bus=message.bus.name if message.bus is not None else UNDEFINED_BUS_NAME,
+        id=message_model['id'],
+        frame_type=message_model['frame_type'],
+        name=message_model['name'],
+        comments=(message_model['description'] or '').split('\n'),
+        sentBy=[],
+        receivedBy=[],
+        timeout=message_model['timeout'],
+        tx_period=message_model['tx_period'],
+        fields=fields,
+        length=message_model['length'],
+    )
+
+
+def get_json_v1_model_for_node(node: Node, db: ProtocolDatabase, absolute_names: bool = False):
+    """
+    The node and the owners of all messages it sends or receives, each with its messages relevant to the node
+    """
+    unit_name = _get_unit_name(node, absolute_names)
+
+    messages_by_owner: Dict[Node, Dict[Message, dict]] = {node: {}}
+
+    for link in db.get_node_message_links(node=node):
+        messages = messages_by_owner.setdefault(link.message.unit, {})
+
+        if link.message not in messages:
+            messages[link.message] = _get_json_v1_model_for_message(link.message, db, absolute_names)
+
+        if link.link_type == NodeMessageLinkType.SENDER:
+            messages[link.message]['sentBy'].append(unit_name)
+        else:
+            messages[link.message]['receivedBy'].append(unit_name)
+
+    groups = []
+
+    for owner, messages in messages_by_owner.items():
+        buses = [bus_link.bus.name for bus_link in db.get_node_bus_links(owner)]
+        buses.append(UNDEFINED_BUS_NAME)
+
+        groups.append(dict(
+            name=_get_unit_name(owner, absolute_names),
+            buses=buses,
+            enum_types=_get_model_for_node(owner, db)['enum_types'],
+            messages=sorted(messages.values(), key=lambda message: message['id'] or 0),
+        ))
+
+    return sorted(groups, key=lambda group: group['name'])
+
+
+def _zip_directory(directory: Path) -> bytes:
+    buffer = io.BytesIO()
+
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zip:
+        for path in sorted(directory.rglob('*')):
+            if path.is_dir():
+                continue
+
+            info = zipfile.ZipInfo(path.relative_to(directory).as_posix(), date_time=ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = (path.stat().st_mode & 0o777) << 16
+            zip.writestr(info, path.read_bytes())
+
+    return buffer.getvalue()
+
+
+def _generate_tx_code(node: Node, db: ProtocolDatabase, options: CodeGenerationOptions, codegen_dir: Path) -> bytes:
+    if options.code_model_version not in SUPPORTED_CODE_MODEL_VERSIONS:
+        raise CodeGenerationError('Unsupported code model version')
+
+    absolute_names = _use_absolute_names(options)
+
+    db.load_package_snapshot(node.package)
+    model = get_json_v1_model_for_node(node, db, absolute_names=absolute_names)
+
+    with tempfile.TemporaryDirectory(prefix='protodb-codegen-') as tmp_dir:
+        model_path = Path(tmp_dir) / 'model.json'
+        output_dir = Path(tmp_dir) / 'output'
+
+        model_path.write_text(json.dumps(model))
+        output_dir.mkdir()
+
+        result = subprocess.run([sys.executable, str(codegen_dir / 'candb-generate-c.py'), str(model_path),
+                                 '-u', _get_unit_name(node, absolute_names),
+                                 '-O', str(output_dir),
+                                 '-x', str(options.code_model_version)],
+                                cwd=codegen_dir.parent, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+        if result.returncode != 0:
+            raise CodeGenerationError(result.stderr)
+
+        if options.code_model_version == 2:
+            # Code Model v2: add the Tx library
+            shutil.copytree(codegen_dir / 'tx', output_dir, dirs_exist_ok=True)
+
+        return _zip_directory(output_dir)
+
+
+def generate_tx_code(node: Node, db: ProtocolDatabase, cache: Optional[ExportCache] = None,
+                     codegen_dir: Path = CODEGEN_DIR) -> bytes:
+    """
+    :return: zip archive of the code
+    :param cache: if specified, reuse the archive for as long as the database does not change
+    :raises CodeGenerationError: with the error output of the generator
+    """
+    # the options are not covered by the version token of SQL databases, so they are a part of the key
+    options = db.get_code_generation_options(node)
+
+    def render() -> bytes:
+        return _generate_tx_code(node, db, options, Path(codegen_dir))
+
+    if cache is None:
+        return render()
+
+    return cache.get_or_render(('code-tx', node.fully_qualified_name, str(options.code_model_version),
+                                options.advanced_options or ''), db, render)
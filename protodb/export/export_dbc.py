@@ -0,0 +1,327 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Export of a single bus as a Vector CAN database (DBC).
+
+The messages are selected the same way as for JSON2 (see ExportSet.add_bus) and the signals are placed according to
+protodb.layout, in Intel (little-endian) byte order. Elements of arrays become separate signals, <name>_<index>.
+An element split into non-adjacent pieces cannot be described by one signal; each piece is exported as a raw signal,
+<name>_part<index>, instead.
+
+Names are made into identifiers by replacing invalid characters. Where the identifiers of nodes clash, they are prefixed
+by the package name; messages are prefixed by the node name in the same way. A name that is still taken (including
+signal names) gets a numeric suffix, <name>_2 etc.
+"""
+
+from collections import Counter
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
+
+from .. import ProtocolDatabase
+from .cache import ExportCache
+from .export_json2 import ExportSet, _encode_chunks, _try_convert_factor_to_float
+from ..layout import BitRange, get_message_layout
+from ..model import (
+    Bus,
+    EnumMessageFieldType,
+    FrameType,
+    Message,
+    MessageField,
+    Node,
+    NodeMessageLink,
+    NodeMessageLinkType,
+    MESSAGE_FIELD_TYPE_FLOAT,
+    MESSAGE_FIELD_TYPE_INT,
+    MESSAGE_FIELD_TYPE_RESERVED,
+)
+
+T = TypeVar("T")
+
+# Placeholder for a missing node, as understood by Vector tools
+NO_NODE = "Vector__XXX"
+
+CAN_ID_EXTENDED_FLAG = 0x80000000
+
+NEW_SYMBOLS = [
+    "NS_DESC_", "CM_", "BA_DEF_", "BA_", "VAL_", "CAT_DEF_", "CAT_", "FILTER", "BA_DEF_DEF_", "EV_DATA_",
+    "ENVVAR_DATA_", "SGTYPE_", "SGTYPE_VAL_", "BA_DEF_SGTYPE_", "BA_SGTYPE_", "SIG_TYPE_REF_", "VAL_TABLE_",
+    "SIG_GROUP_", "SIG_VALTYPE_", "SIGTYPE_VALTYPE_", "BO_TX_BU_", "BA_DEF_REL_", "BA_REL_", "BA_DEF_DEF_REL_",
+    "BU_SG_REL_", "BU_EV_REL_", "BU_BO_REL_", "SG_MUL_VAL_",
+]
+
+
+def _identifier(name: str) -> str:
+    identifier = re.sub(r"[^A-Za-z0-9_]", "_", name)
+
+    if not identifier or identifier[0].isdigit():
+        identifier = "_" + identifier
+
+    return identifier
+
+
+def _unique(name: str, used: Set[str]) -> str:
+    unique = name
+    suffix = 2
+
+    while unique in used:
+        unique = f"{name}_{suffix}"
+        suffix += 1
+
+    used.add(unique)
+    return unique
+
+
+def _assign_identifiers(entities: Iterable[T], get_name: Callable[[T], str],
+                        get_qualified_name: Callable[[T], str]) -> Dict[T, str]:
+    """
+    :param entities: in a deterministic order
+    :return: a distinct identifier for each entity; the qualified name is used for entities whose names clash
+    """
+    entities = list(entities)
+    counts = Counter(_identifier(get_name(entity)) for entity in entities)
+
+    # names without a clash are kept as they are, even if a qualified name comes out the same
+    used = {name for name, count in counts.items() if count == 1}
+    identifiers = {}
+
+    for entity in entities:
+        name = _identifier(get_name(entity))
+
+        if counts[name] == 1:
+            identifiers[entity] = name
+        else:
+            identifiers[entity] = _unique(_identifier(get_qualified_name(entity)), used)
+
+    return identifiers
+
+
+def _string(text: Optional[str]) -> str:
+    if not text:
+        return '""'
+
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _number(value: float) -> str:
+    return f"{value:.15g}"
+
+
+def _try_convert_to_float(value_str: Optional[str]) -> Optional[float]:
+    if not value_str:
+        return None
+
+    try:
+        return float(value_str)
+    except ValueError:
+        return None
+
+
+def _is_contiguous(pieces: Tuple[BitRange, ...]) -> bool:
+    return all(piece.byte * 8 + piece.shift == previous.byte * 8 + previous.shift + previous.bits
+               for previous, piece in zip(pieces, pieces[1:]))
+
+
+class _DbcWriter:
+    """
+    CM_, BA_ and VAL_ entries must follow all messages, so they are collected while the messages are written
+    """
+
+    comments: List[str]
+    attributes: List[str]
+    value_tables: List[str]
+    value_types: List[str]
+
+    _db: ProtocolDatabase
+    _enum_items: Dict[Tuple[Node, str], List[Tuple[int, str]]]
+    _node_names: Dict[Node, str]
+
+    def __init__(self, db: ProtocolDatabase, node_names: Dict[Node, str]):
+        """
+        :param node_names: identifiers of all nodes owning, sending or receiving the messages
+        """
+        self.comments = []
+        self.attributes = []
+        self.value_tables = []
+        self.value_types = []
+
+        self._db = db
+        self._enum_items = {}
+        self._node_names = node_names
+
+    def iter_message(self, message: Message, name: str, refs: Iterable[NodeMessageLink]) -> Iterator[str]:
+        layout = get_message_layout(message)
+
+        dbc_id = message.can_id | CAN_ID_EXTENDED_FLAG if message.frame_type == FrameType.CAN_EXT else message.can_id
+
+        senders = sorted(self._node_names[ref.node] for ref in refs if ref.link_type == NodeMessageLinkType.SENDER)
+        receivers = sorted(self._node_names[ref.node] for ref in refs
+                           if ref.link_type == NodeMessageLinkType.RECEIVER)
+
+        sender = senders[0] if senders else self._node_names[message.unit]
+        receivers_str = ",".join(receivers) if receivers else NO_NODE
+
+        yield f"BO_ {dbc_id} {name}: {layout.num_bytes} {sender}\n"
+
+        signal_names: Set[str] = set()
+
+        for field, field_layout in zip(message.fields, layout.fields):
+            if field.type is MESSAGE_FIELD_TYPE_RESERVED or not field.name:
+                continue
+
+            for i, pieces in enumerate(field_layout.elements):
+                element_name = _identifier(field.name) if field.array_length == 1 else f"{_identifier(field.name)}_{i}"
+
+                if _is_contiguous(pieces):
+                    start_bit = pieces[0].byte * 8 + pieces[0].shift
+                    yield self._signal(dbc_id, _unique(element_name, signal_names), start_bit, field, receivers_str)
+                else:
+                    bit = 0
+
+                    for j, piece in enumerate(pieces):
+                        piece_name = _unique(f"{element_name}_part{j}", signal_names)
+                        yield (f' SG_ {piece_name} : {piece.byte * 8 + piece.shift}|{piece.bits}@1+ (1,0) [0|0] "" '
+                               f'{receivers_str}\n')
+                        self.comments.append(f"CM_ SG_ {dbc_id} {piece_name} "
+                                             f"{_string(f'Bits {bit}-{bit + piece.bits - 1} of {element_name}')};\n")
+                        bit += piece.bits
+
+        yield "\n"
+
+        if message.description:
+            self.comments.append(f"CM_ BO_ {dbc_id} {_string(message.description)};\n")
+
+        if message.tx_period is not None:
+            cycle_time = int(message.tx_period.total_seconds() * 1000)
+            self.attributes.append(f'BA_ "GenMsgCycleTime" BO_ {dbc_id} {cycle_time};\n')
+
+    def _signal(self, dbc_id: int, name: str, start_bit: int, field: MessageField, receivers_str: str) -> str:
+        sign = "-" if field.type is MESSAGE_FIELD_TYPE_INT else "+"
+
+        factor = _try_convert_factor_to_float(field.factor) if field.factor else None
+        offset = _try_convert_to_float(field.offset)
+        min = _try_convert_to_float(field.min)
+        max = _try_convert_to_float(field.max)
+
+        if field.description:
+            self.comments.append(f"CM_ SG_ {dbc_id} {name} {_string(field.description)};\n")
+
+        if field.type is MESSAGE_FIELD_TYPE_FLOAT and field.size_in_bits in (32, 64):
+            self.value_types.append(f"SIG_VALTYPE_ {dbc_id} {name} : {1 if field.size_in_bits == 32 else 2};\n")
+
+        if isinstance(field.type, EnumMessageFieldType):
+            items = self._get_enum_items(field.type)
+
+            if items:
+                values = " ".join(f"{value} {_string(item_name)}" for value, item_name in items)
+                self.value_tables.append(f"VAL_ {dbc_id} {name} {values} ;\n")
+
+        return (f" SG_ {name} : {start_bit}|{field.size_in_bits}@1{sign} "
+                f"({_number(factor if factor is not None else 1)},{_number(offset if offset is not None else 0)}) "
+                f"[{_number(min if min is not None else 0)}|{_number(max if max is not None else 0)}] "
+                f"{_string(field.unit)} {receivers_str}\n")
+
+    def _get_enum_items(self, type: EnumMessageFieldType) -> List[Tuple[int, str]]:
+        key = (type.node, type.enum)
+
+        if key not in self._enum_items:
+            for enum_type in self._db.get_enum_types(scope=type.node):
+                items = sorted((item.value, item.name) for item in enum_type.items)
+                self._enum_items[(type.node, enum_type.name)] = items
+
+            self._enum_items.setdefault(key, [])
+
+        return self._enum_items[key]
+
+
+def _iter_render_bus(bus: Bus, db: ProtocolDatabase) -> Iterator[str]:
+    db.load_package_snapshot(bus.package)
+
+    export_set = ExportSet(db)
+    export_set.add_bus(bus)
+
+    # fetch all at once, rather than one query per message
+    node_links_by_message = db.get_node_message_links_for(export_set.messages)
+
+    # messages without an ID cannot be represented
+    messages = sorted((message for message in export_set.messages if message.can_id is not None),
+                      key=lambda message: (message.unit.fully_qualified_name, message.name))
+
+    # senders and receivers can be outside of the export set (e.g. in other packages), but they must be declared, too
+    nodes = set(export_set.units)
+    nodes.update(message.unit for message in messages)
+    nodes.update(link.node for message in messages for link in node_links_by_message[message])
+    nodes_sorted = sorted(nodes, key=lambda node: node.fully_qualified_name)
+
+    node_names = _assign_identifiers(nodes_sorted, lambda node: node.name,
+                                     lambda node: f"{node.package.name}_{node.name}")
+    message_names = _assign_identifiers(messages, lambda message: message.name,
+                                        lambda message: f"{message.unit.name}_{message.name}")
+
+    yield 'VERSION ""\n\n\n'
+    yield "NS_ :\n" + "".join(f"\t{symbol}\n" for symbol in NEW_SYMBOLS) + "\n"
+    yield "BS_:\n\n"
+    yield "BU_: " + " ".join(sorted(node_names.values())) + "\n\n\n"
+
+    writer = _DbcWriter(db, node_names)
+
+    for message in messages:
+        yield from writer.iter_message(message, message_names[message], node_links_by_message[message])
+
+    yield "\n"
+
+    for node in nodes_sorted:
+        if node.description:
+            yield f"CM_ BU_ {node_names[node]} {_string(node.description)};\n"
+
+    yield from writer.comments
+
+    yield 'BA_DEF_  "BusType" STRING ;\n'
+    yield 'BA_DEF_  "Baudrate" INT 0 1000000000;\n'
+    yield 'BA_DEF_ BO_  "GenMsgCycleTime" INT 0 65535;\n'
+    yield 'BA_DEF_DEF_  "BusType" "CAN";\n'
+    yield 'BA_DEF_DEF_  "Baudrate" 0;\n'
+    yield 'BA_DEF_DEF_  "GenMsgCycleTime" 0;\n'
+    yield 'BA_ "BusType" "CAN";\n'
+
+    if bus.bitrate is not None:
+        yield f'BA_ "Baudrate" {bus.bitrate};\n'
+
+    yield from writer.attributes
+    yield from writer.value_tables
+    yield from writer.value_types
+
+
+def render_bus(bus: Bus, db: ProtocolDatabase, cache: Optional[ExportCache] = None) -> bytes:
+    """
+    :param cache: if specified, reuse the result for as long as the database does not change
+    """
+    return b"".join(stream_bus(bus, db, cache=cache))
+
+
+def stream_bus(bus: Bus, db: ProtocolDatabase, cache: Optional[ExportCache] = None) -> Iterator[bytes]:
+    """
+    Like render_bus, but produce the output in chunks while the bus is being exported
+    """
+    def render() -> Iterator[bytes]:
+        return _encode_chunks(_iter_render_bus(bus, db))
+
+    if cache is None:
+        return render()
+
+    return cache.stream(('dbc', bus.package.name, bus.name), db, render)
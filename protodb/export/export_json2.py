@@ -16,15 +16,25 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
 
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+from pathlib import Path
 import re
-from typing import Set
+import sys
+import threading
+from typing import Callable, Iterable, Iterator, List, Mapping, Optional, Set, TextIO, Tuple
 
 from .. import ProtocolDatabase
+from .cache import ExportCache
+from ..layout import get_message_layout
 from ..model import (
     Bus,
     EnumMessageFieldType,
     Message,
     Node,
+    NodeMessageLink,
     NodeMessageLinkType,
     Package,
     MESSAGE_FIELD_TYPE_RESERVED,
@@ -93,76 +103,6 @@ class ExportSet:
         self.units.add(unit)
 
 
-def _compute_message_layout(self):
-    """
-    Returns (field_ranges, num_bytes)
-    Awful, awful interface
-    Also doesn't belong here.
-    """
-
-    usage_map = []
-    field_ranges = []
-
-    for field in self.fields:
-        ranges = []
-        start_bit = None
-
-        # if isinstance(field.type, ArrayMessageFieldType):
-        #     type = field.type.element_type
-        #     array_length = field.type.length
-        # else:
-        #     type = field.type
-        #     array_length = 1
-
-        for i in range(field.array_length):
-            b = field.size_in_bits
-            ranges.append([])
-
-            if b % 8 == 0:
-                # multiple of 8 bits - always append to the end
-
-                if start_bit is None:
-                    start_bit = len(usage_map) * 8
-
-                for byte in range(b // 8):
-                    ranges[i].append((len(usage_map), 0, 8))
-                    usage_map.append(8)
-            else:
-                # try to find a non-full byte first
-                for byte, used_bits in enumerate(usage_map):
-                    if used_bits == 8:
-                        continue
-
-                    if start_bit is None:
-                        start_bit = byte * 8 + used_bits
-
-                    # use as many bits as possible in this byte
-                    use = min(b, 8 - used_bits)
-
-                    ranges[i].append((byte, used_bits, use))
-                    b -= use
-                    usage_map[byte] += use
-
-                    if b == 0:
-                        break
-
-                if start_bit is None:
-                    start_bit = len(usage_map) * 8
-
-                # any bits left over? - put them at the end
-                if b != 0:
-                    while b > 0:
-                        use = 8 if b > 8 else b
-                        ranges[i].append((len(usage_map), 0, use))
-                        usage_map.append(use)
-                        b -= use
-
-        field_ranges.append((start_bit, ranges))
-
-    num_bytes = len(usage_map)
-    return field_ranges, num_bytes
-
-
 def _try_convert_factor_to_float(factor_str):
     try:
         # Opportunistically try to convert it directly
@@ -181,15 +121,14 @@ def _try_convert_factor_to_float(factor_str):
     return None
 
 
-def _get_model_for_message(message: Message, db: ProtocolDatabase):
+def _get_model_for_message(message: Message, db: ProtocolDatabase, refs: Iterable[NodeMessageLink]):
     if message.bus is not None:
         bus_name = message.bus.fully_qualified_name
     else:
         bus_name = None
 
-    layout, num_bytes = _compute_message_layout(message)
+    layout = get_message_layout(message)
 
-    refs = db.get_node_message_links(message=message)
     sent_by = sorted(ref.node.fully_qualified_name for ref in refs if ref.link_type == NodeMessageLinkType.SENDER)
     received_by = sorted(ref.node.fully_qualified_name for ref in refs if ref.link_type == NodeMessageLinkType.RECEIVER)
 
@@ -202,14 +141,14 @@ def _get_model_for_message(message: Message, db: ProtocolDatabase):
         # FIXME: this must be handled at model level, not here!
         # id=message.can_id if message.can_id_type != Message::CAN_ID_TYPE_UNDEF else None,
         id=message.can_id,
-        length=num_bytes,
+        length=layout.num_bytes,
         received_by=received_by,
         sent_by=sent_by,
         timeout=int(message.timeout.total_seconds() * 1000) if message.timeout is not None else None,
         tx_period=int(message.tx_period.total_seconds() * 1000) if message.tx_period is not None else None,
     )
 
-    for field, field_layout in zip(message.fields, layout):
+    for field, field_layout in zip(message.fields, layout.fields):
         if field.type is MESSAGE_FIELD_TYPE_RESERVED:
             name = None
             type = repr(field.type)
@@ -231,8 +170,6 @@ def _get_model_for_message(message: Message, db: ProtocolDatabase):
         else:
             factor_num = None
 
-        start_bit, ranges = field_layout
-
         if FIXUP_EMPTY_STRINGS_TO_NULL:
             unit = field.unit if field.unit else None
             factor = field.factor if field.factor else None
@@ -252,7 +189,7 @@ def _get_model_for_message(message: Message, db: ProtocolDatabase):
             type=type,
             bits=field.size_in_bits,
             count=field.array_length,
-            start_bit=start_bit,  # how can there even be a single value describing an array of fields?
+            start_bit=field_layout.start_bit,  # how can there even be a single value describing an array of fields?
             unit=unit,
             factor=factor,
             factor_num=factor_num,
@@ -266,112 +203,366 @@ def _get_model_for_message(message: Message, db: ProtocolDatabase):
     return message_model
 
 
-def _render_set(set: ExportSet, db: ProtocolDatabase):
-    model = dict(
-        version=2,
-        packages=[],
+def _get_model_for_node(node: Node, db: ProtocolDatabase):
+    """
+    :return: model of the node, with the messages left empty
+    """
+    # assert node.description != ""  # should be None instead
+    node_model = dict(
+        name=node.name,
+        description=node.description,
+        bus_links=[],
+        enum_types=[],
+        messages=[],
     )
 
-    for package in sorted(set.packages, key=lambda package: package.name):
-        package_model = dict(
-            name=package.name,
-            buses=[],
-            units=[],
+    for bus_link in db.get_node_bus_links(node):
+        bus_link_model = dict(
+            bus=bus_link.bus.fully_qualified_name,
+            note=bus_link.note if bus_link.note else None,
         )
 
-        sorted_buses = sorted(db.get_buses(scope=package), key=lambda bus: bus.name)
+        node_model["bus_links"].append(bus_link_model)
+
+    sorted_enum_types = sorted(db.get_enum_types(scope=node), key=lambda enum_type: enum_type.name)
+
+    for enum_type in sorted_enum_types:
+        # TODO: why not check if is in set?
+
+        assert enum_type.description != ""  # should be None instead
+        enum_type_model = dict(
+            name=enum_type.name,
+            description=enum_type.description,
+            items=[],
+        )
+
+        for item in sorted(enum_type.items, key=lambda item: item.value):
+            enum_item_model = dict(
+                name=item.name,
+                value=item.value,
+                description=item.description if item.description else None,
+            )
+            enum_type_model["items"].append(enum_item_model)
+
+        node_model["enum_types"].append(enum_type_model)
+
+    return node_model
+
 
-        for bus in sorted_buses:
-            bus_model = dict(dbc_id=bus.dbc_id, name=bus.name, bitrate=bus.bitrate)
+def _get_model_for_package(package: Package, db: ProtocolDatabase):
+    """
+    :return: model of the package, with the units left empty
+    """
+    package_model = dict(
+        name=package.name,
+        buses=[],
+        units=[],
+    )
+
+    sorted_buses = sorted(db.get_buses(scope=package), key=lambda bus: bus.name)
+
+    for bus in sorted_buses:
+        bus_model = dict(dbc_id=bus.dbc_id, name=bus.name, bitrate=bus.bitrate)
+
+        package_model["buses"].append(bus_model)
+
+    return package_model
+
+
+def _iter_set(set: ExportSet, db: ProtocolDatabase):
+    """
+    Walk the set in the canonical order of the model
+
+    :return: iterator of (package model, iterator of (node model, iterator of message models)), with the nested lists
+             left empty for the caller to fill in
+    """
+    # fetch all at once, rather than one query per message
+    node_links_by_message = db.get_node_message_links_for(set.messages)
 
-            package_model["buses"].append(bus_model)
+    def iter_messages(node: Node):
+        sorted_messages = sorted(db.get_messages(scope=node), key=lambda message: message.name)
+
+        for message in sorted_messages:
+            if message not in set.messages:
+                continue
 
+            yield _get_model_for_message(message, db, node_links_by_message[message])
+
+    def iter_nodes(package: Package):
         sorted_nodes = sorted(db.get_nodes(scope=package), key=lambda node: node.name)
 
         for node in sorted_nodes:
             if node not in set.units:  # what a mess
                 continue
 
-            # assert node.description != ""  # should be None instead
-            node_model = dict(
-                name=node.name,
-                description=node.description,
-                bus_links=[],
-                enum_types=[],
-                messages=[],
-            )
+            yield _get_model_for_node(node, db), iter_messages(node)
+
+    for package in sorted(set.packages, key=lambda package: package.name):
+        yield _get_model_for_package(package, db), iter_nodes(package)
 
-            for bus_link in db.get_node_bus_links(node):
-                bus_link_model = dict(
-                    bus=bus_link.bus.fully_qualified_name,
-                    note=bus_link.note if bus_link.note else None,
-                )
 
-                node_model["bus_links"].append(bus_link_model)
+def _render_set(set: ExportSet, db: ProtocolDatabase):
+    model = dict(
+        version=2,
+        packages=[],
+    )
+
+    for package_model, nodes in _iter_set(set, db):
+        for node_model, message_models in nodes:
+            node_model["messages"].extend(message_models)
+            package_model["units"].append(node_model)
+
+        model["packages"].append(package_model)
 
-            sorted_enum_types = sorted(db.get_enum_types(scope=node), key=lambda enum_type: enum_type.name)
+    return model
 
-            for enum_type in sorted_enum_types:
-                # TODO: why not check if is in set?
 
-                assert enum_type.description != ""  # should be None instead
-                enum_type_model = dict(
-                    name=enum_type.name,
-                    description=enum_type.description,
-                    items=[],
-                )
+def _json_open_list(model: dict) -> str:
+    """
+    Encode a model whose last item is an empty list, leaving the list open
+    """
+    encoded = json.dumps(model)
+    assert encoded.endswith("[]}")
+    return encoded[:-2]
 
-                for item in sorted(enum_type.items, key=lambda item: item.value):
-                    enum_item_model = dict(
-                        name=item.name,
-                        value=item.value,
-                        description=item.description if item.description else None,
-                    )
-                    enum_type_model["items"].append(enum_item_model)
 
-                node_model["enum_types"].append(enum_type_model)
+def _iter_render_set(set: ExportSet, db: ProtocolDatabase) -> Iterator[str]:
+    """
+    Encode the set piece by piece; the concatenated output equals json.dumps(_render_set(set, db))
+    """
+    yield _json_open_list(dict(version=2, packages=[]))
 
-            sorted_messages = sorted(db.get_messages(scope=node), key=lambda message: message.name)
+    for i, (package_model, nodes) in enumerate(_iter_set(set, db)):
+        yield _json_open_list(package_model) if i == 0 else ", " + _json_open_list(package_model)
 
-            for message in sorted_messages:
-                if message not in set.messages:
-                    continue
+        for j, (node_model, message_models) in enumerate(nodes):
+            yield _json_open_list(node_model) if j == 0 else ", " + _json_open_list(node_model)
 
-                node_model["messages"].append(_get_model_for_message(message, db))
+            for k, message_model in enumerate(message_models):
+                yield json.dumps(message_model) if k == 0 else ", " + json.dumps(message_model)
 
-            package_model["units"].append(node_model)
+            yield "]}"
 
-        model["packages"].append(package_model)
+        yield "]}"
 
-    return model
+    yield "]}"
 
 
-def export_buses_of_package(package: Package, db: ProtocolDatabase):
+def _encode_chunks(chunks: Iterable[str], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Join small pieces of text into chunks of at least chunk_size bytes, for fewer writes
+    """
+    buffer = []
+    buffered = 0
+
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+
+        if buffered >= chunk_size:
+            yield "".join(buffer).encode()
+            buffer = []
+            buffered = 0
+
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+def _buses_of_package(package: Package, db: ProtocolDatabase) -> ExportSet:
+    db.load_package_snapshot(package)
+
     export_set = ExportSet(db)
 
     for bus in db.get_buses(scope=package):
         export_set.add_bus(bus)
 
-    return _render_set(export_set, db)
+    return export_set
 
 
-if __name__ == "__main__":
-    import json
-    import sys
+def export_buses_of_package(package: Package, db: ProtocolDatabase):
+    return _render_set(_buses_of_package(package, db), db)
+
+
+def render_buses_of_package(package: Package, db: ProtocolDatabase, cache: Optional[ExportCache] = None) -> bytes:
+    """
+    Like export_buses_of_package, but serialized as JSON (UTF-8)
+
+    :param cache: if specified, reuse the result for as long as the database does not change
+    """
+    def render() -> bytes:
+        return b"".join(_encode_chunks(_iter_render_set(_buses_of_package(package, db), db)))
+
+    if cache is None:
+        return render()
+
+    return cache.get_or_render(('json2', package.name), db, render)
+
+
+def stream_buses_of_package(package: Package, db: ProtocolDatabase, cache: Optional[ExportCache] = None
+                            ) -> Iterator[bytes]:
+    """
+    Like render_buses_of_package, but produce the output in chunks while the package is being exported,
+    so that the complete model is never held in memory (except by the cache)
+    """
+    def render() -> Iterator[bytes]:
+        return _encode_chunks(_iter_render_set(_buses_of_package(package, db), db))
+
+    if cache is None:
+        return render()
+
+    return cache.stream(('json2', package.name), db, render)
+
+
+def _all_packages(db: ProtocolDatabase) -> ExportSet:
+    db.load_all()
+
+    export_set = ExportSet(db)
+
+    for package in db.get_packages():
+        export_set.add_package(package)
+
+        for node in db.get_nodes(scope=package):
+            export_set.add_unit_with_enums(node)
+
+            for message in db.get_messages(scope=node):
+                export_set.add_message(message)
+
+    return export_set
+
+
+def export_all_packages(db: ProtocolDatabase):
+    return _render_set(_all_packages(db), db)
+
+
+def stream_all_packages(db: ProtocolDatabase) -> Iterator[bytes]:
+    """
+    Like export_all_packages, but serialized as JSON (UTF-8) in chunks, package by package
+    """
+    return _encode_chunks(_iter_render_set(_all_packages(db), db))
+
+
+# State inherited by the processes of export_packages
+_batch_db: Optional[ProtocolDatabase] = None
+_batch_cache: Optional[ExportCache] = None
+_batch_inherited_conn = None
+
+
+def export_packages(db: ProtocolDatabase, package_names: Iterable[str], output_dir, jobs: Optional[int] = None,
+                    cache: Optional[ExportCache] = None) -> List[Path]:
+    """
+    Export the buses of each package into <output_dir>/<package name>.json.
+
+    The database is loaded once, then the packages are rendered by a pool of forked processes, which inherit it.
+    A process running other threads (e.g. protodb.worker) is never forked, since the locks and connections held by
+    those threads would be copied in an undefined state.
+
+    :param jobs: number of processes; by default, one per CPU. With a single job (or where fork() is not available,
+                 or other threads are running), everything is done in this process.
+    :return: paths of the files written
+    """
+    global _batch_db, _batch_cache
+
+    package_names = list(package_names)
+    output_dir = Path(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if len(package_names) > 1:
+        db.load_all()
+
+    tasks = [(name, output_dir / f'{name}.json') for name in package_names]
+
+    if (jobs > 1 and len(tasks) > 1 and 'fork' in multiprocessing.get_all_start_methods() and
+            threading.active_count() == 1):
+        _batch_db, _batch_cache = db, cache
+
+        try:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)), mp_context=multiprocessing.get_context('fork'),
+                                     initializer=_init_batch_process) as executor:
+                return list(executor.map(_export_package_to_file, tasks))
+        finally:
+            _batch_db, _batch_cache = None, None
+    else:
+        return [_export_package_to_file(task, db, cache) for task in tasks]
+
 
+def _init_batch_process() -> None:
+    global _batch_inherited_conn
+
+    reconnect = getattr(_batch_db, 'reconnect', None)
+
+    if reconnect is not None:
+        # the connection inherited from the parent must neither be used, nor closed (by being garbage-collected)
+        _batch_inherited_conn = _batch_db.conn
+        reconnect()
+
+
+def _export_package_to_file(task: Tuple[str, Path], db: Optional[ProtocolDatabase] = None,
+                            cache: Optional[ExportCache] = None) -> Path:
+    name, path = task
+
+    if db is None:
+        db, cache = _batch_db, _batch_cache
+
+    package = db.get_package(name)
+
+    # write to a temporary file first, so that readers never see a partial export
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+
+    with open(tmp_path, 'wb') as f:
+        for chunk in stream_buses_of_package(package, db, cache=cache):
+            f.write(chunk)
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def main(argv: Optional[List[str]] = None, *, env: Optional[Mapping[str, str]] = None,
+         stdin: Optional[TextIO] = None, stdout: Optional[TextIO] = None,
+         connect: Optional[Callable[[str], ProtocolDatabase]] = None) -> None:
+    """ Entry point, see protodb.worker for the parameters """
     import configargparse
 
-    from .. import connect
+    if stdout is None:
+        stdout = sys.stdout
+
+    if connect is None:
+        from .. import connect
 
     parser = configargparse.ArgParser()
     parser.add_argument('--db', dest='conn_string', env_var='PROTODB_CONN_STRING', required=True)
-    parser.add_argument("package")
-    args = parser.parse_args()
+    parser.add_argument('--cache-dir', env_var='PROTODB_EXPORT_CACHE_DIR',
+                        help='reuse exports of unchanged JSON models, stored in this directory')
+    parser.add_argument('--all', action='store_true', help='export all packages')
+    parser.add_argument('--output-dir', help='write each package into <output-dir>/<package>.json')
+    parser.add_argument('-j', '--jobs', type=int, help='number of processes used with --output-dir')
+    parser.add_argument("packages", nargs='*')
+    args = parser.parse_args(argv, env_vars=env if env is not None else os.environ)
+
+    if args.output_dir is None and (args.all or len(args.packages) != 1):
+        parser.error('exactly one package can be written to stdout; use --output-dir to export more')
+    elif args.all and args.packages:
+        parser.error('either --all or packages can be specified')
 
     db = connect(args.conn_string)
 
-    package = db.get_package(args.package)
+    if args.cache_dir:
+        cache = ExportCache(directory=args.cache_dir, namespace=args.conn_string)
+    else:
+        cache = None
 
-    model = export_buses_of_package(package, db)
+    if args.output_dir is not None:
+        package_names = [package.name for package in db.get_packages()] if args.all else args.packages
 
-    json.dump(model, sys.stdout)
+        export_packages(db, package_names, args.output_dir, jobs=args.jobs, cache=cache)
+    else:
+        package = db.get_package(args.packages[0])
+
+        for chunk in stream_buses_of_package(package, db, cache=cache):
+            stdout.write(chunk.decode())
+
+
+if __name__ == "__main__":
+    main()
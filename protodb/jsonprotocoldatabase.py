@@ -16,18 +16,29 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
 
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import itertools
 import json
+import mmap
+import os
+import re
+import threading
+import warnings
 from datetime import timedelta
-from typing import Iterable, Set, Dict, Optional, List
+from pathlib import Path
+from typing import Callable, Iterable, Set, Dict, Optional, List, Tuple
 
 from . import model
 from . import ProtocolDatabase
 from .model import Entity, EnumTypeItem, FrameType, NodeMessageLink, NodeMessageLinkType
 from .protocoldatabase import InvalidScopeError
+from .stringtable import StringTable
 
 
 class Package(model.Package):
+    __slots__ = ('buses_by_name', 'nodes_by_name')
+
     buses_by_name: Dict[str, 'Bus']
     nodes_by_name: Dict[str, 'Node']
 
@@ -50,30 +61,37 @@ class Package(model.Package):
 
 
 class Bus(model.Bus):
+    __slots__ = ('node_links',)
+
     node_links: Set['NodeBusLink']
 
-    def __init__(self, package: Package, name: str, dbc_id: Optional[int] = None, bitrate: Optional[int] = None):
+    def __init__(self, package: Optional[Package], name: str, dbc_id: Optional[int] = None,
+                 bitrate: Optional[int] = None):
         self.name = name
         self.dbc_id = dbc_id
         self.bitrate = bitrate
 
+        # package is None while loading (see _ModelBuilder)
         self.package = package
-        self.fully_qualified_name = f'{package.fully_qualified_name}.{name}'
+        self.fully_qualified_name = f'{package.fully_qualified_name}.{name}' if package is not None else None
 
 
 class Node(model.Node):
+    __slots__ = ('enum_types_by_name', 'messages_by_name', 'bus_links', 'message_links')
+
     enum_types_by_name: Dict[str, 'EnumType']
     messages_by_name: Dict[str, 'Message']
 
     bus_links: List['NodeBusLink']
     message_links: Set[model.NodeMessageLink]
 
-    def __init__(self, package: Package, name: str, description: Optional[str]):
+    def __init__(self, package: Optional[Package], name: str, description: Optional[str]):
         self.name = name
         self.description = description
 
+        # package is None while loading (see _ModelBuilder)
         self.package = package
-        self.fully_qualified_name = f'{package.name}.{name}'
+        self.fully_qualified_name = f'{package.name}.{name}' if package is not None else None
 
     def get_enum_type(self, name: str):
         return self.enum_types_by_name[name]
@@ -89,14 +107,16 @@ class Node(model.Node):
 
 
 class NodeBusLink(model.NodeBusLink):
-    pass
+    __slots__ = ()
 
 
 class Message(model.Message):
+    __slots__ = ('node_links',)
+
     node_links: Iterable[model.NodeMessageLink]
 
-    def __init__(self, unit: Node, name: str, description: str, frame_type: model.FrameType, can_id: Optional[int],
-                 timeout: Optional[timedelta], tx_period: Optional[timedelta]):
+    def __init__(self, unit: Optional[Node], name: str, description: str, frame_type: model.FrameType,
+                 can_id: Optional[int], timeout: Optional[timedelta], tx_period: Optional[timedelta]):
         self.name = name
         self.description = description
         #self.bus = initialized in 2nd pass
@@ -105,37 +125,96 @@ class Message(model.Message):
         self.timeout = timeout
         self.tx_period = tx_period
 
+        # unit is None while loading (see _ModelBuilder)
         self.unit = unit
-        self.fully_qualified_name = f'{unit.fully_qualified_name}.{name}'
+        self.fully_qualified_name = f'{unit.fully_qualified_name}.{name}' if unit is not None else None
 
 
 class MessageField(model.MessageField):
-    pass
+    __slots__ = ()
 
 
 class EnumType(model.EnumType):
-    def __init__(self, name: str, description: str, node: Node):
+    __slots__ = ()
+
+    def __init__(self, name: str, description: str, node: Optional[Node]):
         self.name = name
         self.description = description
 
+        # node is None while loading (see _ModelBuilder)
         self.node = node
-        self.fully_qualified_name = f'{node.fully_qualified_name}.{name}'
+        self.fully_qualified_name = f'{node.fully_qualified_name}.{name}' if node is not None else None
 
 
 class JsonProtocolDatabase(ProtocolDatabase):
+    # Only the loaded entities in lazy mode
+    enum_types: List[EnumType]
     messages: Set[Message]
     message_fields: Set[MessageField]
     packages: Dict[str, Package]
     nodes: Set[Node]
 
+    # Indexes of the published packages, see _add_to_indexes
+    _buses_by_fqn: Dict[str, Bus]
+    _messages_by_bus: Dict[Bus, List[Message]]
+    _messages_by_can_id: Dict[Tuple[Bus, int, FrameType], Message]
+    _messages_by_fqn: Dict[str, Message]
+    _nodes_by_fqn: Dict[str, Node]
+
+    # Canonical instances of repeated values, see StringTable
+    strings: StringTable
+
+    # SHA-256 of the model file (for a partitioned model, of the names and hashes of its files), if loaded from one
+    _source_hash: Optional[bytes]
+
+    # Lazy mode: the model file, with the byte ranges of packages not loaded yet
+    _source: Optional[mmap.mmap]
+    _unloaded_packages: Dict[str, Tuple[int, int]]
+    # Lazy mode: names of the packages referring to a bus or node, by its fully qualified name
+    _bus_referrers: Dict[str, Set[str]]
+    _node_referrers: Dict[str, Set[str]]
+
+    _builder: Optional['_ModelBuilder']
+    _lock: threading.RLock
+    _watcher: Optional['jsonwatch.Watcher']
+    # Packages loaded, but not published yet, because their references are being resolved
+    _loading: Dict[str, Package]
+    _loading_depth: int
+    # The first error while loading, re-raised once the outermost load is over
+    _loading_error: Optional[BaseException]
+
     def __init__(self, /, __do_not_use_directly__):
+        self.enum_types = []
         self.messages = set()
         self.message_fields = set()
         self.packages = {}
         self.nodes = set()
 
+        self.strings = StringTable()
+        self._enum_field_types = {}
+
+        self._buses_by_fqn = {}
+        self._messages_by_bus = {}
+        self._messages_by_can_id = {}
+        self._messages_by_fqn = {}
+        self._nodes_by_fqn = {}
+
+        self._source_hash = None
+
+        self._source = None
+        self._unloaded_packages = {}
+        self._bus_referrers = {}
+        self._node_referrers = {}
+
+        self._builder = None
+        self._lock = threading.RLock()
+        self._watcher = None
+        self._loading = {}
+        self._loading_depth = 0
+        self._loading_error = None
+
     @staticmethod
-    def from_model(model, strict: bool=False):
+    def from_model(model, strict: bool=False, strings: Optional[StringTable] = None):
         """
 
         :param model:
@@ -143,191 +222,57 @@ class JsonProtocolDatabase(ProtocolDatabase):
                 - all referenced buses must be defined
                 - Bus.bitrate, Bus.dbc_id are required
                 - Message.frame_type, Message.received_by, Message.sent_by are required
+        :param strings: table to share with other databases; by default, each database has its own
         :return:
         """
 
-        self = JsonProtocolDatabase(__do_not_use_directly__=True)
-
-        assert model["version"] == 2
-
-        for package_model in model['packages']:
-            package = Package(package_model['name'])
-
-            buses = set()
-
-            for bus_model in package_model['buses']:
-                if not strict:
-                    dbc_id = bus_model.get("dbc_id", None)
-                    bitrate = bus_model.get("bitrate", None)
-                else:
-                    dbc_id = bus_model["dbc_id"]
-                    bitrate = bus_model["bitrate"]
-
-                bus = Bus(package=package, name=bus_model['name'], dbc_id=dbc_id, bitrate=bitrate)
-                bus.node_links = set() # to be filled in a later pass
-                buses.add(bus)
-
-            nodes = []
-
-            for unit_model in package_model['units']:
-                unit = Node(package, unit_model['name'], unit_model['description'])
-                unit.message_links = set() # to be filled in a later pass
-
-                enum_types_by_name = {}
-                messages = []
-
-                for enum_type_model in unit_model["enum_types"]:
-                    enum_type = EnumType(enum_type_model["name"], enum_type_model["description"], unit)
-
-                    items = []
-
-                    for item in enum_type_model["items"]:
-                        items.append(EnumTypeItem(item["name"], item["description"], item["value"]))
-
-                    enum_type.items = items
-                    enum_types_by_name[enum_type.name] = enum_type
-
-                unit.enum_types_by_name = enum_types_by_name
-
-                for message_model in unit_model['messages']:
-                    if not strict and "frame_type" not in message_model:
-                        frame_type = FrameType.CAN_STD
-                    else:
-                        frame_type = FrameType[message_model["frame_type"]]
-
-                    message = Message(unit, message_model['name'], message_model['description'],
-                                      frame_type=frame_type,
-                                      can_id=message_model['id'] if 'id' in message_model else None,
-                                      timeout=timedelta(milliseconds=message_model['timeout']) if message_model['timeout'] is not None else None,
-                                      tx_period=timedelta(milliseconds=message_model['tx_period']) if message_model['tx_period'] is not None else None,)
-
-                    message.node_links = [] # to be filled in a later pass
-
-                    fields = []
-
-                    for field_model in message_model['fields']:
-                        fqn = f'{message.fully_qualified_name}.{field_model["name"]}'
-                        field = MessageField(name=field_model['name'],
-                                             description=field_model['description'],
-                                             type=None,
-                                             size_in_bits=field_model["bits"],
-                                             array_length=field_model["count"],
-
-                                             unit=field_model["unit"] if "unit" in field_model else None,
-                                             factor=field_model["factor"] if "factor" in field_model else None,
-                                             offset=field_model["offset"] if "offset" in field_model else None,
-                                             min=field_model["min"] if "min" in field_model else None,
-                                             max=field_model["max"] if "max" in field_model else None,
-
-                                             message=message,
-                                             fully_qualified_name=fqn,
-                                             )
-                        fields.append(field)
-                        self.message_fields.add(field)
-
-                    message.fields = fields
-                    messages.append(message)
-                    self.messages.add(message)
-
-                unit.enum_types_by_name = enum_types_by_name
-                unit.messages_by_name = {message.name: message for message in messages}
-
-                self.nodes.add(unit)
-                nodes.append(unit)
-
-            package.buses_by_name = {bus.name: bus for bus in buses}
-            package.nodes_by_name = {unit.name: unit for unit in nodes}
+        builder = _ModelBuilder(strict=strict, strings=strings)
+        return builder.finish(builder.build(model))
 
-            self.packages[package.name] = package
+    @property
+    def supports_concurrent_readers(self) -> bool:
+        # in watch mode, the sets and indexes are patched in place, and in lazy mode, they grow as packages are loaded,
+        # while readers iterate them without locking
+        return self._watcher is None and not self._unloaded_packages
 
-        # Second pass: resolve
-        #  - enum types
-        #  - message-bus links
-        #  - unit-bus links
-        for package_model in model['packages']:
-            package = self.get_package(package_model['name'])
-
-            for unit_model in package_model['units']:
-                unit = package.get_node(unit_model['name'])
-
-                unit.bus_links = []
-
-                for bus_link_model in unit_model['bus_links']:
-                    # the JSON2 format permits references to "foreign" buses (buses in undefined packages)
-                    try:
-                        # we if we encounter this, we ~~create the package~~ set the bus ref to None and hope nobody notices
-                        bus = self.get_bus(bus_link_model['bus'])
-                    except KeyError:
-                        if strict:
-                            raise
-
-                        bus = self._create_bus_just_in_time(bus_link_model['bus'])
-
-                    link = NodeBusLink(unit, bus, bus_link_model['note'])
-                    unit.bus_links.append(link)
-                    bus.node_links.add(link)
-
-                for message_model in unit_model['messages']:
-                    message = unit.get_message(message_model['name'])
-
-                    message.bus = self.get_bus(message_model['bus']) if message_model['bus'] is not None else None
-
-                    for i, field_model in enumerate(message_model['fields']):
-                        message.fields[i].type = self.resolve_type(package=package, type_str=field_model["type"])
-
-                    if not strict:
-                        received_by = message_model.get("received_by", [])
-                        sent_by = message_model.get("sent_by", [])
-                    else:
-                        received_by = message_model["received_by"]
-                        sent_by = message_model["sent_by"]
-
-                    for node_fqn in received_by:
-                        try:
-                            node: Node = self.get_node(node_fqn)
-                        except KeyError:
-                            if strict:
-                                raise
-
-                            node = self._create_node_just_in_time(node_fqn)
-
-                        link = NodeMessageLink(node=node, message=message, link_type=NodeMessageLinkType.RECEIVER)
-                        message.node_links.append(link)
-                        node.message_links.add(link)
-
-                    for node_fqn in sent_by:
-                        try:
-                            node: Node = self.get_node(node_fqn)
-                        except KeyError:
-                            if strict:
-                                raise
+    def add_change_callback(self, callback: Callable[['jsonwatch.Changes'], None]) -> None:
+        """
+        Call `callback` after every reload in watch mode (see with_path). It is called with the database lock held,
+        in the thread that noticed the change.
+        """
+        if self._watcher is None:
+            raise ValueError('Not in watch mode')
 
-                            node = self._create_node_just_in_time(node_fqn)
-
-                        link = NodeMessageLink(node=node, message=message, link_type=NodeMessageLinkType.SENDER)
-                        message.node_links.append(link)
-                        node.message_links.add(link)
-
-        return self
+        self._watcher.callbacks.append(callback)
 
     def delete(self, entity: model.Entity, who_changed: str) -> None:
         raise NotImplementedError()
 
     def get_associated_messages(self, bus: model.Bus) -> Iterable[model.Message]:
-        return [message for message in self.get_messages(scope=bus.package) if message.bus is bus]
+        # only messages of the bus's own package count; they are indexed as soon as the package is published
+        return self._messages_by_bus.get(bus, [])
 
     def get_bus(self, path: str) -> Bus:
-        package_name, bus_name = path.split('.')
+        bus = self._buses_by_fqn.get(path)
+
+        if bus is None:
+            # not published yet, or created just in time
+            package_name, bus_name = path.split('.')
+            bus = self.get_package(package_name).get_bus(bus_name)
 
-        return self.get_package(package_name).get_bus(bus_name)
+        return bus
 
     def get_bus_nodes(self, bus: Bus) -> Iterable[model.Node]:
+        # nodes of any package can be linked to the bus
+        self._load_referrers(self._bus_referrers, bus.fully_qualified_name)
+
         return [link.node for link in bus.node_links]
 
     def get_buses(self, scope: Optional[Package] = None) -> Iterable[Bus]:
         if scope is not None:
             return scope.get_buses()
         else:
+            self._load_all_packages()
             return list(itertools.chain(*[package.get_buses() for package in self.packages.values()]))
 
     def get_enum_type(self, type: model.EnumMessageFieldType):
@@ -343,7 +288,19 @@ class JsonProtocolDatabase(ProtocolDatabase):
             else:
                 raise InvalidScopeError()
         else:
-            raise NotImplementedError()
+            self._load_all_packages()
+            return self.enum_types
+
+    def get_message_by_can_id(self, bus: Bus, can_id: int, frame_type: FrameType) -> Optional[Message]:
+        return self._messages_by_can_id.get((bus, can_id, frame_type))
+
+    def get_message(self, /, fully_qualified_name: str) -> Message:
+        message = self._messages_by_fqn.get(fully_qualified_name)
+
+        if message is None:
+            message = super().get_message(fully_qualified_name)
+
+        return message
 
     def get_messages(self, scope: Optional[Entity] = None) -> Iterable[Message]:
         if scope is not None:
@@ -354,6 +311,7 @@ class JsonProtocolDatabase(ProtocolDatabase):
             else:
                 raise InvalidScopeError()
         else:
+            self._load_all_packages()
             return self.messages
 
     def get_message_fields(self, scope: Optional[Entity] = None) -> Iterable[MessageField]:
@@ -366,12 +324,22 @@ class JsonProtocolDatabase(ProtocolDatabase):
             else:
                 raise InvalidScopeError()
         else:
+            self._load_all_packages()
             return self.message_fields
 
+    def get_node(self, /, fully_qualified_name: str) -> Node:
+        node = self._nodes_by_fqn.get(fully_qualified_name)
+
+        if node is None:
+            node = super().get_node(fully_qualified_name)
+
+        return node
+
     def get_nodes(self, scope: Optional[Package] = None) -> Iterable[Node]:
         if scope is not None:
             return scope.get_nodes()
         else:
+            self._load_all_packages()
             return self.nodes
 
     def get_node_bus_links(self, node: Node) -> Iterable[model.NodeBusLink]:
@@ -383,46 +351,418 @@ class JsonProtocolDatabase(ProtocolDatabase):
     def get_node_message_links(self, message: Optional[Message] = None, node: Optional[Node] = None
                                ) -> Iterable[model.NodeMessageLink]:
         if node is not None:
+            # messages of any package can be sent or received by the node
+            self._load_referrers(self._node_referrers, node.fully_qualified_name)
+
             return node.message_links
         elif message is not None:
             return message.node_links
         else:
             raise NotImplementedError()
 
+    def get_node_message_links_for(self, messages: Iterable[Message]
+                                   ) -> Dict[Message, Iterable[model.NodeMessageLink]]:
+        return {message: message.node_links for message in messages}
+
     def get_package(self, name: str) -> Package:
-        return self.packages[name]
+        if self._watcher is not None:
+            self._poll_watcher()
+
+        package = self.packages.get(name)
+
+        if package is None:
+            package = self._load_package(name)
+
+        return package
 
     def get_package_node(self, package: Package, name: str) -> model.Node:
         return package.get_node(name)
 
     def get_packages(self) -> Iterable[model.Package]:
+        if self._watcher is not None:
+            self._poll_watcher()
+
+        self._load_all_packages()
         return self.packages.values()
 
+    def get_version_token(self) -> Optional[str]:
+        if self._watcher is not None:
+            self._poll_watcher()
+            return self._watcher.version_token
+
+        # without watching, the model never changes
+        return self._source_hash.hex() if self._source_hash is not None else None
+
+    def load_all(self) -> None:
+        self._load_all_packages()
+
+    def poll_changes(self) -> Optional['jsonwatch.Changes']:
+        """
+        In watch mode, reload changed packages right away instead of waiting for the next automatic poll
+
+        :return: the changes, or None if there were none
+        """
+        if self._watcher is None:
+            raise ValueError('Not in watch mode')
+
+        return self._watcher.poll(force=True)
+
     def resolve_type(self, package: model.Package, type_str: str) -> model.MessageFieldType:
         if type_str in model.MESSAGE_FIELD_PRIMITIVE_TYPES:
             return model.MESSAGE_FIELD_PRIMITIVE_TYPES[type_str]
         elif type_str.startswith("enum "):
-            node_and_enum = type_str[5:]
-            delim = node_and_enum.find(".")
+            node_name, enum = _split_enum_type(type_str)
 
-            if delim == -1:
-                # Used in JSON version 2
-                delim = node_and_enum.find("_")
+            node = self.get_package_node(package, node_name)
 
-            assert delim > 0
-            node_name = node_and_enum[:delim]
-            enum = node_and_enum[delim + 1:]
+            # field types are immutable, so they can be shared
+            type = self._enum_field_types.get((node, enum))
 
-            node = self.get_package_node(package, node_name)
-            return model.EnumMessageFieldType(node=node, enum=enum,
-                                              fully_qualified_name=f"{node.fully_qualified_name}.{enum}")
+            if type is None:
+                type = model.EnumMessageFieldType(node=node, enum=enum,
+                                                  fully_qualified_name=f"{node.fully_qualified_name}.{enum}")
+                self._enum_field_types[(node, enum)] = type
+
+            return type
         else:
             raise Exception(f"Invalid type {type_str}")
 
+    def save_snapshot(self, path) -> None:
+        """
+        Save the database in a binary format that loads much faster than JSON, see load_snapshot.
+        All packages are loaded first.
+        """
+        from . import jsonsnapshot
+
+        if self._source_hash is None:
+            raise ValueError('Only databases loaded from a file can be saved as snapshot')
+
+        jsonsnapshot.save(self, path, source_hash=self._source_hash)
+
     @staticmethod
-    def with_path(path):
-        with open(path, 'rt') as f:
-            return JsonProtocolDatabase.from_model(json.load(f))
+    def load_snapshot(path, source_path=None, strings: Optional[StringTable] = None) -> 'JsonProtocolDatabase':
+        """
+        :param source_path: if specified, check that the snapshot was made from the current contents of this file
+        :param strings: see from_model
+        :raise jsonsnapshot.StaleSnapshotError: if it was not
+        """
+        from . import jsonsnapshot
+
+        if source_path is not None:
+            source_hash = hashlib.sha256()
+
+            with open(source_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    source_hash.update(chunk)
+
+            source_hash = source_hash.digest()
+        else:
+            source_hash = None
+
+        self = jsonsnapshot.load(path, source_hash=source_hash, strings=strings)
+        self._source_hash = source_hash if source_hash is not None else jsonsnapshot.read_source_hash(path)
+        return self
+
+    @staticmethod
+    def with_path(path, strict: bool=False, lazy: bool=False, snapshot_dir=None,
+                  strings: Optional[StringTable] = None, watch: bool = False):
+        """
+        Load a JSON2 file. Entities are built while the file is being parsed, so the model is never held
+        in memory as a tree of dicts.
+
+        :param strict: see from_model
+        :param strings: see from_model
+        :param lazy: if True, the file is only indexed and each package is loaded on first access, together with
+                     the packages it refers to. The file is memory-mapped and must not be modified in place while
+                     the database is open (replacing it is fine).
+        :param snapshot_dir: if specified, load from a snapshot (see save_snapshot) in this directory, keyed by
+                             the content hash of the file. If there is none yet, the file is loaded in full
+                             and the snapshot is saved.
+        :param watch: if True, the file is checked for modifications at most once per second when a package is
+                      looked up, and the changed packages are reloaded in place (see jsonwatch). Unchanged entities
+                      keep their identity. The database must then be used by one thread at a time (see
+                      supports_concurrent_readers). Not supported together with lazy loading or snapshots.
+        """
+
+        if watch:
+            if lazy or snapshot_dir is not None:
+                raise ValueError('Watch mode requires the model to be loaded in full')
+
+            self = JsonProtocolDatabase.with_path(path, strict=strict, strings=strings)
+            self._start_watching(path, strict)
+            return self
+
+        if snapshot_dir is not None:
+            return JsonProtocolDatabase._open_with_snapshot(path, strict=strict, snapshot_dir=snapshot_dir,
+                                                            strings=strings)
+        elif lazy:
+            return JsonProtocolDatabase._open_lazy(path, strict=strict, strings=strings)
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        builder = _ModelBuilder(strict=strict, strings=strings)
+        self = builder.finish(json.loads(data, object_pairs_hook=builder.object_pairs_hook))
+        self._source_hash = hashlib.sha256(data).digest()
+        return self
+
+    @staticmethod
+    def with_directory(path, strict: bool = False, workers: int = 1,
+                       strings: Optional[StringTable] = None, watch: bool = False) -> 'JsonProtocolDatabase':
+        """
+        Load a JSON2 model partitioned into files, typically one per package (all *.json files in `path`).
+        References between the files are resolved like references within a single file.
+
+        :param strict: see from_model
+        :param strings: see from_model; only used for the files loaded in this process
+        :param workers: number of processes parsing the files. With a single worker (the default), everything is
+                        loaded in this process. More are only worth it for large models, and they are forked,
+                        which is unsafe in multi-threaded processes.
+        :param watch: see with_path; only the changed files are read again
+        """
+        paths = sorted(Path(path).glob('*.json'))
+
+        builder = _ModelBuilder(strict=strict, strings=strings)
+        packages_by_name = {}
+
+        def add_packages(packages: List[Package], file_path: Path) -> None:
+            for package in packages:
+                if package.name in packages_by_name:
+                    raise Exception(f'Package {package.name} defined again in {file_path}')
+
+                packages_by_name[package.name] = package
+
+        source_hash = hashlib.sha256()
+
+        if workers > 1 and len(paths) > 1:
+            for file_path in paths:
+                source_hash.update(_file_digest(file_path.name, file_path.read_bytes()))
+
+            with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+                for file_path, (packages, pending_nodes) in zip(
+                        paths, executor.map(_load_partition, paths, itertools.repeat(strict))):
+                    builder.adopt(packages, pending_nodes)
+                    add_packages(packages, file_path)
+        else:
+            for file_path in paths:
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+
+                source_hash.update(_file_digest(file_path.name, data))
+                model = json.loads(data, object_pairs_hook=builder.object_pairs_hook)
+
+                assert model["version"] == 2
+                add_packages(model["packages"], file_path)
+
+        self = builder.finish(dict(version=2, packages=list(packages_by_name.values())))
+        self._source_hash = source_hash.digest()
+
+        if watch:
+            self._start_watching(path, strict)
+
+        return self
+
+    @staticmethod
+    def _open_lazy(path, strict: bool, strings: Optional[StringTable]) -> 'JsonProtocolDatabase':
+        self = JsonProtocolDatabase(__do_not_use_directly__=True)
+
+        with open(path, 'rb') as f:
+            self._source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._source_hash = hashlib.sha256(self._source).digest()
+        self._builder = _ModelBuilder(strict=strict, db=self, strings=strings)
+
+        version, self._unloaded_packages = _index_packages(self._source)
+        assert version == 2
+
+        for name, (start, end) in self._unloaded_packages.items():
+            for match in _BUS_REFERENCE_RE.finditer(self._source, start, end):
+                self._bus_referrers.setdefault(_decode_string(match.group(1)), set()).add(name)
+
+            for match in _NODE_REFERENCES_RE.finditer(self._source, start, end):
+                for node_fqn in _STRING_RE.findall(match.group(1)):
+                    self._node_referrers.setdefault(_decode_string(node_fqn), set()).add(name)
+
+        return self
+
+    @staticmethod
+    def _open_with_snapshot(path, strict: bool, snapshot_dir, strings: Optional[StringTable]
+                            ) -> 'JsonProtocolDatabase':
+        from .jsonsnapshot import SnapshotError
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        source_hash = hashlib.sha256(data).digest()
+        # only models that passed the strict checks are saved as strict
+        snapshot_path = os.path.join(snapshot_dir, source_hash.hex() + ('.strict' if strict else '') + '.snapshot')
+
+        try:
+            return JsonProtocolDatabase.load_snapshot(snapshot_path, strings=strings)
+        except FileNotFoundError:
+            pass
+        except SnapshotError:
+            # most likely written by a different version of ProtoDB; will be overwritten
+            pass
+
+        builder = _ModelBuilder(strict=strict, strings=strings)
+        self = builder.finish(json.loads(data, object_pairs_hook=builder.object_pairs_hook))
+        self._source_hash = source_hash
+
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.save_snapshot(snapshot_path)
+        return self
+
+    def _poll_watcher(self) -> None:
+        try:
+            self._watcher.poll()
+        except ValueError as ex:
+            # most likely a file being written right now; keep serving the previous version and retry later.
+            # Other errors (e.g. unresolvable references) are raised, the model is left intact in any case.
+            warnings.warn(f'Failed to reload the model: {ex}', RuntimeWarning)
+
+    def _start_watching(self, path, strict: bool) -> None:
+        from . import jsonwatch
+
+        self._watcher = jsonwatch.Watcher(self, path, strict=strict)
+
+    def _load_all_packages(self) -> None:
+        if not self._unloaded_packages:
+            return
+
+        with self._lock:
+            for name in list(self._unloaded_packages.keys()):
+                self.get_package(name)
+
+    def _load_package(self, name: str) -> Package:
+        """
+        Load a package in lazy mode
+
+        :raise KeyError: if there is no such package in the model
+        """
+        with self._lock:
+            # another thread might have been faster; or we are being called back while resolving the references of
+            # a package that refers to this one
+            if name in self.packages:
+                return self.packages[name]
+            elif name in self._loading:
+                return self._loading[name]
+
+            start, end = self._unloaded_packages[name]
+
+            if self._loading_depth == 0:
+                self._builder.journal = []
+
+            self._loading_depth += 1
+
+            try:
+                package = json.loads(self._source[start:end], object_pairs_hook=self._builder.object_pairs_hook)
+                self._loading[name] = package
+
+                # this can recursively load the referenced packages
+                self._builder.resolve(self._builder.take_pending())
+            except BaseException as ex:
+                # the failure of a package loaded recursively might be caught by a lookup in its referrer;
+                # all packages loaded together are discarded anyway
+                if self._loading_error is None:
+                    self._loading_error = ex
+
+                self._finish_loading()
+                raise
+
+            self._finish_loading()
+            return package
+
+    def _finish_loading(self) -> None:
+        self._loading_depth -= 1
+
+        if self._loading_depth > 0:
+            return
+
+        error, self._loading_error = self._loading_error, None
+
+        try:
+            if error is None:
+                # publish only after everything is resolved, so that other threads never see partial entities
+                self._add_to_indexes(self._loading.values())
+                self.packages.update(self._loading)
+
+                for loaded_name in self._loading:
+                    del self._unloaded_packages[loaded_name]
+            else:
+                self._discard_loading()
+        finally:
+            self._loading.clear()
+            self._builder.journal = None
+
+        if error is not None:
+            raise error
+
+    def _discard_loading(self) -> None:
+        """
+        Undo a failed load: forget the entities built since, including the links to them from published entities.
+        The packages stay unloaded, so that the next lookup tries again (and most likely fails the same way).
+        """
+        discarded_nodes = set()
+
+        for entity in self._builder.journal:
+            if isinstance(entity, Node):
+                discarded_nodes.add(entity)
+                self.nodes.discard(entity)
+
+                for link in getattr(entity, 'bus_links', ()):
+                    link.bus.node_links.discard(link)
+
+                for link in entity.message_links:
+                    if link in link.message.node_links:
+                        link.message.node_links.remove(link)
+            elif isinstance(entity, Message):
+                self.messages.discard(entity)
+
+                for link in entity.node_links:
+                    link.node.message_links.discard(link)
+            else:
+                self.message_fields.discard(entity)
+
+        for key in [key for key in self._enum_field_types if key[0] in discarded_nodes]:
+            del self._enum_field_types[key]
+
+        self._builder.discard_pending()
+
+    def _add_to_indexes(self, packages: Iterable[Package]) -> None:
+        """
+        Index fully resolved packages. Entities created just in time later on are not indexed; lookups fall back
+        to walking the package in that case.
+        """
+        messages_by_bus = {}
+        messages_by_can_id = {}
+
+        for package in packages:
+            for bus in package.get_buses():
+                self._buses_by_fqn[bus.fully_qualified_name] = bus
+
+            for node in package.get_nodes():
+                self._nodes_by_fqn[node.fully_qualified_name] = node
+                self.enum_types.extend(node.get_enum_types())
+
+                for message in node.get_messages():
+                    self._messages_by_fqn[message.fully_qualified_name] = message
+
+                    if message.bus is not None and message.bus.package is package:
+                        messages_by_bus.setdefault(message.bus, []).append(message)
+
+                        if message.can_id is not None:
+                            # in case of conflicts, the first one wins
+                            messages_by_can_id.setdefault((message.bus, message.can_id, message.frame_type), message)
+
+        # each list is complete before it becomes visible to other threads
+        self._messages_by_bus.update(messages_by_bus)
+        self._messages_by_can_id.update(messages_by_can_id)
+
+    def _load_referrers(self, referrers: Dict[str, Set[str]], fully_qualified_name: str) -> None:
+        for name in referrers.get(fully_qualified_name, ()):
+            if name not in self.packages:
+                self.get_package(name)
 
     def _create_bus_just_in_time(self, fully_qualified_name: str) -> Bus:
         package_name, bus_name = fully_qualified_name.split('.')
@@ -446,6 +786,9 @@ class JsonProtocolDatabase(ProtocolDatabase):
             package = self._create_package_just_in_time(package_name)
 
         node = Node(name=node_name, description=None, package=package)
+        node.bus_links = []
+        node.enum_types_by_name = dict()
+        node.messages_by_name = dict()
         node.message_links = set()
         package.nodes_by_name[node.name] = node
         return node
@@ -456,3 +799,407 @@ class JsonProtocolDatabase(ProtocolDatabase):
         package.nodes_by_name = dict()
         self.packages[package.name] = package
         return package
+
+
+class _ModelBuilder:
+    """
+    Builds a JsonProtocolDatabase from the objects of a JSON2 model in post-order (children before their parent),
+    which is the order in which json.load calls object_pairs_hook.
+
+    The kind of each object is recognized by its keys. Entities are created as soon as their JSON object is complete,
+    parents are attached when the enclosing object completes, and cross-references (buses, enum types, senders and
+    receivers) are resolved by finish() once all packages are known.
+    """
+
+    db: JsonProtocolDatabase
+    strict: bool
+
+    # Unresolved references, in model order: (node, [(bus, note)], [(message, bus, received_by, sent_by, types)])
+    _pending_nodes: List[tuple]
+    # References of messages not yet attached to a node
+    _pending_messages: List[tuple]
+    # Types of fields not yet attached to a message
+    _pending_field_types: List[str]
+    # If not None, all nodes, messages and fields built are recorded here (see JsonProtocolDatabase._discard_loading)
+    journal: Optional[list]
+
+    def __init__(self, strict: bool, db: Optional[JsonProtocolDatabase] = None,
+                 strings: Optional[StringTable] = None):
+        self.db = db if db is not None else JsonProtocolDatabase(__do_not_use_directly__=True)
+        self.strict = strict
+
+        if strings is not None:
+            self.db.strings = strings
+
+        self._intern = self.db.strings.intern
+
+        self._pending_nodes = []
+        self._pending_messages = []
+        self._pending_field_types = []
+        self.journal = None
+
+    def adopt(self, packages: List[Package], pending_nodes: List[tuple]) -> None:
+        """
+        Take over packages built by another builder, typically in another process (see _load_partition)
+        """
+        for package in packages:
+            for node in package.get_nodes():
+                self.db.nodes.add(node)
+
+                for message in node.get_messages():
+                    self.db.messages.add(message)
+                    self.db.message_fields.update(message.fields)
+
+        self._pending_nodes.extend(pending_nodes)
+
+    def build(self, value):
+        """
+        Build from an already parsed model
+        """
+        if isinstance(value, dict):
+            return self.object_pairs_hook([(key, self.build(item)) for key, item in value.items()])
+        elif isinstance(value, list):
+            return [self.build(item) for item in value]
+        else:
+            return value
+
+    def finish(self, model) -> JsonProtocolDatabase:
+        assert model["version"] == 2
+
+        for package in model["packages"]:
+            self.db.packages[package.name] = package
+
+        self.resolve(self.take_pending())
+        self.db._add_to_indexes(model["packages"])
+        return self.db
+
+    def resolve(self, pending_nodes: List[tuple]) -> None:
+        """
+        Resolve
+         - enum types
+         - message-bus links
+         - unit-bus links
+        """
+        for unit, bus_link_models, message_refs in pending_nodes:
+            self._resolve_node(unit, bus_link_models, message_refs)
+
+    def discard_pending(self) -> None:
+        """
+        Forget the references of everything built so far, e.g. after a parse error
+        """
+        self._pending_nodes = []
+        self._pending_messages = []
+        self._pending_field_types = []
+
+    def take_pending(self) -> List[tuple]:
+        """
+        :return: unresolved references of the nodes built so far
+        """
+        pending_nodes, self._pending_nodes = self._pending_nodes, []
+        return pending_nodes
+
+    def object_pairs_hook(self, pairs):
+        obj = dict(pairs)
+
+        if "packages" in obj:
+            return obj
+        elif "units" in obj:
+            return self._build_package(obj)
+        elif "messages" in obj:
+            return self._build_node(obj)
+        elif "fields" in obj:
+            return self._build_message(obj)
+        elif "items" in obj:
+            enum_type = EnumType(obj["name"], self._intern(obj["description"]), node=None)
+            enum_type.items = self.db.strings.enum_items(obj["items"])
+            return enum_type
+        elif "bits" in obj:
+            return self._build_field(obj)
+        elif "value" in obj:
+            return self.db.strings.enum_item(obj["name"], obj["description"], obj["value"])
+        elif "bus" in obj:
+            # node-bus link; the JSON2 format permits references to "foreign" buses, so these are resolved last
+            return obj["bus"], self._intern(obj["note"])
+        elif "name" in obj:
+            if not self.strict:
+                dbc_id = obj.get("dbc_id", None)
+                bitrate = obj.get("bitrate", None)
+            else:
+                dbc_id = obj["dbc_id"]
+                bitrate = obj["bitrate"]
+
+            bus = Bus(package=None, name=obj['name'], dbc_id=dbc_id, bitrate=bitrate)
+            bus.node_links = set()  # to be filled in finish()
+            return bus
+        else:
+            return obj
+
+    def _build_field(self, field_model: dict) -> MessageField:
+        intern = self._intern
+
+        field = MessageField(name=intern(field_model['name']),
+                             description=intern(field_model['description']),
+                             type=None,  # resolved in finish()
+                             size_in_bits=field_model["bits"],
+                             array_length=field_model["count"],
+
+                             unit=intern(field_model.get("unit")),
+                             factor=intern(field_model.get("factor")),
+                             offset=intern(field_model.get("offset")),
+                             min=intern(field_model.get("min")),
+                             max=intern(field_model.get("max")),
+                             )
+        self._pending_field_types.append(field_model["type"])
+        self.db.message_fields.add(field)
+
+        if self.journal is not None:
+            self.journal.append(field)
+
+        return field
+
+    def _build_message(self, message_model: dict) -> Message:
+        if not self.strict and "frame_type" not in message_model:
+            frame_type = FrameType.CAN_STD
+        else:
+            frame_type = FrameType[message_model["frame_type"]]
+
+        message = Message(None, message_model['name'], self._intern(message_model['description']),
+                          frame_type=frame_type,
+                          can_id=message_model['id'] if 'id' in message_model else None,
+                          timeout=timedelta(milliseconds=message_model['timeout']) if message_model['timeout'] is not None else None,
+                          tx_period=timedelta(milliseconds=message_model['tx_period']) if message_model['tx_period'] is not None else None,)
+
+        message.node_links = []  # to be filled in finish()
+        message.fields = message_model['fields']
+
+        for field in message.fields:
+            field.message = message
+
+        if not self.strict:
+            received_by = message_model.get("received_by", [])
+            sent_by = message_model.get("sent_by", [])
+        else:
+            received_by = message_model["received_by"]
+            sent_by = message_model["sent_by"]
+
+        self._pending_messages.append((message, message_model['bus'], received_by, sent_by,
+                                       self._pending_field_types))
+        self._pending_field_types = []
+
+        self.db.messages.add(message)
+
+        if self.journal is not None:
+            self.journal.append(message)
+
+        return message
+
+    def _build_node(self, unit_model: dict) -> Node:
+        unit = Node(None, unit_model['name'], self._intern(unit_model['description']))
+        unit.message_links = set()  # to be filled in finish()
+
+        unit.enum_types_by_name = {}
+
+        for enum_type in unit_model["enum_types"]:
+            enum_type.node = unit
+            unit.enum_types_by_name[enum_type.name] = enum_type
+
+        unit.messages_by_name = {}
+
+        for message in unit_model['messages']:
+            message.unit = unit
+            unit.messages_by_name[message.name] = message
+
+        self._pending_nodes.append((unit, unit_model['bus_links'], self._pending_messages))
+        self._pending_messages = []
+
+        self.db.nodes.add(unit)
+
+        if self.journal is not None:
+            self.journal.append(unit)
+
+        return unit
+
+    def _build_package(self, package_model: dict) -> Package:
+        package = Package(package_model['name'])
+        package.buses_by_name = {}
+        package.nodes_by_name = {}
+
+        for bus in package_model['buses']:
+            bus.package = package
+            bus.fully_qualified_name = f'{package.fully_qualified_name}.{bus.name}'
+            package.buses_by_name[bus.name] = bus
+
+        # Now that the package is known, all names in it can be qualified
+        for unit in package_model['units']:
+            unit.package = package
+            unit.fully_qualified_name = f'{package.name}.{unit.name}'
+
+            for enum_type in unit.enum_types_by_name.values():
+                enum_type.fully_qualified_name = f'{unit.fully_qualified_name}.{enum_type.name}'
+
+            for message in unit.messages_by_name.values():
+                message.fully_qualified_name = f'{unit.fully_qualified_name}.{message.name}'
+
+                for field in message.fields:
+                    field.fully_qualified_name = f'{message.fully_qualified_name}.{field.name}'
+
+            package.nodes_by_name[unit.name] = unit
+
+        return package
+
+    def _get_node(self, node_fqn: str) -> Node:
+        try:
+            return self.db.get_node(node_fqn)
+        except KeyError:
+            if self.strict:
+                raise
+
+            return self.db._create_node_just_in_time(node_fqn)
+
+    def _resolve_node(self, unit: Node, bus_link_models: List[tuple], message_refs: List[tuple]) -> None:
+        db = self.db
+
+        unit.bus_links = []
+
+        for bus_fqn, note in bus_link_models:
+            # the JSON2 format permits references to "foreign" buses (buses in undefined packages)
+            try:
+                # we if we encounter this, we ~~create the package~~ set the bus ref to None and hope nobody notices
+                bus = db.get_bus(bus_fqn)
+            except KeyError:
+                if self.strict:
+                    raise
+
+                bus = db._create_bus_just_in_time(bus_fqn)
+
+            link = NodeBusLink(unit, bus, note)
+            unit.bus_links.append(link)
+            bus.node_links.add(link)
+
+        for message, bus_fqn, received_by, sent_by, field_types in message_refs:
+            message.bus = db.get_bus(bus_fqn) if bus_fqn is not None else None
+
+            for field, type_str in zip(message.fields, field_types):
+                field.type = db.resolve_type(package=unit.package, type_str=type_str)
+
+            for node_fqn in received_by:
+                node = self._get_node(node_fqn)
+
+                link = NodeMessageLink(node=node, message=message, link_type=NodeMessageLinkType.RECEIVER)
+                message.node_links.append(link)
+                node.message_links.add(link)
+
+            for node_fqn in sent_by:
+                node = self._get_node(node_fqn)
+
+                link = NodeMessageLink(node=node, message=message, link_type=NodeMessageLinkType.SENDER)
+                message.node_links.append(link)
+                node.message_links.add(link)
+
+
+# Matches everything up to and including the next bracket outside of a string
+_BRACKET_RE = re.compile(rb'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*([{}\[\]])')
+_STRING_RE = re.compile(rb'"((?:[^"\\]|\\.)*)"')
+_NAME_RE = re.compile(rb'"name"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_PACKAGES_KEY_RE = re.compile(rb'"packages"\s*:\s*$')
+_VERSION_RE = re.compile(rb'"version"\s*:\s*(\d+)')
+
+# These may also match inside of strings (e.g. a description quoting JSON), which only means that more packages are
+# loaded than strictly necessary
+_BUS_REFERENCE_RE = re.compile(rb'"bus"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_NODE_REFERENCES_RE = re.compile(rb'"(?:received_by|sent_by)"\s*:\s*\[([^\]]*)\]')
+
+
+def _load_partition(path: Path, strict: bool) -> Tuple[List[Package], List[tuple]]:
+    """
+    Build the packages of one file of a partitioned model, see JsonProtocolDatabase.with_directory.
+    Runs in a worker process; the result is pickled back, references are resolved by the caller.
+    """
+    builder = _ModelBuilder(strict=strict)
+
+    with open(path, 'rb') as f:
+        model = json.loads(f.read(), object_pairs_hook=builder.object_pairs_hook)
+
+    assert model["version"] == 2
+    return model["packages"], builder.take_pending()
+
+
+def _split_enum_type(type_str: str) -> Tuple[str, str]:
+    """
+    :param type_str: "enum <node>.<enum>" or "enum <node>_<enum>"
+    :return: (node name, enum name)
+    """
+    node_and_enum = type_str[5:]
+    delim = node_and_enum.find(".")
+
+    if delim == -1:
+        # Used in JSON version 2
+        delim = node_and_enum.find("_")
+
+    assert delim > 0
+    return node_and_enum[:delim], node_and_enum[delim + 1:]
+
+
+def _file_digest(name: str, data: bytes) -> bytes:
+    return hashlib.sha256(name.encode() + b'\0' + hashlib.sha256(data).digest()).digest()
+
+
+def _decode_string(raw: bytes) -> str:
+    return json.loads(b'"' + raw + b'"') if b'\\' in raw else raw.decode()
+
+
+def _index_packages(source) -> Tuple[Optional[int], Dict[str, Tuple[int, int]]]:
+    """
+    Find the packages in a JSON2 model without parsing it
+
+    :param source: the model as bytes or mmap
+    :return: (model version, byte range of each package by name)
+    """
+
+    version = None
+    packages = {}
+
+    depth = 0
+    in_packages = False
+    package_start = None
+    package_name = None
+
+    for match in _BRACKET_RE.finditer(source):
+        bracket = match.group(1)
+
+        if depth == 1:
+            # text since the previous bracket, at the current depth
+            segment = source[match.start():match.end() - 1]
+            version_match = _VERSION_RE.search(segment)
+
+            if version_match:
+                version = int(version_match.group(1))
+
+            if bracket == b'[':
+                in_packages = _PACKAGES_KEY_RE.search(segment) is not None
+        elif depth == 3 and package_start is not None:
+            name_match = _NAME_RE.search(source, match.start(), match.end() - 1)
+
+            if name_match:
+                package_name = _decode_string(name_match.group(1))
+
+        if bracket in b'[{':
+            if depth == 2 and in_packages:
+                package_start = match.end() - 1
+
+            depth += 1
+        else:
+            depth -= 1
+
+            if depth == 2 and package_start is not None:
+                packages[package_name] = (package_start, match.end())
+                package_start = None
+                package_name = None
+            elif depth == 1:
+                in_packages = False
+
+    if depth != 0:
+        # e.g. a file still being written
+        raise ValueError('Unexpected end of JSON model')
+
+    return version, packages
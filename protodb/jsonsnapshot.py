@@ -0,0 +1,284 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Binary snapshots of a fully resolved JsonProtocolDatabase, see JsonProtocolDatabase.save_snapshot.
+
+Layout: a fixed header (magic, format version, SHA-256 of the source JSON) followed by a marshal-ed tuple of tables.
+Entities are stored as tuples in model order and refer to each other by their index in the respective table.
+Equal strings are stored once (marshal keeps shared objects shared), so they are also shared after loading.
+"""
+
+from datetime import timedelta
+import gc
+import marshal
+import mmap
+import os
+import struct
+from typing import Dict, Optional
+
+from . import model
+from .jsonprotocoldatabase import Bus, EnumType, JsonProtocolDatabase, Message, MessageField, Node, NodeBusLink, Package
+from .model import FrameType, NodeMessageLink, NodeMessageLinkType
+from .stringtable import StringTable
+
+MAGIC = b'PDBSNAP\0'
+# Increment on any change of the layout
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<8sI32s')
+
+_FRAME_TYPES = list(FrameType)
+_LINK_TYPES = list(NodeMessageLinkType)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class StaleSnapshotError(SnapshotError):
+    """
+    The snapshot was made from a different version of the source file
+    """
+    pass
+
+
+def load(path, source_hash: Optional[bytes] = None, strings: Optional[StringTable] = None) -> JsonProtocolDatabase:
+    """
+    :param source_hash: if specified, must match the hash stored in the snapshot
+    :param strings: see JsonProtocolDatabase.from_model
+    :raise StaleSnapshotError: if it does not
+    """
+
+    # Nothing built here is garbage, so don't let the collector walk the growing object graph over and over
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        return _load(path, source_hash, strings)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def read_source_hash(path) -> bytes:
+    """
+    :return: SHA-256 of the JSON model from which the snapshot was made
+    """
+    with open(path, 'rb') as f:
+        return _unpack_header(f.read(HEADER.size))
+
+
+def save(db: JsonProtocolDatabase, path, source_hash: bytes) -> None:
+    strings: Dict[str, str] = {}
+
+    def s(value: Optional[str]) -> Optional[str]:
+        return strings.setdefault(value, value) if value is not None else None
+
+    packages = list(db.get_packages())
+    package_ids = {package: i for i, package in enumerate(packages)}
+
+    buses = [bus for package in packages for bus in package.get_buses()]
+    bus_ids = {bus: i for i, bus in enumerate(buses)}
+
+    nodes = [node for package in packages for node in package.get_nodes()]
+    node_ids = {node: i for i, node in enumerate(nodes)}
+
+    messages = [message for node in nodes for message in node.get_messages()]
+
+    enum_types = [enum_type for node in nodes for enum_type in node.get_enum_types()]
+
+    def encode_type(type: model.MessageFieldType):
+        if isinstance(type, model.EnumMessageFieldType):
+            return node_ids[type.node], s(type.enum)
+        else:
+            return -1, s(type.type_name)
+
+    def encode_timedelta(value: Optional[timedelta]) -> Optional[int]:
+        return value // timedelta(microseconds=1) if value is not None else None
+
+    tables = (
+        tuple(s(package.name) for package in packages),
+        tuple((package_ids[bus.package], s(bus.name), bus.dbc_id, bus.bitrate) for bus in buses),
+        tuple((package_ids[node.package], s(node.name), s(node.description), node in db.nodes) for node in nodes),
+        tuple((node_ids[enum_type.node], s(enum_type.name), s(enum_type.description),
+               tuple((s(item.name), s(item.description), item.value) for item in enum_type.items))
+              for enum_type in enum_types),
+        tuple((node_ids[message.unit], s(message.name), s(message.description),
+               _FRAME_TYPES.index(message.frame_type), message.can_id, encode_timedelta(message.timeout),
+               encode_timedelta(message.tx_period), bus_ids[message.bus] if message.bus is not None else -1,
+               tuple((s(field.name), s(field.description), *encode_type(field.type), field.size_in_bits,
+                      field.array_length, s(field.unit), s(field.factor), s(field.offset), s(field.min), s(field.max))
+                     for field in message.fields),
+               tuple((node_ids[link.node], _LINK_TYPES.index(link.link_type)) for link in message.node_links))
+              for message in messages),
+        tuple((node_ids[link.node], bus_ids[link.bus], s(link.note)) for node in nodes for link in node.bus_links),
+    )
+
+    # write to a temporary file first, so that readers never see a partial snapshot
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, source_hash))
+        marshal.dump(tables, f)
+
+    os.replace(tmp_path, path)
+
+
+def _load(path, source_hash: Optional[bytes], strings: Optional[StringTable]) -> JsonProtocolDatabase:
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            snapshot_hash = _unpack_header(source[:HEADER.size])
+
+            if source_hash is not None and snapshot_hash != source_hash:
+                raise StaleSnapshotError(f'{path} was not made from the current version of the model')
+
+            with memoryview(source) as view, view[HEADER.size:] as payload:
+                package_table, bus_table, node_table, enum_type_table, message_table, bus_link_table = \
+                    marshal.loads(payload)
+    except (EOFError, TypeError, ValueError) as ex:
+        # truncated, empty (cannot be mapped), or written by a Python version with a different marshal format
+        raise SnapshotError(f'{path} is corrupt: {ex}') from ex
+
+    db = JsonProtocolDatabase(__do_not_use_directly__=True)
+
+    if strings is not None:
+        db.strings = strings
+
+    # marshal already shares equal strings within the snapshot; the table extends that to other databases
+    intern = db.strings.intern
+
+    packages = []
+
+    for name in package_table:
+        package = Package(name)
+        package.buses_by_name = {}
+        package.nodes_by_name = {}
+
+        db.packages[name] = package
+        packages.append(package)
+
+    buses = []
+
+    for package_id, name, dbc_id, bitrate in bus_table:
+        package = packages[package_id]
+
+        bus = Bus(package, name, dbc_id=dbc_id, bitrate=bitrate)
+        bus.node_links = set()
+
+        package.buses_by_name[name] = bus
+        buses.append(bus)
+
+    nodes = []
+
+    for package_id, name, description, listed in node_table:
+        package = packages[package_id]
+
+        node = Node(package, name, intern(description))
+        node.bus_links = []
+        node.enum_types_by_name = {}
+        node.messages_by_name = {}
+        node.message_links = set()
+
+        package.nodes_by_name[name] = node
+        nodes.append(node)
+
+        # nodes created just in time for foreign references are not listed
+        if listed:
+            db.nodes.add(node)
+
+    for node_id, name, description, items in enum_type_table:
+        node = nodes[node_id]
+
+        enum_type = EnumType(name, intern(description), node)
+        enum_type.items = db.strings.enum_items(db.strings.enum_item(*item) for item in items)
+        node.enum_types_by_name[name] = enum_type
+
+    primitive_types = model.MESSAGE_FIELD_PRIMITIVE_TYPES
+
+    for (node_id, name, description, frame_type, can_id, timeout, tx_period, bus_id, field_table,
+         link_table) in message_table:
+        node = nodes[node_id]
+
+        message = Message(node, name, intern(description),
+                          frame_type=_FRAME_TYPES[frame_type],
+                          can_id=can_id,
+                          timeout=timedelta(microseconds=timeout) if timeout is not None else None,
+                          tx_period=timedelta(microseconds=tx_period) if tx_period is not None else None)
+        message.bus = buses[bus_id] if bus_id >= 0 else None
+        message.fields = []
+        message.node_links = []
+
+        for (field_name, field_description, type_node_id, type_name, size_in_bits, array_length, unit, factor,
+             offset, min, max) in field_table:
+            if type_node_id < 0:
+                type = primitive_types[type_name]
+            else:
+                # field types are immutable, so they can be shared
+                type_node = nodes[type_node_id]
+                type = db._enum_field_types.get((type_node, type_name))
+
+                if type is None:
+                    type = model.EnumMessageFieldType(
+                        node=type_node, enum=type_name,
+                        fully_qualified_name=f'{type_node.fully_qualified_name}.{type_name}')
+                    db._enum_field_types[(type_node, type_name)] = type
+
+            field = MessageField(name=intern(field_name), description=intern(field_description), type=type,
+                                 size_in_bits=size_in_bits, array_length=array_length,
+                                 unit=intern(unit), factor=intern(factor), offset=intern(offset),
+                                 min=intern(min), max=intern(max),
+                                 message=message,
+                                 fully_qualified_name=f'{message.fully_qualified_name}.{field_name}')
+            message.fields.append(field)
+            db.message_fields.add(field)
+
+        for link_node_id, link_type in link_table:
+            link_node = nodes[link_node_id]
+
+            link = NodeMessageLink(node=link_node, message=message, link_type=_LINK_TYPES[link_type])
+            message.node_links.append(link)
+            link_node.message_links.add(link)
+
+        node.messages_by_name[name] = message
+        db.messages.add(message)
+
+    for node_id, bus_id, note in bus_link_table:
+        node = nodes[node_id]
+        bus = buses[bus_id]
+
+        link = NodeBusLink(node, bus, intern(note))
+        node.bus_links.append(link)
+        bus.node_links.add(link)
+
+    db._add_to_indexes(packages)
+    return db
+
+
+def _unpack_header(header: bytes) -> bytes:
+    if len(header) < HEADER.size:
+        raise SnapshotError('Not a ProtoDB snapshot')
+
+    magic, format_version, source_hash = HEADER.unpack(header)
+
+    if magic != MAGIC:
+        raise SnapshotError('Not a ProtoDB snapshot')
+    elif format_version != FORMAT_VERSION:
+        raise SnapshotError(f'Unsupported snapshot format version {format_version}')
+
+    return source_hash
@@ -0,0 +1,578 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Watch mode of JsonProtocolDatabase: reload changed packages in place, see JsonProtocolDatabase.with_path.
+
+Files are polled by mtime and size. The packages of a changed file are located without parsing (see _index_packages)
+and only those whose source text differs are parsed again. The new package is then merged into the existing object
+graph:
+
+ - packages, buses and nodes are updated in place, so their identity never changes
+ - messages are kept if they are unchanged (including their fields and links), otherwise replaced by new objects
+ - buses and nodes that were removed, but are still referred to by other packages, remain as placeholders,
+   like the ones created just in time for unknown references while loading
+"""
+
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from . import model
+from .jsonprotocoldatabase import (_index_packages, _ModelBuilder, _split_enum_type, JsonProtocolDatabase,
+                                   Bus, Message, Node, Package)
+from .model import Entity, NodeMessageLinkType
+
+
+@dataclass
+class Changes:
+    """
+    Passed to the callbacks registered by JsonProtocolDatabase.add_change_callback
+    """
+
+    # Names of the packages reloaded
+    packages: Set[str] = field(default_factory=set)
+
+    # Buses, nodes and messages new in the model. A changed message is both removed (the old object)
+    # and added (the new one).
+    added: List[Entity] = field(default_factory=list)
+    removed: List[Entity] = field(default_factory=list)
+    # Buses and nodes changed in place (properties, enum types or bus links)
+    updated: List[Entity] = field(default_factory=list)
+
+
+class Watcher:
+    db: JsonProtocolDatabase
+    strict: bool
+    interval: float
+    callbacks: List[Callable[[Changes], None]]
+    # Identifies the current content of all packages, see ProtocolDatabase.get_version_token
+    version_token: str
+
+    # Either a single file or all *.json files in a directory
+    _path: Path
+    _is_directory: bool
+
+    _file_stats: Dict[Path, Tuple[int, int]]
+    _package_digests: Dict[str, bytes]
+    _package_files: Dict[str, Path]
+    # Removed buses kept because they were still referred to, see _drop_unused_placeholders
+    _placeholder_buses: Set[Bus]
+    _next_poll: float
+
+    def __init__(self, db: JsonProtocolDatabase, path, strict: bool, interval: float = 1.0):
+        self.db = db
+        self.strict = strict
+        self.interval = interval
+        self.callbacks = []
+
+        self._path = Path(path)
+        self._is_directory = self._path.is_dir()
+
+        self._file_stats = {}
+        self._package_digests = {}
+        self._package_files = {}
+        self._placeholder_buses = set()
+
+        for file_path, stat in self._stat_files().items():
+            self._file_stats[file_path] = stat
+
+            for name, (digest, _) in self._digest_packages(file_path.read_bytes()).items():
+                self._package_digests[name] = digest
+                self._package_files[name] = file_path
+
+        self._update_version_token()
+        self._next_poll = time.monotonic() + interval
+
+    def poll(self, force: bool = False) -> Optional[Changes]:
+        """
+        Reload the packages changed since the last poll, at most once per interval unless forced
+
+        :return: the changes, or None if there were none
+        """
+        now = time.monotonic()
+
+        if not force and now < self._next_poll:
+            return None
+
+        with self.db._lock:
+            self._next_poll = now + self.interval
+
+            file_stats = self._stat_files()
+
+            if file_stats == self._file_stats:
+                return None
+
+            dirty_files = {path for path in file_stats.keys() | self._file_stats.keys()
+                           if file_stats.get(path) != self._file_stats.get(path)}
+
+            # new source of each package that has changed, None if it was removed
+            sources: Dict[str, Optional[bytes]] = {}
+            digests: Dict[str, Tuple[bytes, Path]] = {}
+
+            for path in dirty_files:
+                if path in file_stats:
+                    for name, (digest, source) in self._digest_packages(path.read_bytes()).items():
+                        digests[name] = (digest, path)
+
+                        if self._package_digests.get(name) != digest:
+                            sources[name] = source
+
+            for name, path in self._package_files.items():
+                if path in dirty_files and name not in digests:
+                    sources[name] = None
+
+            # parse everything first, so that a broken file (e.g. one being written) leaves the model intact
+            builder = _ModelBuilder(strict=self.strict, strings=self.db.strings)
+            parsed = {}
+
+            for name, source in sources.items():
+                if source is not None:
+                    package = json.loads(source, object_pairs_hook=builder.object_pairs_hook)
+                    parsed[name] = (package, builder.take_pending())
+                else:
+                    parsed[name] = (None, [])
+
+            # a reference failing to resolve halfway through the patching would leave the model inconsistent
+            self._check_references(parsed)
+
+            # from now on, references resolve against the live database
+            builder.db = self.db
+            changes = Changes()
+
+            for name, (package, pending_nodes) in parsed.items():
+                self._patch_package(builder, name, package, pending_nodes, changes)
+
+            self._file_stats = file_stats
+
+            for name, (digest, path) in digests.items():
+                self._package_digests[name] = digest
+                self._package_files[name] = path
+
+            for name, source in sources.items():
+                if source is None:
+                    del self._package_digests[name]
+                    del self._package_files[name]
+
+            if not changes.packages:
+                return None
+
+            self._drop_unused_placeholders()
+            self._update_version_token()
+
+            # the model no longer corresponds to the file it was loaded from
+            self.db._source_hash = None
+
+            for callback in self.callbacks:
+                callback(changes)
+
+            return changes
+
+    def _check_references(self, parsed: Dict[str, Tuple[Optional[Package], List[tuple]]]) -> None:
+        """
+        Make sure that the references of the parsed packages will resolve once they are patched in, i.e. against
+        their new versions and the remaining packages of the live model
+
+        :raise KeyError: for a reference that would fail to resolve when loading the model from scratch
+        """
+        def find_package(package_name: str) -> Optional[Package]:
+            if package_name in parsed:
+                return parsed[package_name][0]
+            else:
+                return self.db.packages.get(package_name)
+
+        def check_bus(bus_fqn: str) -> None:
+            package_name, bus_name = bus_fqn.split('.')
+            package = find_package(package_name)
+
+            if package is None or bus_name not in package.buses_by_name:
+                raise KeyError(bus_fqn)
+
+        def check_node(node_fqn: str) -> None:
+            package_name, node_name = node_fqn.split('.')
+            package = find_package(package_name)
+
+            if package is None or node_name not in package.nodes_by_name:
+                raise KeyError(node_fqn)
+
+        for name, (package, pending_nodes) in parsed.items():
+            for _, bus_link_models, message_refs in pending_nodes:
+                # otherwise created just in time
+                if self.strict:
+                    for bus_fqn, _ in bus_link_models:
+                        check_bus(bus_fqn)
+
+                for _, bus_fqn, received_by, sent_by, field_types in message_refs:
+                    if bus_fqn is not None:
+                        check_bus(bus_fqn)
+
+                    if self.strict:
+                        for node_fqn in [*received_by, *sent_by]:
+                            check_node(node_fqn)
+
+                    for type_str in field_types:
+                        if type_str in model.MESSAGE_FIELD_PRIMITIVE_TYPES:
+                            continue
+                        elif type_str.startswith("enum "):
+                            check_node(f'{name}.{_split_enum_type(type_str)[0]}')
+                        else:
+                            raise Exception(f"Invalid type {type_str}")
+
+    def _digest_packages(self, data: bytes) -> Dict[str, Tuple[bytes, bytes]]:
+        """
+        :return: (digest, source) of each package in a JSON2 model
+        """
+        version, ranges = _index_packages(data)
+        assert version == 2
+
+        packages = {}
+
+        for name, (start, end) in ranges.items():
+            source = data[start:end]
+            packages[name] = (hashlib.sha256(source).digest(), source)
+
+        return packages
+
+    def _patch_package(self, builder: _ModelBuilder, name: str, new: Optional[Package], pending_nodes: List[tuple],
+                       changes: Changes) -> None:
+        db = self.db
+        old = db.packages.get(name)
+
+        changes.packages.add(name)
+
+        if old is None:
+            if new is None:
+                return
+
+            db.packages[name] = new
+            self._add_new_nodes(new.get_nodes(), changes)
+            changes.added.extend(new.get_buses())
+            builder.resolve(pending_nodes)
+            db._add_to_indexes([new])
+            return
+
+        old_buses = dict(old.buses_by_name)
+        old_nodes = dict(old.nodes_by_name)
+        old_bus_links = {node: [(link.bus.fully_qualified_name, link.note) for link in node.bus_links]
+                         for node in old_nodes.values()}
+
+        self._unindex_package(old)
+
+        # bus links of all nodes are resolved again below
+        for node in old_nodes.values():
+            for link in node.bus_links:
+                link.bus.node_links.discard(link)
+
+            node.bus_links = []
+
+        buses_by_name = {}
+        nodes_by_name = {}
+        removed_messages = []
+        resolved_nodes = []
+
+        for bus in (new.get_buses() if new is not None else ()):
+            old_bus = old_buses.pop(bus.name, None)
+
+            if old_bus is None:
+                bus.package = old
+                changes.added.append(bus)
+                buses_by_name[bus.name] = bus
+            else:
+                self._placeholder_buses.discard(old_bus)
+
+                if (old_bus.dbc_id, old_bus.bitrate) != (bus.dbc_id, bus.bitrate):
+                    old_bus.dbc_id = bus.dbc_id
+                    old_bus.bitrate = bus.bitrate
+                    changes.updated.append(old_bus)
+
+                buses_by_name[bus.name] = old_bus
+
+        pending_by_node = {pending[0]: pending for pending in pending_nodes}
+
+        for node in (new.get_nodes() if new is not None else ()):
+            _, bus_link_models, message_refs = pending_by_node[node]
+            old_node = old_nodes.pop(node.name, None)
+
+            if old_node is None:
+                node.package = old
+            elif old_node not in db.nodes:
+                # so far only a placeholder for references from other packages; keep it, because they point to it
+                old_node.description = node.description
+                old_node.enum_types_by_name = node.enum_types_by_name
+                old_node.messages_by_name = node.messages_by_name
+
+                for enum_type in old_node.get_enum_types():
+                    enum_type.node = old_node
+
+                for message in old_node.get_messages():
+                    message.unit = old_node
+
+                node = old_node
+            else:
+                updated, message_refs = self._patch_node(old_node, node, message_refs, removed_messages, changes)
+
+                if updated or old_bus_links[old_node] != list(bus_link_models):
+                    changes.updated.append(old_node)
+
+                nodes_by_name[node.name] = old_node
+                resolved_nodes.append((old_node, bus_link_models, message_refs))
+                continue
+
+            self._add_new_nodes([node], changes)
+            nodes_by_name[node.name] = node
+            resolved_nodes.append((node, bus_link_models, message_refs))
+
+        # whatever is left was removed from the model
+        for node in old_nodes.values():
+            if node in db.nodes:
+                db.nodes.discard(node)
+                changes.removed.append(node)
+
+            removed_messages.extend(node.get_messages())
+            changes.removed.extend(node.get_messages())
+
+            node.description = None
+            node.enum_types_by_name = {}
+            node.messages_by_name = {}
+
+        for message in removed_messages:
+            for link in message.node_links:
+                link.node.message_links.discard(link)
+
+            db.messages.discard(message)
+            db.message_fields.difference_update(message.fields)
+
+        # keep removed nodes and buses still referred to from other packages (or from the unchanged messages),
+        # as if they were created just in time
+        for node in old_nodes.values():
+            if node.message_links:
+                nodes_by_name[node.name] = node
+
+        referenced_buses = set()
+
+        if old_buses:
+            # messages not resolved yet will resolve their bus again
+            unresolved = {ref[0] for _, _, message_refs in resolved_nodes for ref in message_refs}
+            removed_buses = set(old_buses.values())
+            referenced_buses = {message.bus for message in db.messages
+                                if message not in unresolved and message.bus in removed_buses}
+
+        for bus in old_buses.values():
+            changes.removed.append(bus)
+
+            if bus.node_links or bus in referenced_buses:
+                bus.dbc_id = None
+                bus.bitrate = None
+                buses_by_name[bus.name] = bus
+                self._placeholder_buses.add(bus)
+
+        old.buses_by_name = buses_by_name
+        old.nodes_by_name = nodes_by_name
+
+        if new is None and not buses_by_name and not nodes_by_name:
+            del db.packages[name]
+            return
+
+        builder.resolve(resolved_nodes)
+        db._add_to_indexes([old])
+
+    def _patch_node(self, old_node: Node, node: Node, message_refs: List[tuple], removed_messages: List[Message],
+                    changes: Changes) -> Tuple[bool, List[tuple]]:
+        """
+        Move the contents of a freshly parsed node into the existing one, keeping unchanged messages and enum types
+
+        :param message_refs: unresolved references of the messages of `node`
+        :return: (True if anything but the messages has changed, references of the messages to be resolved)
+        """
+        updated = old_node.description != node.description
+        old_node.description = node.description
+
+        enum_types_by_name = {}
+
+        for enum_type in node.get_enum_types():
+            old_enum_type = old_node.enum_types_by_name.get(enum_type.name)
+
+            # items are canonical (see StringTable), so equal lists are the same object
+            if (old_enum_type is not None and old_enum_type.description == enum_type.description and
+                    old_enum_type.items == enum_type.items):
+                enum_types_by_name[enum_type.name] = old_enum_type
+            else:
+                enum_type.node = old_node
+                enum_types_by_name[enum_type.name] = enum_type
+                updated = True
+
+        if enum_types_by_name.keys() != old_node.enum_types_by_name.keys():
+            updated = True
+
+        old_node.enum_types_by_name = enum_types_by_name
+
+        old_messages = dict(old_node.messages_by_name)
+        messages_by_name = {}
+        unresolved_refs = []
+
+        for ref in message_refs:
+            message = ref[0]
+            old_message = old_messages.pop(message.name, None)
+
+            if (old_message is not None and
+                    _message_signature(old_message) == _parsed_message_signature(old_node.package.name, *ref)):
+                messages_by_name[message.name] = old_message
+                continue
+
+            message.unit = old_node
+            messages_by_name[message.name] = message
+            unresolved_refs.append(ref)
+
+            self.db.messages.add(message)
+            self.db.message_fields.update(message.fields)
+            changes.added.append(message)
+
+            if old_message is not None:
+                removed_messages.append(old_message)
+                changes.removed.append(old_message)
+
+        removed_messages.extend(old_messages.values())
+        changes.removed.extend(old_messages.values())
+
+        old_node.messages_by_name = messages_by_name
+        return updated, unresolved_refs
+
+    def _add_new_nodes(self, nodes, changes: Changes) -> None:
+        for node in nodes:
+            self.db.nodes.add(node)
+            changes.added.append(node)
+            changes.added.extend(node.get_messages())
+
+            for message in node.get_messages():
+                self.db.messages.add(message)
+                self.db.message_fields.update(message.fields)
+
+    def _drop_unused_placeholders(self) -> None:
+        """
+        Forget the placeholders (and packages created just in time) that are no longer referred to by anything,
+        so that the model ends up the same as if loaded from scratch
+        """
+        db = self.db
+        referenced_buses = None
+
+        for name, package in list(db.packages.items()):
+            defined = name in self._package_files
+
+            candidates = [bus for bus in package.get_buses()
+                          if not bus.node_links and (not defined or bus in self._placeholder_buses)]
+
+            if candidates and referenced_buses is None:
+                referenced_buses = {message.bus for message in db.messages}
+
+            for bus in candidates:
+                if bus not in referenced_buses:
+                    del package.buses_by_name[bus.name]
+                    db._buses_by_fqn.pop(bus.fully_qualified_name, None)
+                    db._messages_by_bus.pop(bus, None)
+                    self._placeholder_buses.discard(bus)
+
+            for node in list(package.get_nodes()):
+                if node not in db.nodes and not node.message_links:
+                    del package.nodes_by_name[node.name]
+                    db._nodes_by_fqn.pop(node.fully_qualified_name, None)
+
+            if not defined and not package.buses_by_name and not package.nodes_by_name:
+                del db.packages[name]
+
+    def _stat_files(self) -> Dict[Path, Tuple[int, int]]:
+        paths = sorted(self._path.glob('*.json')) if self._is_directory else [self._path]
+        stats = {}
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # e.g. being replaced right now; the next poll will see the new version
+                continue
+
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+
+        return stats
+
+    def _update_version_token(self) -> None:
+        token = hashlib.sha256()
+
+        for name, digest in sorted(self._package_digests.items()):
+            token.update(name.encode() + b'\0' + digest)
+
+        self.version_token = token.hexdigest()
+
+    def _unindex_package(self, package: Package) -> None:
+        db = self.db
+
+        for bus in package.get_buses():
+            db._buses_by_fqn.pop(bus.fully_qualified_name, None)
+            db._messages_by_bus.pop(bus, None)
+
+        for node in package.get_nodes():
+            db._nodes_by_fqn.pop(node.fully_qualified_name, None)
+
+            for message in node.get_messages():
+                db._messages_by_fqn.pop(message.fully_qualified_name, None)
+
+                if message.bus is not None:
+                    key = (message.bus, message.can_id, message.frame_type)
+
+                    if db._messages_by_can_id.get(key) is message:
+                        del db._messages_by_can_id[key]
+
+        db.enum_types = [enum_type for enum_type in db.enum_types if enum_type.node.package is not package]
+
+
+def _message_signature(message: Message) -> tuple:
+    return (message.description, message.frame_type, message.can_id, message.timeout, message.tx_period,
+            message.bus.fully_qualified_name if message.bus is not None else None,
+            [(link.node.fully_qualified_name, link.link_type) for link in message.node_links],
+            [(field.name, field.description, _type_key(field.type), field.size_in_bits, field.array_length,
+              field.unit, field.factor, field.offset, field.min, field.max) for field in message.fields])
+
+
+def _parsed_message_signature(package_name: str, message: Message, bus_fqn: Optional[str], received_by: List[str],
+                              sent_by: List[str], field_types: List[str]) -> tuple:
+    # must match _message_signature of the message once resolved (see _ModelBuilder._resolve_node)
+    return (message.description, message.frame_type, message.can_id, message.timeout, message.tx_period,
+            bus_fqn,
+            [(node_fqn, NodeMessageLinkType.RECEIVER) for node_fqn in received_by] +
+            [(node_fqn, NodeMessageLinkType.SENDER) for node_fqn in sent_by],
+            [(field.name, field.description, _type_str_key(package_name, type_str), field.size_in_bits,
+              field.array_length, field.unit, field.factor, field.offset, field.min, field.max)
+             for field, type_str in zip(message.fields, field_types)])
+
+
+def _type_key(type: model.MessageFieldType):
+    if isinstance(type, model.EnumMessageFieldType):
+        return type.node.fully_qualified_name, type.enum
+    else:
+        return type.type_name
+
+
+def _type_str_key(package_name: str, type_str: str):
+    if type_str.startswith("enum "):
+        node_name, enum = _split_enum_type(type_str)
+        return f'{package_name}.{node_name}', enum
+    else:
+        return type_str
@@ -0,0 +1,138 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Placement of message fields in the payload, shared by the exporters.
+
+Fields are placed in order. Each element of a field whose size is a multiple of 8 bits is appended as whole bytes.
+Other elements fill the free bits of the bytes used so far, lowest byte (and bit) first, and spill over into new bytes
+at the end; consequently, they may be split into non-adjacent pieces.
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Sequence, Tuple
+
+from .model import Message
+
+
+@dataclass(frozen=True)
+class BitRange:
+    """
+    Bits [shift, shift + bits) of a byte of the payload
+    """
+
+    byte: int
+    shift: int
+    bits: int
+
+    @property
+    def mask(self) -> int:
+        return ((1 << self.bits) - 1) << self.shift
+
+
+@dataclass(frozen=True)
+class FieldLayout:
+    # First bit of the first element (byte * 8 + shift); None for empty arrays
+    start_bit: Optional[int]
+    # Pieces of each array element, from the least significant bits of the value
+    elements: Tuple[Tuple[BitRange, ...], ...]
+
+
+@dataclass(frozen=True)
+class MessageLayout:
+    fields: Tuple[FieldLayout, ...]
+    num_bytes: int
+
+
+def get_message_layout(message: Message) -> MessageLayout:
+    """
+    The result is shared by all messages with fields of the same sizes, and recomputed once the sizes change.
+    """
+    return compute_layout(tuple((field.size_in_bits, field.array_length) for field in message.fields))
+
+
+@lru_cache(maxsize=4096)
+def compute_layout(field_sizes: Sequence[Tuple[int, int]]) -> MessageLayout:
+    """
+    :param field_sizes: (size in bits, array length) of each field; must be hashable
+    """
+    # Bytes are always filled from bit 0 up, so the number of used bits describes a byte completely
+    used_bits = bytearray()
+    # Bitmap of the bytes that still have free bits, to find them without scanning the full ones
+    partial_bytes = 0
+
+    fields = []
+
+    for size_in_bits, array_length in field_sizes:
+        start_bit = None
+        elements = []
+
+        for i in range(array_length):
+            ranges = []
+            remaining = size_in_bits
+
+            if remaining % 8 == 0:
+                # multiple of 8 bits - always append to the end
+                if start_bit is None:
+                    start_bit = len(used_bits) * 8
+
+                for _ in range(remaining // 8):
+                    ranges.append(BitRange(len(used_bits), 0, 8))
+                    used_bits.append(8)
+            else:
+                # fill the non-full bytes first
+                candidates = partial_bytes
+
+                while remaining and candidates:
+                    lowest = candidates & -candidates
+                    candidates ^= lowest
+                    byte = lowest.bit_length() - 1
+
+                    shift = used_bits[byte]
+                    use = min(remaining, 8 - shift)
+
+                    if start_bit is None:
+                        start_bit = byte * 8 + shift
+
+                    ranges.append(BitRange(byte, shift, use))
+                    remaining -= use
+                    used_bits[byte] += use
+
+                    if used_bits[byte] == 8:
+                        partial_bytes ^= lowest
+
+                if start_bit is None:
+                    start_bit = len(used_bits) * 8
+
+                # any bits left over? - put them at the end
+                while remaining:
+                    use = min(remaining, 8)
+
+                    if use < 8:
+                        partial_bytes |= 1 << len(used_bits)
+
+                    ranges.append(BitRange(len(used_bits), 0, use))
+                    used_bits.append(use)
+                    remaining -= use
+
+            elements.append(tuple(ranges))
+
+        fields.append(FieldLayout(start_bit, tuple(elements)))
+
+    return MessageLayout(tuple(fields), len(used_bits))
@@ -30,10 +30,14 @@ class FrameType(Enum):
 
 
 class Entity:
-    pass
+    # Entities use __slots__ throughout, to save the memory of a per-instance __dict__.
+    # Backends can still compute attributes lazily in __getattr__, which is called for slots not assigned yet.
+    __slots__ = ()
 
 
 class Package(Entity):
+    __slots__ = ('name', 'fully_qualified_name')
+
     name: str
     fully_qualified_name: str
 
@@ -42,6 +46,8 @@ class Package(Entity):
 
 
 class Bus(Entity):
+    __slots__ = ('name', 'fully_qualified_name', 'dbc_id', 'bitrate', 'package')
+
     name: str
     fully_qualified_name: str
     dbc_id: Optional[int]
@@ -54,6 +60,8 @@ class Bus(Entity):
 
 
 class Node(Entity):
+    __slots__ = ('name', 'description', 'fully_qualified_name', 'package')
+
     name: str
     description: Optional[str]
     fully_qualified_name: str
@@ -66,12 +74,17 @@ class Node(Entity):
 
 @dataclass(eq=False)
 class NodeBusLink:
+    __slots__ = ('node', 'bus', 'note')
+
     node: Node
     bus: Bus
     note: str
 
 
 class Message(Entity):
+    __slots__ = ('name', 'description', 'fully_qualified_name', 'frame_type', 'can_id', 'timeout', 'tx_period',
+                 'bus', 'fields', 'unit')
+
     name: str
     description: str
     fully_qualified_name: str
@@ -88,12 +101,21 @@ class Message(Entity):
         return f'Message({self.fully_qualified_name})'
 
 
+@dataclass(frozen=True)
+class CodeGenerationOptions:
+    # Set per node in the web UI; consumed by candb-codegen (see protodb.export.codegen)
+    code_model_version: int = 1
+    advanced_options: Optional[str] = None
+
+
 class MessageFieldType:
-    pass
+    __slots__ = ()
 
 
 @dataclass(eq=False)
 class BasicMessageFieldType(MessageFieldType):
+    __slots__ = ('type_name',)
+
     type_name: str
 
     def __repr__(self):
@@ -102,6 +124,8 @@ class BasicMessageFieldType(MessageFieldType):
 
 @dataclass(eq=False)
 class EnumMessageFieldType(MessageFieldType):
+    __slots__ = ('node', 'enum', 'fully_qualified_name')
+
     node: Node
     enum: str
 
@@ -128,8 +152,11 @@ MESSAGE_FIELD_PRIMITIVE_TYPES = {
 }
 
 
-@dataclass(eq=False)
 class MessageField(Entity):
+    # Not a dataclass, because defaults cannot be combined with __slots__
+    __slots__ = ('name', 'description', 'type', 'size_in_bits', 'array_length', 'unit', 'factor', 'offset', 'min',
+                 'max', 'message', 'fully_qualified_name')
+
     name: str
     description: str
 
@@ -137,14 +164,31 @@ class MessageField(Entity):
     size_in_bits: int       # TODO: long-term, shouldn't this be part of Type ?
     array_length: int       # TODO: long-term, shouldn't this be part of Type ?
 
-    unit: Optional[str] = None
-    factor: Optional[str] = None
-    offset: Optional[str] = None
-    min: Optional[str] = None
-    max: Optional[str] = None
+    unit: Optional[str]
+    factor: Optional[str]
+    offset: Optional[str]
+    min: Optional[str]
+    max: Optional[str]
 
-    message: Message = None
-    fully_qualified_name: Optional[str] = None
+    message: Message
+    fully_qualified_name: Optional[str]
+
+    def __init__(self, name: str, description: str, type: MessageFieldType, size_in_bits: int, array_length: int,
+                 unit: Optional[str] = None, factor: Optional[str] = None, offset: Optional[str] = None,
+                 min: Optional[str] = None, max: Optional[str] = None, message: Message = None,
+                 fully_qualified_name: Optional[str] = None):
+        self.name = name
+        self.description = description
+        self.type = type
+        self.size_in_bits = size_in_bits
+        self.array_length = array_length
+        self.unit = unit
+        self.factor = factor
+        self.offset = offset
+        self.min = min
+        self.max = max
+        self.message = message
+        self.fully_qualified_name = fully_qualified_name
 
     def __repr__(self):
         return f'MessageField({self.fully_qualified_name})'
@@ -163,12 +207,16 @@ class NodeMessageLinkType(Enum):
 
 @dataclass(eq=False)
 class NodeMessageLink:
+    __slots__ = ('node', 'message', 'link_type')
+
     node: Node
     message: Message
     link_type: NodeMessageLinkType
 
 
 class EnumType:
+    __slots__ = ('name', 'description', 'items', 'node', 'fully_qualified_name')
+
     name: str
     description: str
 
@@ -180,6 +228,8 @@ class EnumType:
 
 @dataclass(eq=False)
 class EnumTypeItem:
+    __slots__ = ('name', 'description', 'value')
+
     name: str
     description: str
     value: int
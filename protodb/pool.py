@@ -0,0 +1,137 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+import threading
+import time
+from typing import Callable, Iterator, List, Optional
+
+from .protocoldatabase import ProtocolDatabase
+
+
+class ProtocolDatabasePool:
+    """
+    Pool of database connections for multi-threaded servers.
+
+    Connections are opened on demand, up to `size`. A checked-out connection is used by a single thread at a time
+    and keeps its own entity cache. Backends that support concurrent readers are opened only once and shared.
+    Every checkout starts a new operation on the connection, see ProtocolDatabase.refresh.
+
+    Keeping the caches between checkouts saves queries, but each connection then holds up to
+    SqlProtocolDatabase.cache_size entities (100 000 by default), and SQL databases miss in-place edits of buses,
+    enum types and packages until the changelog moves on.
+    """
+
+    keep_cache: bool
+    size: int
+
+    _cond: threading.Condition
+    _factory: Callable[[], ProtocolDatabase]
+    _idle: List[ProtocolDatabase]
+    _num_opened: int
+    _shared: Optional[ProtocolDatabase]
+
+    def __init__(self, conn_string: str, size: int, factory: Optional[Callable[[str], ProtocolDatabase]] = None,
+                 keep_cache: bool = True):
+        """
+        :param keep_cache: keep the entity caches of the connections between checkouts
+        """
+        if factory is None:
+            from . import connect
+            factory = connect
+
+        assert size >= 1
+
+        self.keep_cache = keep_cache
+        self.size = size
+
+        self._cond = threading.Condition()
+        self._factory = lambda: factory(conn_string)
+        self._idle = []
+        self._num_opened = 0
+        self._shared = None
+
+    def checkin(self, db: ProtocolDatabase) -> None:
+        if db is self._shared:
+            return
+
+        with self._cond:
+            self._idle.append(db)
+            self._cond.notify()
+
+    def checkout(self, timeout: Optional[float] = None) -> ProtocolDatabase:
+        """
+        :param timeout: maximum time in seconds to wait for a connection to become available; None to wait forever
+        :return:
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        db: Optional[ProtocolDatabase] = None
+
+        with self._cond:
+            while True:
+                if self._shared is not None:
+                    db = self._shared
+                    break
+
+                if len(self._idle):
+                    # most recently used first, since it is likely to have the warmest cache
+                    db = self._idle.pop()
+                    break
+
+                if self._num_opened < self.size:
+                    self._num_opened += 1
+                    break
+
+                remaining = deadline - time.monotonic() if deadline is not None else None
+
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError('No database connection available')
+
+                self._cond.wait(remaining)
+
+        if db is None:
+            # open the connection outside of the lock, it can take a while
+            try:
+                db = self._factory()
+            except BaseException:
+                with self._cond:
+                    self._num_opened -= 1
+                    self._cond.notify()
+                raise
+
+            if db.supports_concurrent_readers:
+                with self._cond:
+                    self._shared = db
+                    self._cond.notify_all()
+
+        try:
+            db.refresh(keep_cache=self.keep_cache)
+        except BaseException:
+            self.checkin(db)
+            raise
+
+        return db
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[ProtocolDatabase]:
+        db = self.checkout(timeout=timeout)
+
+        try:
+            yield db
+        finally:
+            self.checkin(db)
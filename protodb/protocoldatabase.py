@@ -17,7 +17,7 @@
 # along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
 
 from abc import ABC, abstractmethod
-from typing import Iterable, Optional
+from typing import Dict, Iterable, Optional
 
 from . import model
 
@@ -27,6 +27,9 @@ class InvalidScopeError(BaseException):
 
 
 class ProtocolDatabase(ABC):
+    # True if a single instance can be used from multiple threads at once, as long as nothing is modified
+    supports_concurrent_readers: bool = False
+
     @abstractmethod
     def delete(self, entity: model.Entity, who_changed: str) -> None:
         pass
@@ -43,6 +46,12 @@ class ProtocolDatabase(ABC):
     def get_bus_nodes(self, bus: model.Bus) -> Iterable[model.Node]:
         pass
 
+    def get_code_generation_options(self, node: model.Node) -> model.CodeGenerationOptions:
+        """
+        Backends that do not store the options report the defaults.
+        """
+        return model.CodeGenerationOptions()
+
     @abstractmethod
     def get_enum_type(self, type: model.EnumMessageFieldType):
         pass
@@ -58,10 +67,34 @@ class ProtocolDatabase(ABC):
         node = self.get_package_node(package, node_name)
         return self.get_node_message(node, message_name)
 
+    def get_message_by_can_id(self, bus: model.Bus, can_id: int, frame_type: model.FrameType
+                              ) -> Optional[model.Message]:
+        """
+        Find the message transmitted on `bus` with the given frame ID. For IDs in a custom format,
+        see protodb.tools.frame_id_parser.FrameIdType.encode.
+
+        :return: None if there is no such message; one of them if there are several (see MessageDuplicateIdCheck)
+        """
+        for message in self.get_associated_messages(bus):
+            if message.can_id == can_id and message.frame_type == frame_type:
+                return message
+
+        return None
+
     @abstractmethod
     def get_messages(self, scope: Optional[model.Entity] = None) -> Iterable[model.Message]:
         pass
 
+    def get_version_token(self) -> Optional[str]:
+        """
+        Identify the current content of the database, e.g. to cache exports (see protodb.export.cache).
+        The token changes whenever the content changes; equal tokens from different connections to the same
+        database mean equal content.
+
+        :return: None if the backend cannot tell (results must not be cached then)
+        """
+        return None
+
     @abstractmethod
     def get_message_fields(self, scope: Optional[model.Entity] = None) -> Iterable[model.MessageField]:
         pass
@@ -72,6 +105,14 @@ class ProtocolDatabase(ABC):
                                ) -> Iterable[model.NodeMessageLink]:
         pass
 
+    def get_node_message_links_for(self, messages: Iterable[model.Message]
+                                   ) -> Dict[model.Message, Iterable[model.NodeMessageLink]]:
+        """
+        Get node links of many messages at once. Backends should override this if they can do better than
+        one get_node_message_links call per message.
+        """
+        return {message: self.get_node_message_links(message=message) for message in messages}
+
     @abstractmethod
     def get_package(self, fully_qualified_name: str) -> model.Package:
         pass
@@ -101,3 +142,26 @@ class ProtocolDatabase(ABC):
     @abstractmethod
     def get_nodes(self, scope: Optional[model.Package] = None) -> Iterable[model.Node]:
         pass
+
+    def load_all(self) -> None:
+        """
+        Hint that the whole database is about to be traversed.
+        Lazily-loading backends may use this to fetch everything up front; the default implementation does nothing.
+        """
+        pass
+
+    def load_package_snapshot(self, package: model.Package) -> None:
+        """
+        Hint that the given package is about to be traversed. See load_all.
+        """
+        pass
+
+    def refresh(self, keep_cache: bool = True) -> None:
+        """
+        Start a new operation (e.g. a request) on the current content of the database. Backends may drop their
+        caches here, so entities obtained before the call must not be mixed with those obtained afterwards.
+        Called by ProtocolDatabasePool whenever a connection is checked out; the default implementation does nothing.
+
+        :param keep_cache: if False, drop any cached entities, so that even changes the backend cannot detect are seen
+        """
+        pass
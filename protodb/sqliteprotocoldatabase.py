@@ -0,0 +1,208 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+
+from .sqlprotocoldatabase import SqlProtocolDatabase
+
+
+# Subset of db_schema/candb.sql needed by the protocol database, translated to SQLite.
+# Keep in sync!
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS `bus` (
+  `id` INTEGER PRIMARY KEY,
+  `package_id` INTEGER NOT NULL,
+  `dbc_id` INTEGER DEFAULT NULL,
+  `name` TEXT NOT NULL,
+  `bitrate` INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS `bus_package_id` ON `bus` (`package_id`);
+
+CREATE TABLE IF NOT EXISTS `changelog` (
+  `id` INTEGER PRIMARY KEY,
+  `table` TEXT NOT NULL,
+  `action` TEXT NOT NULL CHECK (`action` IN ('INSERT', 'UPDATE', 'DELETE')),
+  `row` INTEGER NOT NULL,
+  `who_changed` TEXT NOT NULL,
+  `when_changed` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS `enum_item` (
+  `id` INTEGER PRIMARY KEY,
+  `enum_type_id` INTEGER NOT NULL,
+  `position` INTEGER NOT NULL,
+  `name` TEXT NOT NULL,
+  `value` INTEGER DEFAULT NULL,
+  `description` TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS `enum_item_enum_type_id` ON `enum_item` (`enum_type_id`);
+
+CREATE TABLE IF NOT EXISTS `enum_type` (
+  `id` INTEGER PRIMARY KEY,
+  `node_id` INTEGER NOT NULL,
+  `name` TEXT NOT NULL,
+  `description` TEXT DEFAULT NULL,
+  `who_changed` TEXT NOT NULL DEFAULT '',
+  `when_changed` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE (`node_id`, `name`)
+);
+
+CREATE TABLE IF NOT EXISTS `message` (
+  `id` INTEGER PRIMARY KEY,
+  `node_id` INTEGER NOT NULL,
+  `bus_id` INTEGER DEFAULT NULL,
+  `can_id` INTEGER DEFAULT NULL,
+  `can_id_type` TEXT NOT NULL DEFAULT 'DIRECT',
+  `name` TEXT NOT NULL,
+  `description` TEXT DEFAULT NULL,
+  `tx_period` INTEGER DEFAULT NULL,
+  `timeout` INTEGER DEFAULT NULL,
+  `tx_frequency` TEXT DEFAULT NULL,
+  `who_changed` TEXT NOT NULL DEFAULT '',
+  `when_changed` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `valid` INTEGER NOT NULL DEFAULT 1,
+  UNIQUE (`node_id`, `name`)
+);
+CREATE INDEX IF NOT EXISTS `message_bus_id_can_id` ON `message` (`bus_id`, `can_id`);
+
+CREATE TABLE IF NOT EXISTS `message_field` (
+  `id` INTEGER PRIMARY KEY,
+  `message_id` INTEGER NOT NULL,
+  `position` INTEGER NOT NULL,
+  `name` TEXT NOT NULL,
+  `description` TEXT NOT NULL,
+  `type` TEXT NOT NULL,
+  `bit_size` INTEGER NOT NULL,
+  `array_length` INTEGER NOT NULL,
+  `unit` TEXT DEFAULT NULL,
+  `factor` TEXT DEFAULT NULL,
+  `offset` TEXT DEFAULT NULL,
+  `min` TEXT DEFAULT NULL,
+  `max` TEXT DEFAULT NULL,
+  `valid` INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS `message_field_message_id` ON `message_field` (`message_id`);
+
+CREATE TABLE IF NOT EXISTS `message_node` (
+  `id` INTEGER PRIMARY KEY,
+  `node_id` INTEGER NOT NULL,
+  `message_id` INTEGER NOT NULL,
+  `operation` TEXT NOT NULL CHECK (`operation` IN ('SENDER', 'RECEIVER')),
+  UNIQUE (`node_id`, `message_id`, `operation`)
+);
+CREATE INDEX IF NOT EXISTS `message_node_message_id` ON `message_node` (`message_id`);
+
+CREATE TABLE IF NOT EXISTS `node` (
+  `id` INTEGER PRIMARY KEY,
+  `package_id` INTEGER NOT NULL,
+  `name` TEXT NOT NULL,
+  `description` TEXT NOT NULL,
+  `code_model_version` INTEGER NOT NULL DEFAULT 1,
+  `advanced_options` TEXT DEFAULT NULL,
+  `who_changed` TEXT DEFAULT NULL,
+  `when_changed` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `valid` INTEGER NOT NULL DEFAULT 1,
+  UNIQUE (`package_id`, `name`)
+);
+
+CREATE TABLE IF NOT EXISTS `node_bus` (
+  `id` INTEGER PRIMARY KEY,
+  `bus_id` INTEGER NOT NULL,
+  `node_id` INTEGER NOT NULL,
+  `note` TEXT DEFAULT NULL
+);
+CREATE INDEX IF NOT EXISTS `node_bus_bus_id` ON `node_bus` (`bus_id`);
+CREATE INDEX IF NOT EXISTS `node_bus_node_id` ON `node_bus` (`node_id`);
+
+CREATE TABLE IF NOT EXISTS `package` (
+  `id` INTEGER PRIMARY KEY,
+  `name` TEXT NOT NULL UNIQUE,
+  `who_changed` TEXT NOT NULL DEFAULT '',
+  `when_changed` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+
+class SqliteCursor:
+    """
+    Adapts a sqlite3 cursor to the subset of the mysql.connector cursor API used by SqlProtocolDatabase
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor, dictionary: bool):
+        self.cursor = cursor
+
+        if dictionary:
+            self.cursor.row_factory = SqliteCursor._make_dict
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, query: str, args=()) -> None:
+        self.cursor.execute(query.replace('%s', '?'), args)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size: int):
+        return self.cursor.fetchmany(size)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    @property
+    def rowcount(self) -> int:
+        return self.cursor.rowcount
+
+    @staticmethod
+    def _make_dict(cursor: sqlite3.Cursor, row: tuple) -> dict:
+        return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SqliteProtocolDatabase(SqlProtocolDatabase):
+    """
+    Protocol database stored in a SQLite file with the same table layout as the MySQL database.
+    All queries are shared with SqlProtocolDatabase.
+    """
+
+    conn: sqlite3.Connection
+
+    def reconnect(self) -> None:
+        # an in-memory database only exists in its connection (after fork(), in a private copy of it)
+        if self._conn_string != ':memory:':
+            super().reconnect()
+
+    def transaction_begin(self) -> None:
+        if self.conn.in_transaction:
+            self.conn.rollback()
+
+        self.conn.execute('BEGIN')
+
+    def transaction_commit(self) -> None:
+        self.conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are handed over between threads by ProtocolDatabasePool, but never used concurrently.
+        # isolation_level=None: do not open transactions implicitly, see transaction_begin
+        conn = sqlite3.connect(self._conn_string, isolation_level=None, check_same_thread=False)
+        # create any missing tables, so that a new file can be used right away
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _make_cursor(self, dictionary: bool = False, buffered: bool = False) -> SqliteCursor:
+        # no need for buffering, sqlite3 allows interleaving queries on a connection
+        return SqliteCursor(self.conn.cursor(), dictionary=dictionary)
@@ -21,16 +21,16 @@
 # Should have just used SQLAlchemy...
 
 import sys
+import time
 from datetime import timedelta
 from enum import Enum, auto
 import itertools
-from typing import Iterable, Dict, Optional, Set, Tuple
-
-import mysql.connector
+from typing import Iterable, Dict, List, Optional, Set, Tuple, Type
 
 from . import model
 from . import ProtocolDatabase
 from .protocoldatabase import InvalidScopeError
+from .stringtable import StringTable
 
 
 class ChangelogAction(Enum):
@@ -43,6 +43,8 @@ class ChangelogEntityType(Enum):
 
 
 class Package(model.Package):
+    __slots__ = ('db', 'id')
+
     db: 'SqlProtocolDatabase'
 
     def __init__(self, db: 'SqlProtocolDatabase', id: int, name: str):
@@ -53,6 +55,8 @@ class Package(model.Package):
 
 
 class Bus(model.Bus):
+    __slots__ = ('db', 'id', 'package_id')
+
     db: 'SqlProtocolDatabase'
 
     id: int
@@ -78,11 +82,13 @@ class Bus(model.Bus):
 
 
 class Node(model.Node):
+    __slots__ = ('db', 'id', 'package_id')
+
     db: 'SqlProtocolDatabase'
 
     def __init__(self, db: 'SqlProtocolDatabase', id: int, package_id: int, name: str, description: str):
         self.name = name
-        self.description = description
+        self.description = db.strings.intern(description)
 
         self.db = db
         self.id = id
@@ -98,6 +104,8 @@ class Node(model.Node):
 
 
 class NodeBusLink(model.NodeBusLink):
+    __slots__ = ('db', 'id', 'bus_id', 'node_id')
+
     db: 'SqlProtocolDatabase'
 
     id: int
@@ -110,7 +118,7 @@ class NodeBusLink(model.NodeBusLink):
         self.id = id
         self.bus_id = bus_id
         self.node_id = node_id
-        self.note = note
+        self.note = db.strings.intern(note)
 
     def __eq__(self, other):
         return isinstance(other, NodeBusLink) and self.id == other.id
@@ -123,6 +131,8 @@ class NodeBusLink(model.NodeBusLink):
 
 
 class Message(model.Message):
+    __slots__ = ('db', 'id', 'bus_id', 'unit_id')
+
     db: 'SqlProtocolDatabase'
 
     id: int
@@ -133,7 +143,7 @@ class Message(model.Message):
                  can_id: Optional[int], unit_id: int, name: str, description: str, timeout: Optional[timedelta],
                  tx_period: Optional[timedelta]):
         self.name = name
-        self.description = description
+        self.description = db.strings.intern(description)
         self.frame_type = frame_type
         self.can_id = can_id
         self.timeout = timeout
@@ -158,6 +168,8 @@ class Message(model.Message):
 
 
 class MessageField(model.MessageField):
+    __slots__ = ()
+
     message: Message
 
     def __init__(self, message: Message, name: str, description: str,
@@ -165,14 +177,19 @@ class MessageField(model.MessageField):
                  unit: Optional[str], factor: Optional[str], offset: Optional[str],
                  min: Optional[str], max: Optional[str],
                  ):
-        super().__init__(name=name, description=description, type=type, size_in_bits=size_in_bits, array_length=array_length,
-                         unit=unit, factor=factor, offset=offset, min=min, max=max)
+        intern = message.db.strings.intern
+
+        super().__init__(name=intern(name), description=intern(description), type=type, size_in_bits=size_in_bits,
+                         array_length=array_length, unit=intern(unit), factor=intern(factor), offset=intern(offset),
+                         min=intern(min), max=intern(max))
 
         self.message = message
         self.fully_qualified_name = f'{message.fully_qualified_name}.{name if name else "<reserved>"}'
 
 
 class EnumType(model.EnumType):
+    __slots__ = ('id',)
+
     id: int
 
     def __init__(self, name: str, description: str, items: Iterable[model.EnumTypeItem], node: Node, id: int):
@@ -185,8 +202,61 @@ class EnumType(model.EnumType):
         self.id = id
 
 
+class Snapshot:
+    """
+    In-memory indexes populated by SqlProtocolDatabase.load_package_snapshot and load_all.
+    Presence of a key means that the corresponding collection has been loaded completely.
+    """
+
+    complete: bool
+    package_ids: Set[int]
+
+    buses_by_package_id: Dict[int, List[Bus]]
+    enum_types_by_node_id: Dict[int, List[EnumType]]
+    messages_by_bus_id: Dict[int, List[Message]]
+    # derived from messages_by_bus_id on first use
+    messages_by_can_id: Dict[int, Dict[Tuple[int, model.FrameType], Message]]
+    messages_by_node_id: Dict[int, List[Message]]
+    node_bus_links_by_node_id: Dict[int, List[NodeBusLink]]
+    node_message_links_by_message_id: Dict[int, Set[model.NodeMessageLink]]
+    nodes_by_bus_id: Dict[int, Set[Node]]
+    nodes_by_package_id: Dict[int, List[Node]]
+
+    def __init__(self):
+        self.complete = False
+        self.package_ids = set()
+
+        self.buses_by_package_id = {}
+        self.enum_types_by_node_id = {}
+        self.messages_by_bus_id = {}
+        self.messages_by_can_id = {}
+        self.messages_by_node_id = {}
+        self.node_bus_links_by_node_id = {}
+        self.node_message_links_by_message_id = {}
+        self.nodes_by_bus_id = {}
+        self.nodes_by_package_id = {}
+
+
+MESSAGE_COLUMNS = ('message.id, message.node_id AS unit_id, message.name, message.description, message.bus_id, '
+                   'message.can_id, message.can_id_type, message.timeout, message.tx_period')
+
+# Columns of parent entities joined to a row, see SqlProtocolDatabase._cache_joined_parents
+JOINED_NODE_COLUMNS = ('node.id AS `node.id`, node.description AS `node.description`, '
+                       'node.package_id AS `node.package_id`, node.name AS `node.name`')
+JOINED_PACKAGE_COLUMNS = 'package.id AS `package.id`, package.name AS `package.name`'
+
+
+def _is_loaded(entity: model.Entity, name: str) -> bool:
+    """ Check whether a lazily computed attribute is set, without computing it """
+    try:
+        object.__getattribute__(entity, name)
+        return True
+    except AttributeError:
+        return False
+
+
 def build_filter(query: str, kwargs: dict) -> Tuple[str, Tuple]:
-    """ Dynamically append WHERE clause to query and populate argument tuple """
+    """ Dynamically append WHERE clause to query and populate argument tuple. Keys can be qualified (table.column) """
 
     args = []
 
@@ -199,7 +269,7 @@ def build_filter(query: str, kwargs: dict) -> Tuple[str, Tuple]:
         else:
             query += ' AND '
 
-        query += f'`{key}` = %s'
+        query += '.'.join(f'`{part}`' for part in key.split('.')) + ' = %s'
 
         args.append(str(value))
 
@@ -207,32 +277,63 @@ def build_filter(query: str, kwargs: dict) -> Tuple[str, Tuple]:
 
 
 class SqlProtocolDatabase(ProtocolDatabase):
-    buses_by_id: Dict[int, Bus] = {}
-    enum_types_by_id: Dict[int, EnumType] = {}
-    messages_by_id: Dict[int, Message] = {}
-    packages_by_id: Dict[int, Package] = {}
-    packages_by_name: Dict[str, Package] = {}
-    units_by_id: Dict[int, Node] = {}
-
-    all_buses: Iterable[Bus] = None
-    all_enum_types: Iterable[EnumType] = None
-    all_messages: Iterable[Message] = None
-    all_units: Iterable[Node] = None
-    have_all_packages: bool = False         # put them in packages_by_*
-
-    conn: mysql.connector.MySQLConnection
-    _connection_kwargs: dict
-
-    def __init__(self, conn_string, run_consistency_checks=True):
-        kwargs = {key: value for (key, value) in
-                  [pair.split('=') for pair in conn_string.replace('mysql:', '').split(';')]}
-
-        if 'dbname' in kwargs:
-            kwargs['database'] = kwargs['dbname']
-            del kwargs['dbname']
-
-        self._connection_kwargs = kwargs
-        self.conn = mysql.connector.connect(**kwargs)
+    """
+    Entities are cached per instance and shared between queries, so that each database row maps to a single object.
+    The cache is dropped by refresh() when it has grown beyond cache_size entities or when a change of the version
+    token is detected (polled at most every cache_poll_interval seconds), and on an explicit call to invalidate().
+    It is never dropped in the middle of an operation, i.e. between two calls of refresh().
+
+    Note that the version token is derived from the changelog, which only tracks changes of messages and nodes,
+    and from row counts, so edits of buses, enum types and packages in place go unnoticed. For the same reason,
+    the token is not exposed through get_version_token, and exports of SQL databases are never cached.
+    """
+
+    buses_by_id: Dict[int, Bus]
+    enum_types_by_id: Dict[int, EnumType]
+    messages_by_id: Dict[int, Message]
+    packages_by_id: Dict[int, Package]
+    packages_by_name: Dict[str, Package]
+    units_by_id: Dict[int, Node]
+
+    all_buses: Optional[Iterable[Bus]]
+    all_enum_types: Optional[Iterable[EnumType]]
+    all_messages: Optional[Iterable[Message]]
+    all_units: Optional[Iterable[Node]]
+    have_all_packages: bool                 # put them in packages_by_*
+
+    conn: 'mysql.connector.MySQLConnection'
+    # errors of the driver after which _make_cursor reconnects; set by _connect, to import the driver only once
+    _connection_errors: Tuple[Type[Exception], ...] = ()
+    snapshot: Snapshot
+    strings: StringTable
+    _conn_string: str
+    _enum_field_types: Dict[int, model.EnumMessageFieldType]
+    _owns_strings: bool
+
+    cache_poll_interval: Optional[float]
+    cache_size: Optional[int]
+    _cache_version_token: Optional[str]
+    _cache_next_poll: float
+
+    def __init__(self, conn_string, run_consistency_checks=True, cache_size: Optional[int] = 100_000,
+                 cache_poll_interval: Optional[float] = 1.0, strings: Optional[StringTable] = None):
+        """
+        :param conn_string:
+        :param run_consistency_checks:
+        :param cache_size: number of cached entities above which the cache is dropped; None for no limit
+        :param cache_poll_interval: minimum interval in seconds between changelog polls by refresh(); None to never poll
+        :param strings: table to share with other databases; by default, each database has its own,
+                        which is cleared together with the cache
+        """
+        self._conn_string = conn_string
+        self.conn = self._connect()
+
+        self.strings = strings if strings is not None else StringTable()
+        self._owns_strings = strings is None
+
+        self.cache_poll_interval = cache_poll_interval
+        self.cache_size = cache_size
+        self.invalidate()
 
         if run_consistency_checks:
             self.run_consistency_checks()
@@ -246,6 +347,9 @@ class SqlProtocolDatabase(ProtocolDatabase):
             raise InvalidScopeError()
 
     def get_associated_messages(self, bus: Bus) -> Iterable[model.Message]:
+        if bus.id in self.snapshot.messages_by_bus_id:
+            return set(self.snapshot.messages_by_bus_id[bus.id])
+
         return self.get_messages_with_filter(bus_id=bus.id)
 
     def get_bus_by_id(self, bus_id: int, db_row=None) -> Bus:
@@ -263,7 +367,8 @@ class SqlProtocolDatabase(ProtocolDatabase):
         return self.buses_by_id[bus_id]
 
     def get_bus_nodes(self, bus: Bus) -> Iterable[Node]:
-        # TODO: better caching
+        if bus.id in self.snapshot.nodes_by_bus_id:
+            return sorted(self.snapshot.nodes_by_bus_id[bus.id], key=lambda node: node.fully_qualified_name)
 
         cursor = self._make_cursor(dictionary=True)
         cursor.execute('SELECT DISTINCT node.id, node.description, node.package_id, node.name FROM node_bus '
@@ -278,6 +383,9 @@ class SqlProtocolDatabase(ProtocolDatabase):
 
     def get_buses(self, scope: Optional[Package] = None) -> Iterable[Bus]:
         if scope is not None:
+            if scope.id in self.snapshot.buses_by_package_id:
+                return set(self.snapshot.buses_by_package_id[scope.id])
+
             return self.get_buses_with_filter(package_id=scope.id)
         else:
             if self.all_buses is None:
@@ -288,17 +396,30 @@ class SqlProtocolDatabase(ProtocolDatabase):
     def get_buses_with_filter(self, name: Optional[str] = None, package_id: Optional[int] = None) -> Iterable[Bus]:
         buses = set()
 
-        query, args = build_filter('SELECT id, package_id, name, dbc_id, bitrate FROM bus',    # no "valid" field
-                                   dict(name=name, package_id=package_id))
+        query, args = build_filter('SELECT bus.id, bus.package_id, bus.name, bus.dbc_id, bus.bitrate, '
+                                   f'{JOINED_PACKAGE_COLUMNS} FROM bus '    # no "valid" field
+                                   'LEFT JOIN package ON package.id = bus.package_id',
+                                   {'bus.name': name, 'bus.package_id': package_id})
         cursor = self._make_cursor(dictionary=True)
         cursor.execute(query, args)
 
         for row in cursor:
+            self._cache_joined_parents(row)
             buses.add(self.get_bus_by_id(row['id'], db_row=row))
 
         return buses
 
+    def get_code_generation_options(self, node: Node) -> model.CodeGenerationOptions:
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute('SELECT code_model_version, advanced_options FROM node WHERE id = %s', (node.id,))
+        return model.CodeGenerationOptions(**cursor.fetchone())
+
     def get_enum_type(self, type: model.EnumMessageFieldType):
+        if type.node.id in self.snapshot.enum_types_by_node_id:
+            for enum_type in self.snapshot.enum_types_by_node_id[type.node.id]:
+                if enum_type.name == type.enum:
+                    return enum_type
+
         enum_types = self.get_enum_types_with_filter(name=type.enum, node_id=type.node.id)
 
         if len(enum_types) != 0:
@@ -308,7 +429,8 @@ class SqlProtocolDatabase(ProtocolDatabase):
 
         raise Exception(f'No enum type named "{name}" found in node {node.fully_qualified_name}')
 
-    def get_enum_type_by_id(self, enum_type_id: int, db_row=None) -> EnumType:
+    def get_enum_type_by_id(self, enum_type_id: int, db_row=None, items: Optional[List[model.EnumTypeItem]] = None
+                            ) -> EnumType:
         if enum_type_id not in self.enum_types_by_id:
             if db_row is None:
                 cursor = self._make_cursor(dictionary=True)
@@ -323,23 +445,30 @@ class SqlProtocolDatabase(ProtocolDatabase):
             node = self.get_unit_by_id(db_row["node_id"])
             del db_row["node_id"]
 
-            cursor = self._make_cursor(dictionary=True, buffered=True)
-            cursor.execute("SELECT description, name, value FROM enum_item "
-                           "WHERE enum_type_id = %s", (enum_type_id,))
+            if items is None:
+                cursor = self._make_cursor(dictionary=True, buffered=True)
+                cursor.execute("SELECT description, name, value FROM enum_item "
+                               "WHERE enum_type_id = %s", (enum_type_id,))
 
-            items = [model.EnumTypeItem(**row) for row in cursor.fetchall()]
+                items = [self.strings.enum_item(**row) for row in cursor.fetchall()]
 
-            self.enum_types_by_id[enum_type_id] = EnumType(**db_row, node=node, items=items)
+            self.enum_types_by_id[enum_type_id] = EnumType(**db_row, node=node, items=self.strings.enum_items(items))
 
         return self.enum_types_by_id[enum_type_id]
 
     def get_enum_types(self, scope: Optional[model.Entity] = None) -> Iterable[EnumType]:
         if scope is not None:
             if isinstance(scope, Node):
+                if scope.id in self.snapshot.enum_types_by_node_id:
+                    return set(self.snapshot.enum_types_by_node_id[scope.id])
+
                 return self.get_enum_types_with_filter(node_id=scope.id)
             elif isinstance(scope, Package):
-                nodes = self.get_nodes_with_filter(package_id=scope.id)
-                return itertools.chain(*[self.get_enum_types_with_filter(node_id=node.id) for node in nodes])
+                if scope.id in self.snapshot.nodes_by_package_id:
+                    return set(itertools.chain(*[self.snapshot.enum_types_by_node_id[node.id]
+                                                 for node in self.snapshot.nodes_by_package_id[scope.id]]))
+
+                return set(self._load_enum_types('node.valid = 1 AND node.package_id = %s', (scope.id,)))
             else:
                 raise InvalidScopeError()
         else:
@@ -349,25 +478,16 @@ class SqlProtocolDatabase(ProtocolDatabase):
             return self.all_enum_types
 
     def get_enum_types_with_filter(self, name: Optional[str] = None, node_id: Optional[int] = None) -> Iterable[EnumType]:
-        enum_types = set()
-
-        query, args = build_filter('SELECT id, description, node_id, name FROM enum_type ',
-                                   dict(name=name, node_id=node_id))
-        # cursor must be buffered due to get_enum_type_by_id
-        cursor = self._make_cursor(dictionary=True, buffered=True)
-        cursor.execute(query, args)
+        query, args = build_filter('SELECT enum_type.id FROM enum_type WHERE 1 = 1',
+                                   {'enum_type.name': name, 'enum_type.node_id': node_id})
 
-        for row in cursor:
-            enum_types.add(self.get_enum_type_by_id(row['id'], db_row=row))
-
-        return enum_types
+        return set(self._load_enum_types(f'enum_type.id IN ({query})', args))
 
     def get_message_by_id(self, message_id: int, db_row=None) -> Message:
         if message_id not in self.messages_by_id:
             if db_row is None:
                 cursor = self._make_cursor(dictionary=True)
-                cursor.execute('SELECT id, node_id AS unit_id, name, description, bus_id, can_id, can_id_type, timeout, tx_period FROM message '
-                               'WHERE id = %s AND valid = 1', (message_id,))
+                cursor.execute(f'SELECT {MESSAGE_COLUMNS} FROM message WHERE id = %s AND valid = 1', (message_id,))
 
                 db_row = cursor.fetchone()
 
@@ -397,13 +517,47 @@ class SqlProtocolDatabase(ProtocolDatabase):
 
         return self.messages_by_id[message_id]
 
+    def get_message_by_can_id(self, bus: Bus, can_id: int, frame_type: model.FrameType) -> Optional[Message]:
+        if bus.id in self.snapshot.messages_by_bus_id:
+            if bus.id not in self.snapshot.messages_by_can_id:
+                messages_by_can_id = {}
+
+                # in case of conflicts, the lowest ID wins, like below
+                for message in sorted(self.snapshot.messages_by_bus_id[bus.id], key=lambda message: message.id):
+                    if message.can_id is not None:
+                        messages_by_can_id.setdefault((message.can_id, message.frame_type), message)
+
+                self.snapshot.messages_by_can_id[bus.id] = messages_by_can_id
+
+            return self.snapshot.messages_by_can_id[bus.id].get((can_id, frame_type))
+
+        # can_id_type distinguishes more than the frame type (custom ID formats), so that is compared afterwards
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute(f'SELECT {MESSAGE_COLUMNS} FROM message '
+                       'WHERE message.bus_id = %s AND message.can_id = %s AND message.valid = 1 ORDER BY message.id',
+                       (bus.id, can_id))
+
+        for row in cursor.fetchall():
+            message = self.get_message_by_id(row['id'], db_row=row)
+
+            if message.can_id == can_id and message.frame_type == frame_type:
+                return message
+
+        return None
+
     def get_messages(self, scope=None) -> Iterable[Message]:
         if scope is not None:
             if isinstance(scope, Node):
+                if scope.id in self.snapshot.messages_by_node_id:
+                    return set(self.snapshot.messages_by_node_id[scope.id])
+
                 return self.get_messages_with_filter(node_id=scope.id)
             elif isinstance(scope, Package):
-                nodes = self.get_nodes_with_filter(package_id=scope.id)
-                return itertools.chain(*[self.get_messages_with_filter(node_id=node.id) for node in nodes])
+                if scope.id in self.snapshot.nodes_by_package_id:
+                    return set(itertools.chain(*[self.snapshot.messages_by_node_id[node.id]
+                                                 for node in self.snapshot.nodes_by_package_id[scope.id]]))
+
+                return self.get_messages_with_filter(package_id=scope.id)
             else:
                 raise InvalidScopeError()
         else:
@@ -416,34 +570,48 @@ class SqlProtocolDatabase(ProtocolDatabase):
         if scope is not None:
             if isinstance(scope, Message):
                 return scope.fields
-            elif isinstance(scope, Node) or isinstance(scope, Package):
-                messages = self.get_messages(scope=scope)
-                return itertools.chain(*[message.fields for message in messages])
+            elif isinstance(scope, Node):
+                where, args = 'message.valid = 1 AND message.node_id = %s', (scope.id,)
+            elif isinstance(scope, Package):
+                where, args = ('message.valid = 1 AND message.node_id IN '
+                               '(SELECT node.id FROM node WHERE node.package_id = %s AND node.valid = 1)', (scope.id,))
             else:
                 raise InvalidScopeError()
         else:
-            fields = set()
+            where, args = 'message.valid = 1', ()
 
-            for message in self.get_messages():
-                fields.update(message.fields)
+        messages = self.get_messages(scope=scope)
+        self._load_message_fields({message.id: message for message in messages}, where, args)
 
-            return fields
+        if scope is not None:
+            return itertools.chain(*[message.fields for message in messages])
+        else:
+            return set(itertools.chain(*[message.fields for message in messages]))
 
-    def get_messages_with_filter(self, bus_id: Optional[int] = None, name: Optional[str] = None, node_id: Optional[int] = None) -> Iterable[Message]:
+    def get_messages_with_filter(self, bus_id: Optional[int] = None, name: Optional[str] = None, node_id: Optional[int] = None,
+                                 package_id: Optional[int] = None) -> Iterable[Message]:
         messages = set()
 
-        query, args = build_filter('SELECT id, node_id AS unit_id, name, description, can_id, can_id_type, bus_id, timeout, tx_period FROM message '
-                                   'WHERE valid = 1', dict(bus_id=bus_id, name=name, node_id=node_id))
+        query, args = build_filter(f'SELECT {MESSAGE_COLUMNS}, {JOINED_NODE_COLUMNS}, {JOINED_PACKAGE_COLUMNS} FROM message '
+                                   'LEFT JOIN node ON node.id = message.node_id '
+                                   'LEFT JOIN package ON package.id = node.package_id '
+                                   'WHERE message.valid = 1',
+                                   {'message.bus_id': bus_id, 'message.name': name, 'message.node_id': node_id,
+                                    'node.package_id': package_id,
+                                    # mirror get_nodes(scope=package)
+                                    'node.valid': 1 if package_id is not None else None})
         cursor = self._make_cursor(dictionary=True)
         cursor.execute(query, args)
 
         for row in cursor:
+            self._cache_joined_parents(row)
             messages.add(self.get_message_by_id(row['id'], db_row=row))
 
         return messages
 
     def get_node_bus_links(self, node: Node) -> Iterable[NodeBusLink]:
-        # TODO: caching
+        if node.id in self.snapshot.node_bus_links_by_node_id:
+            return list(self.snapshot.node_bus_links_by_node_id[node.id])
 
         cursor = self._make_cursor(dictionary=True)
         cursor.execute('SELECT id, node_id, bus_id, note FROM node_bus WHERE node_id = %s', (node.id,))
@@ -452,6 +620,13 @@ class SqlProtocolDatabase(ProtocolDatabase):
         return [NodeBusLink(self, **kwargs) for kwargs in cursor]
 
     def get_node_message(self, node: Node, name: str) -> model.Message:
+        if node.id in self.snapshot.messages_by_node_id:
+            for message in self.snapshot.messages_by_node_id[node.id]:
+                if message.name == name:
+                    return message
+
+            raise Exception(f'No message named "{name}" found in node {node.fully_qualified_name}')
+
         nodes = self.get_messages_with_filter(name=name, node_id=node.id)
 
         if len(nodes) != 0:
@@ -463,6 +638,9 @@ class SqlProtocolDatabase(ProtocolDatabase):
 
     def get_nodes(self, scope: Optional[Package] = None) -> Iterable[Node]:
         if scope is not None:
+            if scope.id in self.snapshot.nodes_by_package_id:
+                return set(self.snapshot.nodes_by_package_id[scope.id])
+
             return self.get_nodes_with_filter(package_id=scope.id)
         else:
             if self.all_units is None:
@@ -472,53 +650,79 @@ class SqlProtocolDatabase(ProtocolDatabase):
 
     def get_node_message_links(self, message: Optional[Message] = None, node: Optional[Node] = None
                                ) -> Iterable[model.NodeMessageLink]:
-        # TODO: caching
-
         if node is not None:
-            query, args = build_filter('SELECT operation AS link_type, message_id FROM message_node WHERE 1 = 1',
-                                       dict(message_id=message.id if message else None, node_id=node.id if node else None))
+            query, args = build_filter(f'SELECT operation AS link_type, {MESSAGE_COLUMNS} FROM message_node '
+                                       'JOIN message ON message.id = message_node.message_id WHERE message.valid = 1',
+                                       {'message_node.message_id': message.id if message else None,
+                                        'message_node.node_id': node.id})
             cursor = self._make_cursor(dictionary=True)
             cursor.execute(query, args)
 
-            # FIXME: probably cannot do this -- database-linked objects should be unique ?
-            # Also super inefficient (another fetch for every message!)
-            return set(model.NodeMessageLink(node=node,
-                                             message=self.get_message_by_id(row["message_id"]),
-                                             link_type=model.NodeMessageLinkType[row["link_type"]]
-                                             ) for row in cursor)
-        elif message is not None:
-            query, args = build_filter('SELECT operation AS link_type, node.description, node.id, node.name, node.package_id '
-                                       'FROM message_node JOIN node ON message_node.node_id = node.id',
-                                       dict(message_id=message.id))
-            cursor = self._make_cursor(buffered=True, dictionary=True)
-            cursor.execute(query, args)
-
             results = set()
 
             for row in cursor:
-                link_type=model.NodeMessageLinkType[row["link_type"]]
-                del row["link_type"]
-
-                node = self.get_unit_by_id(row['id'], db_row=row)
+                link_type = model.NodeMessageLinkType[row.pop('link_type')]
 
                 # FIXME: probably cannot do this -- database-linked objects should be unique ?
                 results.add(model.NodeMessageLink(node=node,
-                                                  message=message,
+                                                  message=self.get_message_by_id(row['id'], db_row=row),
                                                   link_type=link_type))
 
             return results
+        elif message is not None:
+            return self.get_node_message_links_for([message])[message]
         else:
             raise NotImplementedError()
 
+    def get_node_message_links_for(self, messages: Iterable[Message]
+                                   ) -> Dict[Message, Iterable[model.NodeMessageLink]]:
+        results = {}
+        messages_by_id = {}
+
+        for message in messages:
+            if message.id in self.snapshot.node_message_links_by_message_id:
+                results[message] = set(self.snapshot.node_message_links_by_message_id[message.id])
+            else:
+                results[message] = set()
+                messages_by_id[message.id] = message
+
+        message_ids = list(messages_by_id.keys())
+
+        # keep the IN list at a reasonable length
+        for i in range(0, len(message_ids), 1000):
+            batch = message_ids[i:i + 1000]
+
+            cursor = self._make_cursor(dictionary=True)
+            cursor.execute('SELECT message_node.message_id, message_node.operation AS link_type, '
+                           f'{JOINED_NODE_COLUMNS}, {JOINED_PACKAGE_COLUMNS} FROM message_node '
+                           'JOIN node ON node.id = message_node.node_id '
+                           'LEFT JOIN package ON package.id = node.package_id '
+                           f'WHERE message_node.message_id IN ({", ".join(["%s"] * len(batch))})', batch)
+
+            for row in cursor:
+                node_id = row['node.id']
+                self._cache_joined_parents(row)
+
+                # FIXME: probably cannot do this -- database-linked objects should be unique ?
+                message = messages_by_id[row['message_id']]
+                results[message].add(model.NodeMessageLink(node=self.get_unit_by_id(node_id),
+                                                           message=message,
+                                                           link_type=model.NodeMessageLinkType[row['link_type']]))
+
+        return results
+
     def get_nodes_with_filter(self, name: Optional[str] = None, package_id: Optional[int] = None) -> Iterable[Node]:
         nodes = set()
 
-        query, args = build_filter('SELECT id, description, package_id, name FROM node WHERE valid = 1',
-                                   dict(name=name, package_id=package_id))
+        query, args = build_filter('SELECT node.id, node.description, node.package_id, node.name, '
+                                   f'{JOINED_PACKAGE_COLUMNS} FROM node '
+                                   'LEFT JOIN package ON package.id = node.package_id WHERE node.valid = 1',
+                                   {'node.name': name, 'node.package_id': package_id})
         cursor = self._make_cursor(dictionary=True)
         cursor.execute(query, args)
 
         for row in cursor:
+            self._cache_joined_parents(row)
             nodes.add(self.get_unit_by_id(row['id'], db_row=row))
 
         return nodes
@@ -551,6 +755,13 @@ class SqlProtocolDatabase(ProtocolDatabase):
         return self.packages_by_id[package_id]
 
     def get_package_node(self, package: Package, name: str) -> model.Node:
+        if package.id in self.snapshot.nodes_by_package_id:
+            for node in self.snapshot.nodes_by_package_id[package.id]:
+                if node.name == name:
+                    return node
+
+            raise Exception(f'No node named "{name}" found in package {package.fully_qualified_name}')
+
         nodes = self.get_nodes_with_filter(name=name, package_id=package.id)
 
         if len(nodes) != 0:
@@ -583,22 +794,47 @@ class SqlProtocolDatabase(ProtocolDatabase):
 
         return self.units_by_id[unit_id]
 
-    # TODO: make private
-    def load_message_fields(self, message: Message) -> Iterable[MessageField]:
-        # cursor must be buffered (= fetched all at once) because MessageField's constructor may need to perform
-        # another query to resolve the fully-qualified name
-        cursor = self._make_cursor(dictionary=True, buffered=True)
-        cursor.execute('SELECT bit_size AS size_in_bits, name, description, type, array_length, unit, offset, factor, min, max '
-                       'FROM message_field WHERE message_id = %s AND valid = 1 ORDER BY position',
-                       (message.id,))
+    def invalidate(self) -> None:
+        """
+        Drop all cached entities. Objects obtained before the call remain usable, but are not updated
+        and will not be identical to objects obtained afterwards.
+        """
+        self.buses_by_id = {}
+        self.enum_types_by_id = {}
+        self.messages_by_id = {}
+        self.packages_by_id = {}
+        self.packages_by_name = {}
+        self.units_by_id = {}
+
+        self.all_buses = None
+        self.all_enum_types = None
+        self.all_messages = None
+        self.all_units = None
+        self.have_all_packages = False
+
+        self.snapshot = Snapshot()
+
+        # a shared table may be in use by other databases, so it is left alone
+        if self._owns_strings:
+            self.strings.clear()
+
+        self._enum_field_types = {}
 
-        fields = [] # strictly speaking, it should be an ordered set
+        self._cache_version_token = None
+        self._cache_next_poll = 0
 
-        for kwargs in cursor:
-            kwargs["type"] = self.resolve_type(kwargs["type"])
-            fields.append(MessageField(message, **kwargs))
+    def load_all(self) -> None:
+        if not self.snapshot.complete:
+            self._load_snapshot(package_id=None)
 
-        return fields
+    def load_package_snapshot(self, package: Package) -> None:
+        if not self.snapshot.complete and package.id not in self.snapshot.package_ids:
+            self._load_snapshot(package_id=package.id)
+
+    # TODO: make private
+    def load_message_fields(self, message: Message) -> Iterable[MessageField]:
+        self._load_message_fields({message.id: message}, 'message.id = %s', (message.id,))
+        return message.fields
 
     def resolve_type(self, type_name_or_enum_id: str) -> model.MessageFieldType:
         if type_name_or_enum_id in model.MESSAGE_FIELD_PRIMITIVE_TYPES:
@@ -606,11 +842,32 @@ class SqlProtocolDatabase(ProtocolDatabase):
         else:
             enum_type_id = int(type_name_or_enum_id)
 
-            enum_type = self.get_enum_type_by_id(enum_type_id)
+            # field types are immutable, so they can be shared
+            if enum_type_id not in self._enum_field_types:
+                enum_type = self.get_enum_type_by_id(enum_type_id)
 
-            # node = self.get_package_node(package, node_name)
-            return model.EnumMessageFieldType(node=enum_type.node, enum=enum_type.name,
-                                              fully_qualified_name=enum_type.fully_qualified_name)
+                # node = self.get_package_node(package, node_name)
+                self._enum_field_types[enum_type_id] = model.EnumMessageFieldType(
+                    node=enum_type.node, enum=enum_type.name, fully_qualified_name=enum_type.fully_qualified_name)
+
+            return self._enum_field_types[enum_type_id]
+
+    def refresh(self, keep_cache: bool = True) -> None:
+        # end the transaction left over from the previous operation, so that the queries see the latest commits
+        if self.conn.in_transaction:
+            self.conn.rollback()
+
+        if keep_cache:
+            self._poll_cache()
+        else:
+            self.invalidate()
+
+    def reconnect(self) -> None:
+        """
+        Open a new connection, keeping the cache. Use in a child process after fork(), where the inherited
+        connection must not be used (it is shared with the parent).
+        """
+        self.conn = self._connect()
 
     def run_consistency_checks(self) -> None:
         fixes = set()
@@ -634,7 +891,7 @@ class SqlProtocolDatabase(ProtocolDatabase):
 
     def transaction_begin(self) -> None:
         if self.conn.in_transaction:
-            # unclear why we are in a transaction by default
+            # left open by an operation that failed before committing
             self.conn.rollback()
 
         self.conn.start_transaction()
@@ -656,7 +913,7 @@ class SqlProtocolDatabase(ProtocolDatabase):
         cursor.execute('DELETE FROM message_node WHERE message_id = %s', (message_id,))
         self._put_changelog_entry(ChangelogEntityType.MESSAGE, ChangelogAction.DELETE, message_id, who_changed)
 
-        # FIXME: purge cache (or wait until commit ?)
+        self.invalidate()
 
     def _delete_node_by_id(self, node_id: int, who_changed: str) -> None:
         cursor = self._make_cursor(dictionary=True)
@@ -669,7 +926,7 @@ class SqlProtocolDatabase(ProtocolDatabase):
 
         self._put_changelog_entry(ChangelogEntityType.NODE, ChangelogAction.DELETE, node_id, who_changed)
 
-        # FIXME: purge cache (or wait until commit ?)
+        self.invalidate()
 
     def _get_packages(self) -> Iterable[Package]:
         packages = set()
@@ -682,17 +939,323 @@ class SqlProtocolDatabase(ProtocolDatabase):
 
         return packages
 
+    def _load_snapshot(self, package_id: Optional[int]) -> None:
+        """
+        Load a package (or the entire database, if package_id is None) using a fixed number of queries
+        and build the object graph in memory. Foreign entities referenced by the package (nodes receiving its
+        messages, buses of other packages etc.) are loaded too, but their own collections are not.
+        """
+
+        if package_id is not None:
+            scope_args = (package_id,)
+            node_scope = 'node.package_id = %s'
+            bus_scope = 'bus.package_id = %s'
+            # messages owned by the package + messages of other packages associated to its buses
+            message_scope = ('message.valid = 1 AND (message.node_id IN (SELECT node.id FROM node WHERE node.package_id = %s) '
+                             'OR message.bus_id IN (SELECT bus.id FROM bus WHERE bus.package_id = %s))')
+            message_args = (package_id, package_id)
+        else:
+            scope_args = ()
+            node_scope = '1 = 1'
+            bus_scope = '1 = 1'
+            message_scope = 'message.valid = 1'
+            message_args = ()
+
+        def in_scope(entity_package_id: int) -> bool:
+            return package_id is None or entity_package_id == package_id
+
+        snapshot = self.snapshot
+
+        # Packages (always all of them, there are few)
+        self._get_packages()
+        self.have_all_packages = True
+
+        for package in self.packages_by_id.values():
+            if in_scope(package.id):
+                snapshot.buses_by_package_id[package.id] = []
+                snapshot.nodes_by_package_id[package.id] = []
+
+        # Buses
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute(f'SELECT bus.id, bus.package_id, bus.name, bus.dbc_id, bus.bitrate FROM bus WHERE {bus_scope} '
+                       f'OR bus.id IN (SELECT node_bus.bus_id FROM node_bus JOIN node ON node.id = node_bus.node_id '
+                       f'WHERE {node_scope}) '
+                       f'OR bus.id IN (SELECT message.bus_id FROM message WHERE {message_scope})',
+                       (*scope_args, *scope_args, *message_args))
+
+        for row in cursor:
+            bus = self.get_bus_by_id(row['id'], db_row=row)
+            bus.package = self.get_package_by_id(bus.package_id)
+
+            if in_scope(bus.package_id):
+                snapshot.buses_by_package_id[bus.package_id].append(bus)
+                snapshot.messages_by_bus_id[bus.id] = []
+                snapshot.nodes_by_bus_id[bus.id] = set()
+
+        # Nodes: valid nodes in scope + everything they might refer to or be referred from.
+        # Validity is not checked for the latter to mirror what the on-demand queries return.
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute(f'SELECT node.id, node.description, node.package_id, node.name, node.valid FROM node '
+                       f'WHERE (node.valid = 1 AND {node_scope}) '
+                       f'OR node.id IN (SELECT node_bus.node_id FROM node_bus JOIN bus ON bus.id = node_bus.bus_id '
+                       f'WHERE {bus_scope}) '
+                       f'OR node.id IN (SELECT message_node.node_id FROM message_node '
+                       f'JOIN message ON message.id = message_node.message_id WHERE {message_scope}) '
+                       f'OR node.id IN (SELECT message.node_id FROM message WHERE {message_scope})',
+                       (*scope_args, *scope_args, *message_args, *message_args))
+
+        for row in cursor:
+            valid = row.pop('valid')
+            node = self.get_unit_by_id(row['id'], db_row=row)
+            node.package = self.get_package_by_id(node.package_id)
+
+            if valid and in_scope(node.package_id):
+                snapshot.nodes_by_package_id[node.package_id].append(node)
+                snapshot.enum_types_by_node_id[node.id] = []
+                snapshot.messages_by_node_id[node.id] = []
+                snapshot.node_bus_links_by_node_id[node.id] = []
+
+        # Node-bus links
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute(f'SELECT node_bus.id, node_bus.node_id, node_bus.bus_id, node_bus.note FROM node_bus '
+                       f'JOIN node ON node.id = node_bus.node_id JOIN bus ON bus.id = node_bus.bus_id '
+                       f'WHERE {node_scope} OR {bus_scope}',
+                       (*scope_args, *scope_args))
+
+        for row in cursor:
+            link = NodeBusLink(self, **row)
+            link.bus = self.buses_by_id[link.bus_id]
+            node = self.units_by_id.get(link.node_id)
+
+            # the link may have been already loaded with another package
+            if node is not None and in_scope(node.package_id) and link.node_id in snapshot.node_bus_links_by_node_id:
+                snapshot.node_bus_links_by_node_id[link.node_id].append(link)
+
+            if node is not None and link.bus_id in snapshot.nodes_by_bus_id:
+                snapshot.nodes_by_bus_id[link.bus_id].add(node)
+
+        # Enum types & their items
+        for enum_type in self._load_enum_types(f'node.valid = 1 AND {node_scope}', scope_args):
+            if enum_type.node.id in snapshot.enum_types_by_node_id:
+                snapshot.enum_types_by_node_id[enum_type.node.id].append(enum_type)
+
+        # Messages
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute(f'SELECT {MESSAGE_COLUMNS} FROM message WHERE {message_scope}', message_args)
+
+        messages = []
+
+        for row in cursor:
+            message = self.get_message_by_id(row['id'], db_row=row)
+
+            if message.bus_id is None:
+                message.bus = None
+            elif message.bus_id in self.buses_by_id:
+                message.bus = self.buses_by_id[message.bus_id]
+
+                if in_scope(message.bus.package_id) and message.bus_id in snapshot.messages_by_bus_id:
+                    snapshot.messages_by_bus_id[message.bus_id].append(message)
+
+            if message.unit_id in self.units_by_id:
+                message.unit = self.units_by_id[message.unit_id]
+
+                if in_scope(message.unit.package_id) and message.unit_id in snapshot.messages_by_node_id:
+                    snapshot.messages_by_node_id[message.unit_id].append(message)
+
+            snapshot.node_message_links_by_message_id[message.id] = set()
+            messages.append(message)
+
+        # Node-message links
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute(f'SELECT message_node.message_id, message_node.node_id, message_node.operation AS link_type '
+                       f'FROM message_node JOIN message ON message.id = message_node.message_id '
+                       f'WHERE {message_scope}',
+                       message_args)
+
+        for row in cursor:
+            if row['node_id'] not in self.units_by_id:
+                continue
+
+            link = model.NodeMessageLink(node=self.units_by_id[row['node_id']],
+                                         message=self.messages_by_id[row['message_id']],
+                                         link_type=model.NodeMessageLinkType[row['link_type']])
+            snapshot.node_message_links_by_message_id[row['message_id']].add(link)
+
+        # Message fields
+        self._load_message_fields({message.id: message for message in messages}, message_scope, message_args)
+
+        if package_id is not None:
+            snapshot.package_ids.add(package_id)
+        else:
+            snapshot.complete = True
+            snapshot.package_ids.update(self.packages_by_id.keys())
+
+            self.all_buses = set(itertools.chain(*snapshot.buses_by_package_id.values()))
+            self.all_enum_types = set(itertools.chain(*snapshot.enum_types_by_node_id.values()))
+            self.all_messages = set(messages)
+            self.all_units = set(itertools.chain(*snapshot.nodes_by_package_id.values()))
+
+    def _load_enum_types(self, where: str, args: Tuple) -> List[EnumType]:
+        """
+        Load enum types matching a condition (on enum_type, node) together with their items using two queries
+        """
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute(f'SELECT enum_item.enum_type_id, enum_item.description, enum_item.name, enum_item.value '
+                       f'FROM enum_item JOIN enum_type ON enum_type.id = enum_item.enum_type_id '
+                       f'JOIN node ON node.id = enum_type.node_id WHERE {where} '
+                       f'ORDER BY enum_item.enum_type_id, enum_item.position',
+                       args)
+
+        items_by_enum_type_id: Dict[int, List[model.EnumTypeItem]] = {}
+
+        for row in cursor:
+            enum_type_id = row.pop('enum_type_id')
+            items_by_enum_type_id.setdefault(enum_type_id, []).append(self.strings.enum_item(**row))
+
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute(f'SELECT enum_type.id, enum_type.description, enum_type.node_id, enum_type.name, '
+                       f'{JOINED_NODE_COLUMNS}, {JOINED_PACKAGE_COLUMNS} FROM enum_type '
+                       f'JOIN node ON node.id = enum_type.node_id LEFT JOIN package ON package.id = node.package_id '
+                       f'WHERE {where}',
+                       args)
+
+        enum_types = []
+
+        for row in cursor:
+            self._cache_joined_parents(row)
+            enum_types.append(self.get_enum_type_by_id(row['id'], db_row=row,
+                                                       items=items_by_enum_type_id.get(row['id'], [])))
+
+        return enum_types
+
+    def _load_message_fields(self, messages_by_id: Dict[int, Message], where: str, args: Tuple) -> None:
+        """
+        Load fields of messages matching a condition (on message_field, message) using a single query,
+        plus two to prefetch any enum types not in the cache yet. Messages that already have fields are not updated.
+        """
+        if all(_is_loaded(message, 'fields') for message in messages_by_id.values()):
+            return
+
+        cursor = self._make_cursor(dictionary=True)
+        cursor.execute(f'SELECT message_field.message_id, message_field.bit_size AS size_in_bits, message_field.name, '
+                       f'message_field.description, message_field.type, message_field.array_length, '
+                       f'message_field.unit, message_field.offset, message_field.factor, message_field.min, '
+                       f'message_field.max '
+                       f'FROM message_field JOIN message ON message.id = message_field.message_id '
+                       f'WHERE message_field.valid = 1 AND {where} '
+                       f'ORDER BY message_field.message_id, message_field.position',
+                       args)
+        rows = cursor.fetchall()
+
+        enum_type_ids = tuple({int(row['type']) for row in rows
+                               if row['type'] not in model.MESSAGE_FIELD_PRIMITIVE_TYPES} - self.enum_types_by_id.keys())
+
+        if len(enum_type_ids):
+            self._load_enum_types(f'enum_type.id IN ({", ".join(["%s"] * len(enum_type_ids))})', enum_type_ids)
+
+        fields_by_message_id: Dict[int, List[MessageField]] = {message.id: [] for message in messages_by_id.values()
+                                                               if not _is_loaded(message, 'fields')}
+
+        for row in rows:
+            message_id = row.pop('message_id')
+            fields = fields_by_message_id.get(message_id)
+
+            if fields is not None:
+                row['type'] = self.resolve_type(row['type'])
+                fields.append(MessageField(messages_by_id[message_id], **row))
+
+        for message_id, fields in fields_by_message_id.items():
+            messages_by_id[message_id].fields = fields
+
+    def _cache_joined_parents(self, row: dict) -> None:
+        """
+        Remove parent node and package columns (see JOINED_NODE_COLUMNS, JOINED_PACKAGE_COLUMNS) from a row and
+        put the parents in the cache, so that resolving them (e.g. for fully_qualified_name) needs no more queries
+        """
+        package_row = {}
+        node_row = {}
+
+        for key in list(row.keys()):
+            if key.startswith('package.'):
+                package_row[key[8:]] = row.pop(key)
+            elif key.startswith('node.'):
+                node_row[key[5:]] = row.pop(key)
+
+        if package_row.get('id') is not None:
+            self.get_package_by_id(package_row['id'], db_row=package_row)
+
+        if node_row.get('id') is not None:
+            self.get_unit_by_id(node_row['id'], db_row=node_row)
+
+    def _connect(self):
+        import mysql.connector
+
+        kwargs = {key: value for (key, value) in
+                  [pair.split('=') for pair in self._conn_string.replace('mysql:', '').split(';')]}
+
+        if 'dbname' in kwargs:
+            kwargs['database'] = kwargs['dbname']
+            del kwargs['dbname']
+
+        # Without autocommit, the first query opens a transaction that nothing ends, and InnoDB keeps serving the
+        # snapshot taken then (REPEATABLE READ), so changes by others, including the changelog, would never be seen
+        kwargs['autocommit'] = True
+
+        self._connection_errors = (mysql.connector.errors.OperationalError,)
+        return mysql.connector.connect(**kwargs)
+
     def _make_cursor(self, *args, **kwargs):
         try:
             return self.conn.cursor(*args, **kwargs)
-        except mysql.connector.errors.OperationalError as ex:
-            if "MySQL Connection not available." in ex.msg:
+        except self._connection_errors as ex:
+            if "MySQL Connection not available." in str(ex):
                 # connection to MySQL DB has been lost. re-connect and try again
-                self.conn = mysql.connector.connect(**self._connection_kwargs)
+                self.conn = self._connect()
                 return self.conn.cursor(*args, **kwargs)
             else:
                 raise
 
+    def _poll_cache(self) -> None:
+        """
+        Drop the cache if it has grown too big or if the database has been changed since it was populated
+        """
+        num_cached = (len(self.buses_by_id) + len(self.enum_types_by_id) + len(self.messages_by_id) +
+                      len(self.packages_by_id) + len(self.units_by_id))
+
+        if self.cache_size is not None and num_cached > self.cache_size:
+            self.invalidate()
+
+        if self.cache_poll_interval is None:
+            return
+
+        now = time.monotonic()
+
+        if now < self._cache_next_poll:
+            return
+
+        version_token = self._query_version_token()
+
+        # without a previous token, it is unknown which version the cached entities (if any) come from
+        if version_token != self._cache_version_token or self._cache_version_token is None:
+            self.invalidate()
+            self._cache_version_token = version_token
+
+        self._cache_next_poll = now + self.cache_poll_interval
+
+    def _query_version_token(self) -> str:
+        # Deletions only clear the `valid` flags, and changes of buses, enum types and packages are not recorded
+        # in the changelog, so the row counts are needed to notice them
+        cursor = self._make_cursor()
+        cursor.execute('SELECT (SELECT COALESCE(MAX(id), 0) FROM changelog), '
+                       '(SELECT COUNT(*) FROM message WHERE valid = 1), '
+                       '(SELECT COUNT(*) FROM message_field WHERE valid = 1), '
+                       '(SELECT COUNT(*) FROM node WHERE valid = 1), '
+                       '(SELECT COUNT(*) FROM bus), '
+                       '(SELECT COUNT(*) FROM enum_type), '
+                       '(SELECT COUNT(*) FROM enum_item), '
+                       '(SELECT COUNT(*) FROM package)')
+        return '-'.join(str(value) for value in cursor.fetchone())
+
     def _put_changelog_entry(self, entity_type: ChangelogEntityType, action: ChangelogAction, row_id: int, who_changed: str):
         table_by_entity_type = {
             ChangelogEntityType.MESSAGE: "message",
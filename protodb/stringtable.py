@@ -0,0 +1,71 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict, Iterable, Optional, Tuple, TypeVar
+
+from .model import EnumTypeItem
+
+T = TypeVar('T')
+
+
+class StringTable:
+    """
+    Canonical instances of values that repeat throughout a model: units, factors and other free-form properties of
+    message fields, descriptions, and enum items. Backends pass every such value through the table while loading,
+    so that equal values are stored only once.
+
+    The returned objects are shared and must not be modified. A table can be shared by several databases; it is safe
+    to use from multiple threads.
+    """
+
+    _enum_items: Dict[Tuple, EnumTypeItem]
+    _enum_item_lists: Dict[Tuple[EnumTypeItem, ...], Tuple[EnumTypeItem, ...]]
+    _values: Dict
+
+    def __init__(self):
+        self._enum_items = {}
+        self._enum_item_lists = {}
+        self._values = {}
+
+    def __len__(self):
+        return len(self._values) + len(self._enum_items) + len(self._enum_item_lists)
+
+    def clear(self) -> None:
+        self._enum_items.clear()
+        self._enum_item_lists.clear()
+        self._values.clear()
+
+    def enum_item(self, name: str, description: str, value: int) -> EnumTypeItem:
+        key = (name, description, value)
+        item = self._enum_items.get(key)
+
+        if item is None:
+            item = self._enum_items.setdefault(key, EnumTypeItem(self.intern(name), self.intern(description), value))
+
+        return item
+
+    def enum_items(self, items: Iterable[EnumTypeItem]) -> Tuple[EnumTypeItem, ...]:
+        """
+        :param items: items, preferably obtained from enum_item()
+        """
+        items = tuple(items)
+        return self._enum_item_lists.setdefault(items, items)
+
+    def intern(self, value: Optional[T]) -> Optional[T]:
+        # setdefault is atomic, so concurrent callers always agree on the canonical instance
+        return self._values.setdefault(value, value) if value is not None else None
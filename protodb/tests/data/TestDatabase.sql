@@ -0,0 +1,58 @@
+-- Small dataset for SqliteProtocolDatabase tests (see sqliteprotocoldatabase.SCHEMA)
+--  - package Q has a node linked to a bus of P and a message associated to it
+--  - P.Dead is a deleted node which still has a message link
+
+INSERT INTO package (id, name) VALUES (1, 'P'), (2, 'Q');
+
+INSERT INTO bus (id, package_id, dbc_id, name, bitrate) VALUES
+  (1, 1, 1, 'CAN1', 500000),
+  (2, 1, 2, 'CAN2', 250000),
+  (3, 2, NULL, 'QBus', 125000);
+
+INSERT INTO node (id, package_id, name, description, valid) VALUES
+  (1, 1, 'ECU', 'Main controller', 1),
+  (2, 1, 'BMS', 'Battery management', 1),
+  (3, 2, 'Ext', 'Foreign node', 1),
+  (4, 1, 'Dead', 'Deleted node', 0);
+
+INSERT INTO node_bus (id, bus_id, node_id, note) VALUES
+  (1, 1, 1, 'main bus'),
+  (2, 2, 1, NULL),
+  (3, 1, 2, NULL),
+  (4, 1, 3, NULL),
+  (5, 3, 1, NULL);
+
+INSERT INTO message (id, node_id, bus_id, can_id, can_id_type, name, description, tx_period, timeout, valid) VALUES
+  (1, 1, 1, 256, 'DIRECT', 'Status', 'Controller status', 100, 500, 1),
+  (2, 2, 1, 300, 'DIRECT_EXTENDED', 'Cells', 'Cell voltages', NULL, NULL, 1),
+  (3, 3, 1, 400, 'DIRECT', 'ExtMsg', 'Foreign message on P.CAN1', 10, 20, 1),
+  (4, 1, NULL, 7, 'UNDEF', 'Loose', NULL, NULL, NULL, 1),
+  (5, 1, 1, 500, 'DIRECT', 'Gone', 'Deleted message', NULL, NULL, 0),
+  (6, 3, NULL, 7, 'DIRECT', 'ExtLoose', 'Foreign message without bus', NULL, NULL, 1);
+
+INSERT INTO message_node (node_id, message_id, operation) VALUES
+  (1, 1, 'SENDER'),
+  (2, 1, 'RECEIVER'),
+  (3, 1, 'RECEIVER'),
+  (4, 1, 'RECEIVER'),
+  (2, 2, 'SENDER'),
+  (3, 3, 'SENDER'),
+  (1, 3, 'RECEIVER');
+
+INSERT INTO enum_type (id, node_id, name, description) VALUES
+  (1, 1, 'Mode', 'Operating mode'),
+  (2, 2, 'State', NULL);
+
+INSERT INTO enum_item (enum_type_id, position, name, value, description) VALUES
+  (1, 0, 'OFF', 0, 'Off'),
+  (1, 1, 'ON', 1, ''),
+  (2, 0, 'A', 5, 'State A');
+
+INSERT INTO message_field (message_id, position, name, description, type, bit_size, array_length, unit, factor, offset, min, max, valid) VALUES
+  (1, 1, 'Speed', 'Motor speed', 'uint', 12, 1, 'rpm', '(1/10)', '0', '0', '100', 1),
+  (1, 0, 'Mode', 'Operating mode', '1', 2, 1, NULL, NULL, NULL, NULL, NULL, 1),
+  (1, 2, '', '', 'reserved', 2, 1, NULL, NULL, NULL, NULL, NULL, 1),
+  (1, 3, 'Old', 'Deleted field', 'uint', 2, 1, NULL, NULL, NULL, NULL, NULL, 0),
+  (2, 0, 'Voltage', 'Cell voltage', 'int', 16, 4, 'mV', '', NULL, NULL, NULL, 1),
+  (2, 1, 'State', 'State', '2', 3, 1, NULL, NULL, NULL, NULL, NULL, 1),
+  (3, 0, 'Flags', 'Flags', 'bool', 1, 3, NULL, NULL, NULL, NULL, NULL, 1);
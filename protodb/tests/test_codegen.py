@@ -0,0 +1,106 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+from pathlib import Path
+import zipfile
+
+import pytest
+
+from protodb.export.cache import ExportCache
+from protodb.export.codegen import CodeGenerationError, generate_tx_code
+from protodb.jsonprotocoldatabase import JsonProtocolDatabase
+from protodb.model import CodeGenerationOptions
+
+TEST_MODEL_PATH = Path(__file__).parent / "data" / "TestModel.json"
+
+# Stands in for candb-codegen: lists the messages of each group of the model
+FAKE_GENERATOR = '''
+import argparse, json, pathlib
+
+parser = argparse.ArgumentParser()
+parser.add_argument("json")
+parser.add_argument("-u", dest="unit")
+parser.add_argument("-O", dest="output_dir")
+parser.add_argument("-x", dest="code_model_version")
+args = parser.parse_args()
+
+groups = json.loads(pathlib.Path(args.json).read_text())
+
+for group in groups:
+    path = pathlib.Path(args.output_dir) / f"{group['name']}.txt"
+    path.write_text("".join(f"{message['name']} {message['sentBy']} {message['receivedBy']}\\n"
+                            for message in group["messages"]))
+'''
+
+
+@pytest.fixture
+def codegen_dir(tmp_path):
+    (tmp_path / "candb-generate-c.py").write_text(FAKE_GENERATOR)
+    (tmp_path / "tx").mkdir()
+    (tmp_path / "tx" / "tx.c").write_text("// Tx library\n")
+    return tmp_path
+
+
+def _list_zip(data: bytes):
+    with zipfile.ZipFile(io.BytesIO(data)) as zip:
+        return {name: zip.read(name).decode() for name in zip.namelist()}
+
+
+def test_generate_tx_code(codegen_dir):
+    db = JsonProtocolDatabase.with_path(TEST_MODEL_PATH)
+    node = db.get_node("BCP07.BCB")
+
+    files = _list_zip(generate_tx_code(node, db, codegen_dir=codegen_dir))
+
+    assert "tx.c" not in files
+    assert "BCB.txt" in files
+
+    for message in db.get_messages(scope=node):
+        links = [link for link in db.get_node_message_links(message=message) if link.node is node]
+
+        if links:
+            assert f"{message.name} " in files["BCB.txt"]
+
+    # the same code, the same archive
+    cache = ExportCache()
+    data = generate_tx_code(node, db, cache=cache, codegen_dir=codegen_dir)
+    assert generate_tx_code(node, db, codegen_dir=codegen_dir) == data
+    assert generate_tx_code(node, db, cache=cache, codegen_dir=codegen_dir) is data
+
+    # code model v2 also includes the Tx library; absolute names are prefixed by the package
+    db.get_code_generation_options = lambda node: CodeGenerationOptions(2, "-fcodegen-unit-versions")
+    files = _list_zip(generate_tx_code(node, db, cache=cache, codegen_dir=codegen_dir))
+    assert files["tx.c"] == "// Tx library\n"
+    assert "BCP07_BCB.txt" in files
+
+
+def test_generate_tx_code_errors(codegen_dir):
+    db = JsonProtocolDatabase.with_path(TEST_MODEL_PATH)
+    node = db.get_node("BCP07.BCB")
+
+    db.get_code_generation_options = lambda node: CodeGenerationOptions(3)
+
+    with pytest.raises(CodeGenerationError, match="Unsupported code model version"):
+        generate_tx_code(node, db, codegen_dir=codegen_dir)
+
+    db.get_code_generation_options = lambda node: CodeGenerationOptions()
+    (codegen_dir / "candb-generate-c.py").write_text("import sys; sys.exit('no such unit')")
+
+    with pytest.raises(CodeGenerationError, match="no such unit"):
+        generate_tx_code(node, db, codegen_dir=codegen_dir)
@@ -0,0 +1,95 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from pathlib import Path
+
+from protodb.export.cache import ExportCache
+from protodb.export.export_json2 import export_buses_of_package, render_buses_of_package
+from protodb.jsonprotocoldatabase import JsonProtocolDatabase
+
+TEST_MODEL_PATH = Path(__file__).parent / "data" / "TestModel.json"
+
+
+class FakeDatabase:
+    def __init__(self, version_token):
+        self.version_token = version_token
+
+    def get_version_token(self):
+        return self.version_token
+
+
+def _renderer(renders: list, data: bytes):
+    def render():
+        renders.append(data)
+        return data
+
+    return render
+
+
+def test_cache_in_memory():
+    cache = ExportCache(max_memory_size=10)
+    db = FakeDatabase("v1")
+    renders = []
+
+    assert cache.get_or_render(("a",), db, _renderer(renders, b"A1")) == b"A1"
+    assert cache.get_or_render(("a",), db, _renderer(renders, b"A2")) == b"A1"
+    assert renders == [b"A1"]
+
+    # a new version of the database
+    db.version_token = "v2"
+    assert cache.get_or_render(("a",), db, _renderer(renders, b"A2")) == b"A2"
+
+    # evicts the least recently used entries, ("a", "v1") and then ("a", "v2")
+    assert cache.get_or_render(("b",), db, _renderer(renders, b"B12345678")) == b"B12345678"
+    assert cache.get_or_render(("a",), db, _renderer(renders, b"A3")) == b"A3"
+    assert renders == [b"A1", b"A2", b"B12345678", b"A3"]
+
+    # no token, no caching
+    db.version_token = None
+    cache.get_or_render(("a",), db, _renderer(renders, b"A4"))
+    cache.get_or_render(("a",), db, _renderer(renders, b"A4"))
+    assert renders[-2:] == [b"A4", b"A4"]
+
+
+def test_cache_directory(tmp_path):
+    db = FakeDatabase("v1")
+    renders = []
+
+    ExportCache(directory=tmp_path).get_or_render(("a",), db, _renderer(renders, b"A1"))
+
+    # e.g. another process
+    assert ExportCache(directory=tmp_path).get_or_render(("a",), db, _renderer(renders, b"A2")) == b"A1"
+    assert ExportCache(directory=tmp_path, namespace="other").get_or_render(
+        ("a",), db, _renderer(renders, b"A2")) == b"A2"
+    assert renders == [b"A1", b"A2"]
+
+    cache = ExportCache(directory=tmp_path, max_directory_size=5)
+    cache.get_or_render(("b",), db, _renderer(renders, b"B1234"))
+    assert [path.read_bytes() for path in tmp_path.glob("*.bin")] == [b"B1234"]
+
+
+def test_render_buses_of_package():
+    db = JsonProtocolDatabase.with_path(TEST_MODEL_PATH)
+    package = db.get_package("BCP07")
+    cache = ExportCache()
+
+    expected = json.dumps(export_buses_of_package(package, db)).encode()
+    assert render_buses_of_package(package, db) == expected
+    assert render_buses_of_package(package, db, cache=cache) == expected
+    assert render_buses_of_package(package, db, cache=cache) is render_buses_of_package(package, db, cache=cache)
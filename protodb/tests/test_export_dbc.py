@@ -0,0 +1,107 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+import re
+
+from protodb.export.cache import ExportCache
+from protodb.export.export_dbc import render_bus, stream_bus
+from protodb.export.export_json2 import export_buses_of_package
+from protodb.jsonprotocoldatabase import JsonProtocolDatabase
+
+TEST_MODEL_PATH = Path(__file__).parent / "data" / "TestModel.json"
+
+SIGNAL_RE = re.compile(r' SG_ (\w+) : (\d+)\|(\d+)@1[+-] \(([^,]+),([^)]+)\) \[[^|]+\|[^]]+\] "[^"]*" [\w,]+')
+
+
+def test_export_dbc():
+    db = JsonProtocolDatabase.with_path(TEST_MODEL_PATH)
+    package = db.get_package("BCP07")
+    bus = next(bus for bus in db.get_buses(scope=package) if bus.name == "WFE7_qik")
+
+    dbc = render_bus(bus, db).decode()
+    assert b"".join(stream_bus(bus, db)).decode() == dbc
+
+    # the same messages as in JSON2, wherever an ID is assigned
+    json_model = export_buses_of_package(package, db)
+    expected_messages = sorted((message["id"], message["length"])
+                               for package_model in json_model["packages"]
+                               for unit in package_model["units"]
+                               for message in unit["messages"]
+                               if message["id"] is not None and (message["bus"] is None or
+                                                                 message["bus"] == bus.fully_qualified_name))
+
+    messages = []
+
+    for block in dbc.split("\nBO_ ")[1:]:
+        header, *lines = block.split("\n\n")[0].splitlines()
+        can_id, name, length, sender = re.fullmatch(r"(\d+) (\w+): (\d+) (\w+)", header).groups()
+        messages.append((int(can_id), int(length)))
+
+        used_bits = 0
+
+        for line in lines:
+            signal_name, start_bit, size, factor, offset = SIGNAL_RE.fullmatch(line).groups()
+            mask = ((1 << int(size)) - 1) << int(start_bit)
+
+            # signals fit in the message and do not overlap
+            assert int(start_bit) + int(size) <= int(length) * 8
+            assert used_bits & mask == 0
+            used_bits |= mask
+
+    assert sorted(messages) == expected_messages
+
+    cache = ExportCache()
+    assert render_bus(bus, db, cache=cache) == dbc.encode()
+    assert render_bus(bus, db, cache=cache) is render_bus(bus, db, cache=cache)
+
+
+def _field(name, start_bit):
+    return dict(name=name, description=None, type="uint", bits=4, count=1, start_bit=start_bit, unit=None,
+                factor=None, factor_num=None, offset=None, min=None, max=None)
+
+
+def _message(name, id, fields, sent_by, received_by):
+    return dict(name=name, description=None, bus=None, fields=fields, frame_type="CAN_STD", id=id, length=1,
+                sent_by=sent_by, received_by=received_by, timeout=None, tx_period=None)
+
+
+def _unit(name, bus_links=(), messages=()):
+    return dict(name=name, description=None, bus_links=[dict(bus=bus, note=None) for bus in bus_links],
+                enum_types=[], messages=list(messages))
+
+
+def test_export_dbc_name_clashes():
+    db = JsonProtocolDatabase.from_model(dict(version=2, packages=[
+        dict(name="P", buses=[dict(name="CAN", dbc_id=None, bitrate=None)], units=[
+            _unit("ECU", ["P.CAN"], [_message("Status", 1, [_field("a b", 0), _field("a_b", 4)],
+                                              ["P.ECU"], ["Q.ECU", "Q.P_ECU"])]),
+            _unit("BMS", ["P.CAN"], [_message("Status", 2, [_field("x", 0)], [], [])]),
+        ]),
+        dict(name="Q", buses=[], units=[_unit("ECU"), _unit("P_ECU")]),
+    ]))
+    bus = db.get_bus("P.CAN")
+
+    dbc = render_bus(bus, db).decode()
+
+    # nodes of the same name are told apart by the package; receivers from other packages are declared as well
+    assert "\nBU_: BMS P_ECU P_ECU_2 Q_ECU\n" in dbc
+    assert "\nBO_ 1 ECU_Status: 1 P_ECU_2\n" in dbc
+    assert "\nBO_ 2 BMS_Status: 1 BMS\n" in dbc
+    assert [line.split()[1] for line in dbc.splitlines() if line.startswith(" SG_ ")] == ["x", "a_b", "a_b_2"]
+    assert " SG_ a_b_2 : 4|4@1+ (1,0) [0|0] \"\" P_ECU,Q_ECU\n" in dbc
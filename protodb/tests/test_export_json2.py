@@ -18,8 +18,14 @@
 
 import json
 from pathlib import Path
+import threading
 
-from protodb.export.export_json2 import export_buses_of_package
+import pytest
+
+from protodb.export import export_json2
+from protodb.export.cache import ExportCache
+from protodb.export.export_json2 import (export_buses_of_package, export_packages, render_buses_of_package,
+                                         stream_buses_of_package)
 from protodb.jsonprotocoldatabase import JsonProtocolDatabase
 
 
@@ -39,3 +45,60 @@ def test_export_json2():
 
             for line_expected, line_actual in zip(check, actual_lines):
                 assert line_expected.strip() == line_actual.strip()
+
+
+def test_stream_buses_of_package():
+    db = JsonProtocolDatabase.with_path(Path(__file__).parent / "data" / "TestModel.json")
+
+    for package in db.get_packages():
+        expected = json.dumps(export_buses_of_package(package, db)).encode()
+        chunks = list(stream_buses_of_package(package, db))
+
+        assert b"".join(chunks) == expected
+        assert render_buses_of_package(package, db) == expected
+
+    cache = ExportCache()
+    package = db.get_package("BCP07")
+    expected = render_buses_of_package(package, db)
+
+    # only complete iterations are cached
+    next(stream_buses_of_package(package, db, cache=cache))
+    assert b"".join(stream_buses_of_package(package, db, cache=cache)) == expected
+    assert list(stream_buses_of_package(package, db, cache=cache)) == [expected]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_export_packages(tmp_path, jobs):
+    db = JsonProtocolDatabase.with_path(Path(__file__).parent / "data" / "TestModel.json", lazy=True)
+    expected = JsonProtocolDatabase.with_path(Path(__file__).parent / "data" / "TestModel.json")
+    package_names = sorted(package.name for package in expected.get_packages())
+
+    paths = export_packages(db, package_names, tmp_path / "out", jobs=jobs)
+
+    assert paths == [tmp_path / "out" / f"{name}.json" for name in package_names]
+
+    for name, path in zip(package_names, paths):
+        assert path.read_bytes() == render_buses_of_package(expected.get_package(name), expected)
+
+
+def test_export_packages_does_not_fork_threads(tmp_path, monkeypatch):
+    db = JsonProtocolDatabase.with_path(Path(__file__).parent / "data" / "TestModel.json")
+    package_names = sorted(package.name for package in db.get_packages())
+
+    def fail(*args, **kwargs):
+        raise AssertionError("forked a multi-threaded process")
+
+    monkeypatch.setattr(export_json2, "ProcessPoolExecutor", fail)
+
+    # e.g. served by protodb.worker
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+
+    try:
+        paths = export_packages(db, package_names, tmp_path / "out", jobs=2)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert [path.name for path in paths] == [f"{name}.json" for name in package_names]
@@ -0,0 +1,39 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+
+import pytest
+
+from protodb.model import FrameType
+from protodb.tools.frame_id_parser import load_frame_id_types
+
+DEFAULT_FORMATS_PATH = Path(__file__).parent.parent.parent / "config" / "frame-id-formats.default.yml"
+
+
+def test_encode_decode():
+    type, = load_frame_id_types(DEFAULT_FORMATS_PATH)
+    assert type.model_frame_type is FrameType.CAN_STD
+
+    # Priority (3 bits) | Node (4 bits) | Message (4 bits)
+    can_id = type.encode(dict(Priority="P5", Node=3, Message="msg15"))
+    assert can_id == (5 << 8) | (3 << 4) | 15
+    assert type.decode(can_id) == dict(Priority="P5", Node="DEV3", Message="msg15")
+
+    with pytest.raises(ValueError):
+        type.encode(dict(Priority=8, Node=0, Message=0))
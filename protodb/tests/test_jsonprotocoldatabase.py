@@ -0,0 +1,316 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from protodb import connect
+from protodb.export.export_json2 import export_buses_of_package
+from protodb.jsonprotocoldatabase import JsonProtocolDatabase
+from protodb.jsonsnapshot import SnapshotError, StaleSnapshotError
+from protodb.stringtable import StringTable
+
+TEST_MODEL_PATH = Path(__file__).parent / "data" / "TestModel.json"
+
+
+def _describe(db: JsonProtocolDatabase):
+    for message in sorted(db.get_messages(), key=lambda message: message.fully_qualified_name):
+        yield (message.fully_qualified_name,
+               message.unit.fully_qualified_name,
+               message.bus.fully_qualified_name if message.bus is not None else None,
+               sorted((link.node.fully_qualified_name, link.link_type.name) for link in message.node_links),
+               [(field.fully_qualified_name, repr(field.type), field.size_in_bits) for field in message.fields])
+
+
+def test_with_path_matches_from_model():
+    with open(TEST_MODEL_PATH) as f:
+        expected = JsonProtocolDatabase.from_model(json.load(f))
+
+    db = JsonProtocolDatabase.with_path(TEST_MODEL_PATH)
+
+    assert list(_describe(db)) == list(_describe(expected))
+    assert [package.name for package in db.get_packages()] == [package.name for package in expected.get_packages()]
+    assert len(db.message_fields) == len(expected.message_fields)
+
+    for node in db.get_nodes():
+        for enum_type in node.get_enum_types():
+            assert enum_type.node is node
+            assert enum_type.fully_qualified_name == f"{node.fully_qualified_name}.{enum_type.name}"
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_indexes(lazy):
+    db = JsonProtocolDatabase.with_path(TEST_MODEL_PATH, lazy=lazy)
+
+    for package in list(db.get_packages()):
+        for bus in package.get_buses():
+            assert db.get_bus(bus.fully_qualified_name) is bus
+            assert list(db.get_associated_messages(bus)) == \
+                   [message for message in db.get_messages(scope=package) if message.bus is bus]
+
+        for node in package.get_nodes():
+            assert db.get_node(node.fully_qualified_name) is node
+
+            for message in node.get_messages():
+                assert db.get_message(message.fully_qualified_name) is message
+
+            for message in db.get_associated_messages(bus):
+                if message.can_id is not None:
+                    found = db.get_message_by_can_id(bus, message.can_id, message.frame_type)
+                    assert (found.can_id, found.frame_type) == (message.can_id, message.frame_type)
+
+    assert sorted(enum_type.fully_qualified_name for enum_type in db.get_enum_types()) == \
+           sorted(enum_type.fully_qualified_name for node in db.get_nodes() for enum_type in node.get_enum_types())
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_with_directory(tmp_path, workers):
+    with open(TEST_MODEL_PATH) as f:
+        model = json.load(f)
+
+    for package_model in model["packages"]:
+        (tmp_path / f"{package_model['name']}.json").write_text(json.dumps(dict(version=2, packages=[package_model])))
+
+    expected = JsonProtocolDatabase.with_path(TEST_MODEL_PATH)
+    db = JsonProtocolDatabase.with_directory(tmp_path, workers=workers)
+
+    assert list(_describe(db)) == list(_describe(expected))
+    assert export_buses_of_package(db.get_package("BCP07"), db) == \
+           export_buses_of_package(expected.get_package("BCP07"), expected)
+
+    (tmp_path / "duplicate.json").write_text(json.dumps(dict(version=2, packages=model["packages"][:1])))
+
+    with pytest.raises(Exception, match="defined again"):
+        JsonProtocolDatabase.with_directory(tmp_path, workers=workers)
+
+
+def test_watch(tmp_path):
+    with open(TEST_MODEL_PATH) as f:
+        model = json.load(f)
+
+    path = tmp_path / "model.json"
+    path.write_text(json.dumps(model))
+
+    db = JsonProtocolDatabase.with_path(path, watch=True)
+    received = []
+    db.add_change_callback(received.append)
+
+    assert db.poll_changes() is None
+    version_token = db.get_version_token()
+
+    messages = {message.fully_qualified_name: message for message in db.get_messages()}
+    nodes = {node.fully_qualified_name: node for node in db.get_nodes()}
+
+    package_model = next(package_model for package_model in model["packages"] if package_model["name"] == "BCP07")
+    message_model = package_model["units"][0]["messages"][0]
+    message_model["description"] = "changed"
+    changed_fqn = f'BCP07.{package_model["units"][0]["name"]}.{message_model["name"]}'
+
+    def write(text):
+        stat = path.stat()
+        path.write_text(text)
+        # make sure the change is seen even if the clock is coarse
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    write(json.dumps(model))
+    changes = db.poll_changes()
+
+    assert changes is not None and received == [changes]
+    assert changes.packages == {"BCP07"}
+    assert [message.fully_qualified_name for message in changes.added] == [changed_fqn]
+    assert changes.removed == [messages[changed_fqn]]
+    assert db.get_version_token() != version_token
+
+    assert db.get_message(changed_fqn).description == "changed"
+    assert all(db.get_message(fqn) is message for fqn, message in messages.items() if fqn != changed_fqn)
+    assert all(db.get_node(fqn) is node for fqn, node in nodes.items())
+    assert list(_describe(db)) == list(_describe(JsonProtocolDatabase.with_path(path)))
+
+    # a broken file leaves the model as it was
+    write("{")
+
+    with pytest.raises(ValueError):
+        db.poll_changes()
+
+    # lookups poll automatically, and only warn
+    db._watcher._next_poll = 0
+
+    with pytest.warns(RuntimeWarning, match="Failed to reload"):
+        db.get_package("BCP07")
+
+    assert db.get_message(changed_fqn).description == "changed"
+
+    # and so does a reference that cannot be resolved
+    described = list(_describe(db))
+    message_model["bus"] = "A.MISSING"
+    write(json.dumps(model))
+
+    with pytest.raises(KeyError, match="A.MISSING"):
+        db.poll_changes()
+
+    assert list(_describe(db)) == described
+
+
+def test_with_path_strict(tmp_path):
+    path = tmp_path / "model.json"
+    path.write_text(json.dumps(dict(version=2, packages=[dict(name="A", buses=[dict(name="CAN")], units=[])])))
+
+    JsonProtocolDatabase.with_path(path)
+
+    with pytest.raises(KeyError):
+        JsonProtocolDatabase.with_path(path, strict=True)
+
+
+def test_lazy_loads_only_referenced_packages():
+    expected = JsonProtocolDatabase.with_path(TEST_MODEL_PATH)
+    db = JsonProtocolDatabase.with_path(TEST_MODEL_PATH, lazy=True)
+
+    assert db.packages == {}
+
+    package = db.get_package("BCP07")
+    assert list(db.packages.keys()) == ["BCP07"]
+
+    out_model = export_buses_of_package(package, db)
+    assert out_model == export_buses_of_package(expected.get_package("BCP07"), expected)
+
+    # nodes of another package are linked to the buses of BCP07
+    assert "Lwefwuxyh" in db.packages
+
+    assert sorted(package.name for package in db.get_packages()) == \
+           sorted(package.name for package in expected.get_packages())
+    assert list(_describe(db)) == list(_describe(expected))
+
+
+def test_lazy_unknown_package():
+    db = JsonProtocolDatabase.with_path(TEST_MODEL_PATH, lazy=True)
+
+    with pytest.raises(KeyError):
+        db.get_package("NoSuchPackage")
+
+
+def test_lazy_failed_load(tmp_path):
+    def message(name, bus, sent_by):
+        return dict(name=name, description=None, bus=bus, fields=[], frame_type="CAN_STD", id=1, received_by=[],
+                    sent_by=sent_by, timeout=None, tx_period=None)
+
+    def package(name, bus_name, messages):
+        return dict(name=name, buses=[dict(name=bus_name, dbc_id=None, bitrate=None)],
+                    units=[dict(name="N", description=None, bus_links=[], enum_types=[], messages=messages)])
+
+    path = tmp_path / "model.json"
+    path.write_text(json.dumps(dict(version=2, packages=[
+        package("A", "CAN", [message("Good", "A.CAN", ["B.N"]), message("Bad", "A.MISSING", [])]),
+        package("B", "CAN", []),
+    ])))
+
+    db = JsonProtocolDatabase.with_path(path, lazy=True)
+    b = db.get_package("B")
+
+    # the failure is reported every time, rather than a half-built package being returned
+    for _ in range(2):
+        with pytest.raises(KeyError, match="MISSING"):
+            db.get_package("A")
+
+    assert list(db.packages) == ["B"]
+    assert {message.fully_qualified_name for message in db.messages} == set()
+    assert b.get_node("N").message_links == set()
+
+
+def test_snapshot_roundtrip(tmp_path):
+    expected = JsonProtocolDatabase.with_path(TEST_MODEL_PATH)
+    expected.save_snapshot(tmp_path / "model.snapshot")
+
+    db = JsonProtocolDatabase.load_snapshot(tmp_path / "model.snapshot", source_path=TEST_MODEL_PATH)
+
+    assert list(_describe(db)) == list(_describe(expected))
+    assert export_buses_of_package(db.get_package("BCP07"), db) == \
+           export_buses_of_package(expected.get_package("BCP07"), expected)
+
+
+def test_snapshot_dir(tmp_path):
+    model_path = tmp_path / "model.json"
+    model_path.write_bytes(TEST_MODEL_PATH.read_bytes())
+
+    expected = JsonProtocolDatabase.with_path(model_path, snapshot_dir=tmp_path / "snapshots")
+    assert len(list((tmp_path / "snapshots").iterdir())) == 1
+
+    db = JsonProtocolDatabase.with_path(model_path, snapshot_dir=tmp_path / "snapshots")
+    assert list(_describe(db)) == list(_describe(expected))
+
+    # a modified model must not be served from the old snapshot
+    model_path.write_text(json.dumps(dict(version=2, packages=[])))
+
+    db = JsonProtocolDatabase.with_path(model_path, snapshot_dir=tmp_path / "snapshots")
+    assert list(db.get_packages()) == []
+    assert len(list((tmp_path / "snapshots").iterdir())) == 2
+
+    with pytest.raises(StaleSnapshotError):
+        JsonProtocolDatabase.load_snapshot(tmp_path / "snapshots" / (expected._source_hash.hex() + ".snapshot"),
+                                           source_path=model_path)
+
+
+@pytest.mark.parametrize("size", [0, 20, -100])
+def test_snapshot_dir_corrupt(tmp_path, size):
+    model_path = tmp_path / "model.json"
+    model_path.write_bytes(TEST_MODEL_PATH.read_bytes())
+
+    expected = JsonProtocolDatabase.with_path(model_path, snapshot_dir=tmp_path / "snapshots")
+    snapshot_path, = (tmp_path / "snapshots").iterdir()
+
+    # truncated, e.g. by a full disk
+    data = snapshot_path.read_bytes()
+    snapshot_path.write_bytes(data[:size])
+
+    with pytest.raises(SnapshotError):
+        JsonProtocolDatabase.load_snapshot(snapshot_path)
+
+    # rebuilt from the model
+    db = JsonProtocolDatabase.with_path(model_path, snapshot_dir=tmp_path / "snapshots")
+    assert list(_describe(db)) == list(_describe(expected))
+    assert snapshot_path.read_bytes() == data
+
+
+def test_shared_string_table(tmp_path):
+    strings = StringTable()
+    db = JsonProtocolDatabase.with_path(TEST_MODEL_PATH, strings=strings)
+
+    db.save_snapshot(tmp_path / "model.snapshot")
+    other = JsonProtocolDatabase.load_snapshot(tmp_path / "model.snapshot", strings=strings)
+
+    units = {}
+
+    for field in list(db.get_message_fields()) + list(other.get_message_fields()):
+        if field.unit is not None:
+            assert units.setdefault(field.unit, field.unit) is field.unit
+
+    for node in db.nodes:
+        other_node = other.get_package(node.package.name).nodes_by_name[node.name]
+
+        for enum_type in node.get_enum_types():
+            assert other_node.enum_types_by_name[enum_type.name].items is enum_type.items
+
+
+def test_connect_lazy_is_opt_in(monkeypatch):
+    monkeypatch.delenv("PROTODB_JSON_LAZY", raising=False)
+    assert connect(str(TEST_MODEL_PATH)).packages != {}
+
+    monkeypatch.setenv("PROTODB_JSON_LAZY", "1")
+    assert connect(str(TEST_MODEL_PATH)).packages == {}
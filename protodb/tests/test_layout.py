@@ -0,0 +1,100 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+from protodb.layout import BitRange, compute_layout
+
+
+def _reference_layout(field_sizes):
+    """
+    The original implementation from export_json2, scanning all bytes for every element
+    """
+    usage_map = []
+    field_ranges = []
+
+    for size_in_bits, array_length in field_sizes:
+        ranges = []
+        start_bit = None
+
+        for i in range(array_length):
+            b = size_in_bits
+            ranges.append([])
+
+            if b % 8 == 0:
+                if start_bit is None:
+                    start_bit = len(usage_map) * 8
+
+                for byte in range(b // 8):
+                    ranges[i].append((len(usage_map), 0, 8))
+                    usage_map.append(8)
+            else:
+                for byte, used_bits in enumerate(usage_map):
+                    if used_bits == 8:
+                        continue
+
+                    if start_bit is None:
+                        start_bit = byte * 8 + used_bits
+
+                    use = min(b, 8 - used_bits)
+
+                    ranges[i].append((byte, used_bits, use))
+                    b -= use
+                    usage_map[byte] += use
+
+                    if b == 0:
+                        break
+
+                if start_bit is None:
+                    start_bit = len(usage_map) * 8
+
+                if b != 0:
+                    while b > 0:
+                        use = 8 if b > 8 else b
+                        ranges[i].append((len(usage_map), 0, use))
+                        usage_map.append(use)
+                        b -= use
+
+        field_ranges.append((start_bit, ranges))
+
+    return field_ranges, len(usage_map)
+
+
+def test_layout_matches_reference():
+    rng = random.Random(0)
+
+    for _ in range(2000):
+        field_sizes = tuple((rng.choice([0, 1, 2, 3, 4, 5, 7, 8, 12, 16, 17, 32, 64]), rng.choice([0, 1, 1, 1, 2, 5]))
+                            for _ in range(rng.randrange(0, 12)))
+
+        layout = compute_layout(field_sizes)
+        field_ranges, num_bytes = _reference_layout(field_sizes)
+
+        assert layout.num_bytes == num_bytes
+        assert [(field.start_bit, [[(r.byte, r.shift, r.bits) for r in element] for element in field.elements])
+                for field in layout.fields] == field_ranges
+
+
+def test_layout_masks():
+    layout = compute_layout(((4, 1), (8, 1), (6, 1)))
+
+    assert layout.num_bytes == 3
+    assert [field.start_bit for field in layout.fields] == [0, 8, 4]
+    # the third field fills up the first byte, then continues after the second one
+    assert layout.fields[2].elements == ((BitRange(byte=0, shift=4, bits=4), BitRange(byte=2, shift=0, bits=2)),)
+    assert [piece.mask for piece in layout.fields[2].elements[0]] == [0xF0, 0x03]
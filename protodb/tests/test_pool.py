@@ -0,0 +1,107 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+
+import pytest
+
+from protodb.jsonprotocoldatabase import JsonProtocolDatabase
+from protodb.pool import ProtocolDatabasePool
+from protodb.sqliteprotocoldatabase import SqliteProtocolDatabase
+from protodb.tests.test_MessageDuplicateIdCheck import MODEL
+from protodb.tests.testutil import make_test_database
+
+
+class FakeDatabase:
+    supports_concurrent_readers = False
+
+    def __init__(self):
+        self.refreshes = 0
+
+    def refresh(self, keep_cache):
+        self.refreshes += 1
+
+
+def test_pool_reuses_connections_up_to_size():
+    opened = []
+
+    def factory(conn_string):
+        opened.append(FakeDatabase())
+        return opened[-1]
+
+    pool = ProtocolDatabasePool("fake", size=2, factory=factory)
+
+    db1 = pool.checkout()
+    db2 = pool.checkout()
+    assert db1 is not db2
+
+    with pytest.raises(TimeoutError):
+        pool.checkout(timeout=0.01)
+
+    pool.checkin(db1)
+
+    with pool.connection() as db:
+        assert db is db1
+
+    assert len(opened) == 2
+    # every checkout starts a new operation
+    assert db1.refreshes == 2 and db2.refreshes == 1
+
+
+def test_pool_shares_concurrent_reader():
+    pool = ProtocolDatabasePool("fake", size=1, factory=lambda conn_string: JsonProtocolDatabase.from_model(MODEL))
+
+    db1 = pool.checkout()
+    db2 = pool.checkout(timeout=0)
+    assert db1 is db2
+
+
+def test_pool_refreshes_sql_connections(tmp_path):
+    path = str(tmp_path / "candb.sqlite")
+    writer = make_test_database(path)
+
+    for keep_cache, expected_bitrate in [(True, 500000), (False, 123456)]:
+        pool = ProtocolDatabasePool(path, size=1, factory=SqliteProtocolDatabase, keep_cache=keep_cache)
+        writer.conn.execute("UPDATE bus SET bitrate = 500000 WHERE id = 1")
+
+        with pool.connection() as db:
+            assert db.get_bus_by_id(1).bitrate == 500000
+            # a transaction left open by the request
+            db.conn.execute("BEGIN")
+
+        # not recorded in the changelog, so only seen without the cache
+        writer.conn.execute("UPDATE bus SET bitrate = 123456 WHERE id = 1")
+
+        with pool.connection() as db:
+            assert not db.conn.in_transaction
+            assert db.get_bus_by_id(1).bitrate == expected_bitrate
+
+
+def test_pool_does_not_share_changing_models(tmp_path):
+    path = tmp_path / "model.json"
+    path.write_text(json.dumps(MODEL))
+
+    # reloads and lazy loading change the model in place, so each thread needs its own copy
+    for options in [dict(watch=True), dict(lazy=True)]:
+        pool = ProtocolDatabasePool(str(path), size=2,
+                                    factory=lambda path: JsonProtocolDatabase.with_path(path, **options))
+
+        db1 = pool.checkout()
+        db2 = pool.checkout()
+        assert db1 is not db2
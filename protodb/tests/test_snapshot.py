@@ -0,0 +1,65 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from protodb import connect
+from protodb.export.export_json2 import export_all_packages
+from protodb.sqliteprotocoldatabase import SqliteProtocolDatabase
+from protodb.tests.testutil import make_test_database
+from protodb.tools.snapshot import copy_to_sqlite, export_json
+
+
+def test_snapshot_incremental_refresh(tmp_path):
+    source = make_test_database()
+    dest = SqliteProtocolDatabase(str(tmp_path / "snapshot.sqlite"))
+
+    rows_copied = copy_to_sqlite(source, dest)
+    assert rows_copied["message"] == 6
+    assert export_all_packages(dest) == export_all_packages(source)
+
+    # logged change
+    source.transaction_begin()
+    source.conn.execute("UPDATE message SET name = 'Status2' WHERE id = 1")
+    source.conn.execute("INSERT INTO changelog (`table`, action, row, who_changed) VALUES ('message', 'UPDATE', 1, 'test')")
+    source.delete(source.get_node("P.BMS"), who_changed="test")
+    source.transaction_commit()
+
+    # unlogged hard delete
+    source.conn.execute("DELETE FROM message WHERE id = 3")
+    source.invalidate()
+
+    rows_copied = copy_to_sqlite(source, dest)
+    # message 1 + message 2 soft-deleted together with its node
+    assert rows_copied["message"] == 2
+    assert export_all_packages(dest) == export_all_packages(source)
+    assert {message.name for message in dest.get_messages()} == {"Status2", "Loose", "ExtLoose"}
+
+
+def test_snapshot_json(tmp_path):
+    source = make_test_database()
+    path = str(tmp_path / "snapshot.json")
+
+    export_json(source, path)
+
+    with open(path) as f:
+        assert json.load(f) == export_all_packages(source)
+
+    db = connect(path)
+    assert {message.fully_qualified_name for message in db.get_messages()} == \
+        {message.fully_qualified_name for message in source.get_messages()}
@@ -0,0 +1,367 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from datetime import timedelta
+from pathlib import Path
+import sys
+import types
+
+import pytest
+
+from protodb.export.cache import ExportCache
+from protodb.export.export_dbc import render_bus
+from protodb.export.export_json2 import export_buses_of_package, ExportSet, _render_set
+from protodb.model import CodeGenerationOptions, FrameType, MESSAGE_FIELD_TYPE_RESERVED, NodeMessageLinkType
+from protodb.sqlprotocoldatabase import SqlProtocolDatabase
+from protodb.sqliteprotocoldatabase import SqliteProtocolDatabase
+from protodb.stringtable import StringTable
+from protodb.tests.testutil import count_queries, make_test_database
+
+
+def test_sqlite_getters():
+    db = make_test_database()
+
+    package = db.get_package("P")
+    assert sorted(bus.name for bus in db.get_buses(scope=package)) == ["CAN1", "CAN2"]
+    assert sorted(node.name for node in db.get_nodes(scope=package)) == ["BMS", "ECU"]
+
+    ecu = db.get_node("P.ECU")
+    status = db.get_node_message(ecu, "Status")
+    assert status.fully_qualified_name == "P.ECU.Status"
+    assert status.frame_type is FrameType.CAN_STD
+    assert status.timeout == timedelta(milliseconds=500)
+    assert [field.name for field in status.fields] == ["Mode", "Speed", ""]
+    assert status.fields[0].type.fully_qualified_name == "P.ECU.Mode"
+    assert status.fields[2].type is MESSAGE_FIELD_TYPE_RESERVED
+
+    assert db.get_message("P.BMS.Cells").frame_type is FrameType.CAN_EXT
+    # UNDEF ID is coerced to null
+    assert db.get_message("P.ECU.Loose").can_id is None
+
+    bus = db.get_bus_by_id(1)
+    assert sorted(message.name for message in db.get_associated_messages(bus)) == ["Cells", "ExtMsg", "Status"]
+    assert [node.fully_qualified_name for node in db.get_bus_nodes(bus)] == ["P.BMS", "P.ECU", "Q.Ext"]
+
+    links = {(link.node.name, link.link_type) for link in db.get_node_message_links(message=status)}
+    assert links == {("ECU", NodeMessageLinkType.SENDER), ("BMS", NodeMessageLinkType.RECEIVER),
+                     ("Ext", NodeMessageLinkType.RECEIVER), ("Dead", NodeMessageLinkType.RECEIVER)}
+
+
+def test_sqlite_lazy_attributes_with_slots():
+    db = make_test_database()
+
+    message = db.get_message_by_id(1)
+    assert not hasattr(message, "__dict__")
+
+    # unassigned slots are loaded on first access
+    queries = count_queries(db)
+    assert message.unit.name == "ECU"
+    assert message.bus.name == "CAN1"
+    assert [field.name for field in message.fields] == ["Mode", "Speed", ""]
+    assert len(queries) > 0
+
+    del queries[:]
+    assert [field.name for field in message.fields] == ["Mode", "Speed", ""]
+    assert queries == []
+
+
+def test_sqlite_get_message_by_can_id():
+    db = make_test_database()
+    bus = db.get_bus_by_id(1)
+
+    for load_all in [False, True]:
+        if load_all:
+            db.load_all()
+
+        assert db.get_message_by_can_id(bus, 256, FrameType.CAN_STD).name == "Status"
+        assert db.get_message_by_can_id(bus, 300, FrameType.CAN_EXT).name == "Cells"
+        assert db.get_message_by_can_id(bus, 300, FrameType.CAN_STD) is None
+        # deleted message
+        assert db.get_message_by_can_id(bus, 500, FrameType.CAN_STD) is None
+
+
+def test_sqlite_invalidate_keeps_shared_string_table():
+    strings = StringTable()
+    db = make_test_database(strings=strings)
+
+    db.load_all()
+    descriptions = [field.description for field in db.get_message_by_id(1).fields]
+    assert len(strings) > 0
+
+    # the entities are loaded again, but the strings are not duplicated
+    db.invalidate()
+    reloaded = [field.description for field in db.get_message_by_id(1).fields]
+    assert reloaded == descriptions
+    assert all(a is b for a, b in zip(reloaded, descriptions))
+
+    # a private table is dropped together with the cache
+    db = make_test_database()
+    db.load_all()
+    db.invalidate()
+    assert len(db.strings) == 0
+
+
+def test_sqlite_delete_node():
+    db = make_test_database()
+
+    db.transaction_begin()
+    db.delete(db.get_node("P.BMS"), who_changed="test")
+    db.transaction_commit()
+
+    assert sorted(node.name for node in db.get_nodes(scope=db.get_package("P"))) == ["ECU"]
+    assert "Cells" not in {message.name for message in db.get_messages()}
+
+
+def test_sqlite_cache_poll():
+    db = make_test_database(cache_poll_interval=0)
+    db.refresh()
+    ecu = db.get_node("P.ECU")
+
+    db.refresh()
+    assert db.get_node("P.ECU") is ecu
+
+    db.conn.execute("INSERT INTO changelog (`table`, `action`, `row`, `who_changed`) VALUES ('node', 'UPDATE', 1, 'x')")
+
+    # not in the middle of an operation
+    db.load_all()
+    assert db.get_node("P.ECU") is ecu
+
+    # the changelog has moved on, so the cache is dropped when the next operation starts
+    db.refresh()
+    assert db.get_node("P.ECU") is not ecu
+
+    # the size limit is only applied there, too
+    db.cache_size = 1
+    db.load_all()
+    ecu = db.get_node("P.ECU")
+    assert db.get_package("P") is ecu.package
+
+    db.refresh()
+    assert db.get_node("P.ECU") is not ecu
+
+
+def test_sqlite_refresh_sees_other_connections(tmp_path):
+    path = str(tmp_path / "candb.sqlite")
+
+    writer = SqliteProtocolDatabase(path)
+    # readers keep a snapshot for the duration of a transaction, like InnoDB does
+    writer.conn.execute("PRAGMA journal_mode = WAL")
+
+    with open(Path(__file__).parent / "data" / "TestDatabase.sql") as f:
+        writer.conn.executescript(f.read())
+
+    reader = SqliteProtocolDatabase(path, cache_poll_interval=0)
+    reader.refresh()
+
+    # a transaction left open, as by MySQL connections without autocommit
+    reader.conn.execute("BEGIN")
+    assert "Cells" in {message.name for message in reader.get_messages()}
+
+    writer.transaction_begin()
+    writer.delete(writer.get_message("P.BMS.Cells"), who_changed="test")
+    writer.transaction_commit()
+
+    reader.refresh()
+    assert not reader.conn.in_transaction
+    assert "Cells" not in {message.name for message in reader.get_messages()}
+
+
+def test_mysql_autocommit(monkeypatch):
+    # without autocommit, a MySQL connection would never see changes made by others, see test above
+    connections = []
+
+    connector = types.ModuleType("mysql.connector")
+    connector.errors = types.SimpleNamespace(OperationalError=type("OperationalError", (Exception,), {}))
+    connector.connect = lambda **kwargs: connections.append(kwargs)
+    mysql = types.ModuleType("mysql")
+    mysql.connector = connector
+
+    monkeypatch.setitem(sys.modules, "mysql", mysql)
+    monkeypatch.setitem(sys.modules, "mysql.connector", connector)
+
+    db = SqlProtocolDatabase.__new__(SqlProtocolDatabase)
+    db._conn_string = "mysql:host=db;dbname=candb"
+    db._connect()
+
+    assert connections == [dict(host="db", database="candb", autocommit=True)]
+
+
+def test_sqlite_exports_not_cached():
+    db = make_test_database(cache_poll_interval=0)
+    bus = db.get_bus_by_id(1)
+    cache = ExportCache()
+
+    # in-place edits of buses (and enum types) are not tracked, so no version can be told
+    assert db.get_version_token() is None
+
+    assert 'BA_ "Baudrate" 123456;' not in render_bus(bus, db, cache=cache).decode()
+    db.conn.execute("UPDATE bus SET bitrate = 123456 WHERE id = 1")
+    db.invalidate()
+
+    bus = db.get_bus_by_id(1)
+    assert 'BA_ "Baudrate" 123456;' in render_bus(bus, db, cache=cache).decode()
+
+
+def test_sqlite_snapshot_matches_lazy_loading():
+    for package_name in ["P", "Q"]:
+        db = make_test_database()
+        export_set = ExportSet(db)
+
+        for bus in db.get_buses(scope=db.get_package(package_name)):
+            export_set.add_bus(bus)
+
+        lazy_model = _render_set(export_set, db)
+
+        db = make_test_database()
+        snapshot_model = export_buses_of_package(db.get_package(package_name), db)
+
+        assert snapshot_model == lazy_model
+
+
+def test_sqlite_load_all_query_count():
+    db = make_test_database(cache_poll_interval=None)
+
+    queries = count_queries(db)
+    db.load_all()
+    # one query per table
+    assert len(queries) == 9
+
+    queries.clear()
+
+    for package in db.get_packages():
+        export_buses_of_package(package, db)
+
+    assert len(queries) == 0
+
+
+def test_sqlite_package_snapshot_query_count():
+    db = make_test_database(cache_poll_interval=None)
+    package = db.get_package("P")
+
+    queries = count_queries(db)
+    db.load_package_snapshot(package)
+    # one query per table
+    assert len(queries) == 9
+
+    queries.clear()
+
+    # the package itself can be traversed without any more queries; foreign nodes are not loaded completely
+    assert sorted(bus.name for bus in db.get_buses(scope=package)) == ["CAN1", "CAN2"]
+
+    for node in db.get_nodes(scope=package):
+        db.get_node_bus_links(node)
+        db.get_enum_types(scope=node)
+
+        for message in db.get_messages(scope=node):
+            assert all(field.message is message for field in message.fields)
+            db.get_node_message_links(message=message)
+
+    assert len(queries) == 0
+
+
+def test_sqlite_parents_are_joined():
+    db = make_test_database(cache_poll_interval=None)
+
+    queries = count_queries(db)
+    names = {message.fully_qualified_name for message in db.get_messages()}
+    names |= {node.fully_qualified_name for node in db.get_nodes()}
+    names |= {bus.fully_qualified_name for bus in db.get_buses()}
+
+    assert "Q.Ext.ExtMsg" in names and "P.BMS" in names and "Q.QBus" in names
+    # one query each for messages, nodes and buses
+    assert len(queries) == 3
+
+
+def test_sqlite_node_message_links_for():
+    db = make_test_database(cache_poll_interval=None)
+    messages = db.get_messages()
+
+    queries = count_queries(db)
+    links_by_message = db.get_node_message_links_for(messages)
+    assert len(queries) == 1
+
+    def as_tuples(links):
+        return {(link.node, link.message, link.link_type) for link in links}
+
+    for message in messages:
+        assert as_tuples(links_by_message[message]) == as_tuples(db.get_node_message_links(message=message))
+
+    ecu = db.get_node("P.ECU")
+    assert {(link.message.name, link.link_type) for link in db.get_node_message_links(node=ecu)} == \
+        {("Status", NodeMessageLinkType.SENDER), ("ExtMsg", NodeMessageLinkType.RECEIVER)}
+
+
+def test_sqlite_scope_queries():
+    db = make_test_database(cache_poll_interval=None)
+    package = db.get_package("P")
+
+    queries = count_queries(db)
+    fields = list(db.get_message_fields(scope=package))
+    # messages, fields, enum items, enum types
+    assert len(queries) == 4
+    assert [field.fully_qualified_name for field in fields if field.message.name == "Status"] == \
+        ["P.ECU.Status.Mode", "P.ECU.Status.Speed", "P.ECU.Status.<reserved>"]
+    assert {field.type.fully_qualified_name for field in fields if hasattr(field.type, "enum")} == \
+        {"P.ECU.Mode", "P.BMS.State"}
+
+    queries.clear()
+    enum_types = db.get_enum_types(scope=package)
+    assert len(queries) == 2
+    assert {enum_type.fully_qualified_name: [item.name for item in enum_type.items] for enum_type in enum_types} == \
+        {"P.ECU.Mode": ["OFF", "ON"], "P.BMS.State": ["A"]}
+
+    assert len(db.get_message_fields()) == 6
+
+
+def test_sqlite_code_generation_options():
+    db = make_test_database()
+    ecu = db.get_node("P.ECU")
+
+    assert db.get_code_generation_options(ecu) == CodeGenerationOptions()
+
+    db.conn.execute("UPDATE node SET code_model_version = 2, advanced_options = '-fcodegen-unit-versions' "
+                    "WHERE name = 'ECU'")
+    assert db.get_code_generation_options(ecu) == CodeGenerationOptions(2, "-fcodegen-unit-versions")
+
+
+def test_sql_make_cursor_reconnects():
+    # SqliteProtocolDatabase has its own cursors, so the MySQL code path is called directly
+    class LostConnectionError(Exception):
+        pass
+
+    class LostConnection:
+        def cursor(self):
+            raise LostConnectionError("2055: MySQL Connection not available.")
+
+    db = make_test_database()
+    connection = db.conn
+    db._connect = lambda: connection
+
+    # a driver error meaning that the connection is gone: reconnect and retry
+    db._connection_errors = (LostConnectionError,)
+    db.conn = LostConnection()
+    assert SqlProtocolDatabase._make_cursor(db).execute("SELECT 1").fetchone() == (1,)
+    assert db.conn is connection
+
+    # errors not declared by the driver are passed on
+    db._connection_errors = ()
+    db.conn = LostConnection()
+
+    with pytest.raises(LostConnectionError):
+        SqlProtocolDatabase._make_cursor(db)
@@ -0,0 +1,46 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from protodb.export.export_json2 import export_buses_of_package
+from protodb.tests.testutil import count_queries, make_test_database
+from protodb.trace import normalize_query, tracing
+
+
+def test_tracing():
+    db = make_test_database(cache_poll_interval=None)
+    package = db.get_package("P")
+
+    queries = count_queries(db)
+
+    with tracing(db) as stats:
+        export_buses_of_package(package, db)
+
+    report = stats.to_dict()
+    assert report["methods"]["load_package_snapshot"]["calls"] == 1
+    assert sum(query["calls"] for query in report["queries"].values()) == len(queries)
+    assert report["queries"]["SELECT id, name FROM package"]["rows"] == 2
+
+    # instrumentation is removed afterwards
+    assert "_make_cursor" not in db.__dict__
+    assert "get_buses" not in db.__dict__
+
+
+def test_normalize_query():
+    assert normalize_query("SELECT id\n  FROM message WHERE id IN (%s, %s, %s)") == \
+        "SELECT id FROM message WHERE id IN (%s, ...)"
@@ -0,0 +1,134 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import socket
+import threading
+
+from protodb.tests.testutil import make_test_database
+from protodb.worker import Worker, WorkerServer
+
+
+def call(socket_path: str, request: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def test_worker(tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+    worker = Worker(pool_size=1, keep_cache=False, modules=["protodb.tools.frame_id_parser"])
+
+    with WorkerServer(socket_path, worker) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        try:
+            response = call(socket_path, dict(argv=["-m", "protodb.tools.frame_id_parser"]))
+            assert response["status"] == 0
+            assert isinstance(json.loads(response["stdout"]), list)
+
+            # same as above, but with the module name attached
+            assert call(socket_path, dict(argv=["-mprotodb.tools.frame_id_parser"]))["stdout"] == response["stdout"]
+
+            assert call(socket_path, dict(argv=["candb-codegen/candb-generate-c.py"])) == dict(fallback=True)
+        finally:
+            server.shutdown()
+            thread.join()
+
+
+NOISY_MODULE = '''
+import argparse, sys, time
+
+def main(argv, *, env, stdin, stdout, connect):
+    parser = argparse.ArgumentParser(prog="noisy")
+    parser.add_argument("count", type=int)
+    args = parser.parse_args(argv)
+
+    for i in range(args.count):
+        print(f"{args.count}: {i}", file=sys.stderr)
+        time.sleep(0.001)
+
+    print("done", file=stdout)
+'''
+
+
+def test_worker_stderr(tmp_path, monkeypatch):
+    (tmp_path / "noisy_module.py").write_text(NOISY_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    worker = Worker(pool_size=1, keep_cache=False, modules=["noisy_module"])
+
+    # argparse reports usage errors on stderr
+    response = worker.handle(dict(argv=["-m", "noisy_module", "x"]))
+    assert response["status"] == 2
+    assert "noisy: error: argument count: invalid int value: 'x'" in response["stderr"]
+
+    # concurrent requests only get their own output
+    responses = {}
+
+    def run(count: int):
+        responses[count] = worker.handle(dict(argv=["-m", "noisy_module", str(count)]))
+
+    threads = [threading.Thread(target=run, args=(count,)) for count in (10, 20)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    for count, response in responses.items():
+        assert response == dict(status=0, stdout="done\n", stderr="".join(f"{count}: {i}\n" for i in range(count)))
+
+
+READER_MODULE = '''
+def main(argv, *, env, stdin, stdout, connect):
+    db = connect(env["PROTODB_CONN_STRING"])
+
+    # like a MySQL connection without autocommit: the queries run in a transaction that is never ended
+    if not db.conn.in_transaction:
+        db.conn.execute("BEGIN")
+
+    print(" ".join(sorted(message.name for message in db.get_messages())), file=stdout)
+'''
+
+
+def test_worker_sees_changes_between_requests(tmp_path, monkeypatch):
+    (tmp_path / "reader_module.py").write_text(READER_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    path = str(tmp_path / "candb.sqlite")
+    writer = make_test_database(path)
+    # readers keep a snapshot for the duration of a transaction, like InnoDB does
+    writer.conn.execute("PRAGMA journal_mode = WAL")
+
+    worker = Worker(pool_size=1, keep_cache=False, modules=["reader_module"])
+    request = dict(argv=["-m", "reader_module"], env=dict(PROTODB_CONN_STRING="sqlite:" + path))
+
+    assert "Cells" in worker.handle(request)["stdout"].split()
+
+    writer.transaction_begin()
+    writer.delete(writer.get_message("P.BMS.Cells"), who_changed="test")
+    writer.transaction_commit()
+
+    assert "Cells" not in worker.handle(request)["stdout"].split()
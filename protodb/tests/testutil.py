@@ -16,11 +16,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
 
+from pathlib import Path
 from typing import Iterable
 
 from protodb import drc, ProtocolDatabase
 from protodb.drc import Check
 from protodb.model import Entity
+from protodb.sqliteprotocoldatabase import SqliteProtocolDatabase
 
 
 def check_over_set(db: ProtocolDatabase, check: Check, set: Iterable[Entity]):
@@ -32,3 +34,18 @@ def check_over_set(db: ProtocolDatabase, check: Check, set: Iterable[Entity]):
         check(context, object)
 
     return output.get_violations()
+
+
+def make_test_database(path: str = ":memory:", **kwargs) -> SqliteProtocolDatabase:
+    db = SqliteProtocolDatabase(path, **kwargs)
+
+    with open(Path(__file__).parent / "data" / "TestDatabase.sql") as f:
+        db.conn.executescript(f.read())
+
+    return db
+
+
+def count_queries(db: SqliteProtocolDatabase) -> list:
+    queries = []
+    db.conn.set_trace_callback(queries.append)
+    return queries
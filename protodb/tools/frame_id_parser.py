@@ -19,10 +19,13 @@
 from dataclasses import dataclass
 from enum import auto, Enum
 import json
-from typing import Optional, List
+import sys
+from typing import Dict, Optional, List, TextIO, Union
 
 import yaml
 
+from .. import model as protodb_model
+
 
 def check(model, required_properties, allowed_properties):
     assert isinstance(model, dict)
@@ -73,6 +76,24 @@ class FrameIdField:
         else:
             return [self.label_fmt % i for i in range(self.min_value, self.min_value + 2**self.bits)]
 
+    def decode(self, can_id: int) -> int:
+        """
+        :return: index of the field's label
+        """
+        return (can_id >> self.lsb_pos) & ((1 << self.bits) - 1)
+
+    def encode(self, value: Union[int, str]) -> int:
+        """
+        :param value: label or its index
+        :return: the field's bits in place, to be OR-ed into the frame ID
+        """
+        index = self.flat_labels.index(value) if isinstance(value, str) else value
+
+        if not 0 <= index < (1 << self.bits):
+            raise ValueError(f'Value {value} out of range for frame ID field {self.name}')
+
+        return index << self.lsb_pos
+
 
 @dataclass
 class FrameIdType:
@@ -83,15 +104,50 @@ class FrameIdType:
     def dict(self):
         return dict(name=self.name, frame_type=self.frame_type, fields=[field.dict() for field in self.fields])
 
+    def decode(self, can_id: int) -> Dict[str, str]:
+        """
+        :return: label of each field by field name
+        """
+        return {field.name: field.flat_labels[field.decode(can_id)] for field in self.fields}
 
-if __name__ == "__main__":
-    try:
-        with open("config/frame-id-formats.yml") as f:
-            model = yaml.safe_load(f)
-    except FileNotFoundError:
-        with open("config/frame-id-formats.default.yml") as f:
+    def encode(self, values: Dict[str, Union[int, str]]) -> int:
+        """
+        Assemble a frame ID, like the CAN ID editor of the web UI
+
+        :param values: label (or label index) of each field by field name
+        """
+        can_id = 0
+
+        for field in self.fields:
+            can_id |= field.encode(values[field.name])
+
+        return can_id
+
+    @property
+    def model_frame_type(self) -> protodb_model.FrameType:
+        # frame_type is kept as in the configuration file, for the JSON output of main()
+        return protodb_model.FrameType[self.frame_type]
+
+
+def load_frame_id_types(path: Optional[str] = None) -> List[FrameIdType]:
+    """
+    :param path: configuration file; by default config/frame-id-formats.yml, falling back to the bundled defaults
+    """
+    if path is not None:
+        with open(path) as f:
             model = yaml.safe_load(f)
+    else:
+        try:
+            with open("config/frame-id-formats.yml") as f:
+                model = yaml.safe_load(f)
+        except FileNotFoundError:
+            with open("config/frame-id-formats.default.yml") as f:
+                model = yaml.safe_load(f)
 
+    return parse_frame_id_types(model)
+
+
+def parse_frame_id_types(model) -> List[FrameIdType]:
     assert isinstance(model, list)
 
     types = []
@@ -162,5 +218,16 @@ if __name__ == "__main__":
             # print(type)
             types.append(type)
 
+    return types
+
+
+def main(argv=None, *, env=None, stdin=None, stdout: Optional[TextIO] = None, connect=None) -> None:
+    """ Entry point, see protodb.worker for the parameters """
+    types = load_frame_id_types()
+
     # dump flat model
-    print(json.dumps([type.dict() for type in types]))
+    print(json.dumps([type.dict() for type in types]), file=stdout if stdout is not None else sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
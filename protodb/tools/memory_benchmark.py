@@ -0,0 +1,97 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measure the memory held by a fully loaded protocol database.
+
+    python -m protodb.tools.memory_benchmark --db D1.json
+    python -m protodb.tools.memory_benchmark --db sqlite:protodb.sqlite
+
+Only the memory still allocated after loading is counted, so for JSON databases this excludes the source text.
+"""
+
+import gc
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+from .. import ProtocolDatabase
+from ..jsonprotocoldatabase import JsonProtocolDatabase
+from ..sqlprotocoldatabase import SqlProtocolDatabase
+
+
+def measure(open_db: Callable[[], ProtocolDatabase]) -> Dict[str, float]:
+    """
+    :param open_db: opens and fully loads the database
+    :return: memory in bytes, time in seconds, number of entities by type
+    """
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        start = time.perf_counter()
+        db = open_db()
+        elapsed = time.perf_counter() - start
+
+        gc.collect()
+        memory, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    messages = list(db.get_messages())
+
+    return dict(
+        memory=memory,
+        peak=peak,
+        time=elapsed,
+        messages=len(messages),
+        message_fields=sum(len(message.fields) for message in messages),
+        nodes=len(list(db.get_nodes())),
+    )
+
+
+def _open_json(path: str) -> JsonProtocolDatabase:
+    return JsonProtocolDatabase.with_path(path)
+
+
+def _open_sql(conn_string: str) -> SqlProtocolDatabase:
+    from .. import connect
+
+    db = connect(conn_string)
+    db.load_all()
+    return db
+
+
+if __name__ == "__main__":
+    import configargparse
+
+    parser = configargparse.ArgParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--db', dest='conn_string', env_var='PROTODB_CONN_STRING', required=True)
+    args = parser.parse_args()
+
+    if args.conn_string.endswith('.json'):
+        result = measure(lambda: _open_json(args.conn_string))
+    else:
+        result = measure(lambda: _open_sql(args.conn_string))
+
+    entities = result['messages'] + result['message_fields'] + result['nodes']
+
+    print(f"{result['messages']} messages, {result['message_fields']} fields, {result['nodes']} nodes")
+    print(f"loaded in {result['time']:.3f} s")
+    print(f"memory: {result['memory'] / 1024 / 1024:.1f} MiB (peak {result['peak'] / 1024 / 1024:.1f} MiB), "
+          f"{result['memory'] / entities:.0f} bytes per message, field or node")
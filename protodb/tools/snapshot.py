@@ -0,0 +1,218 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Copy a SQL protocol database into a local SQLite file or JSON2 model, so that exports and checks can run without
+loading the main database.
+
+A SQLite snapshot is refreshed incrementally on subsequent runs. The changelog only tracks messages and nodes, so
+only the (large) message and message_field tables are copied selectively; all other tables are small and are copied
+whole every time. Soft-deleted rows are copied together with their `valid` flag, the backend filters them out.
+
+A JSON2 snapshot is always exported in full, but the source can itself be a SQLite snapshot:
+
+    python -m protodb.tools.snapshot --db "mysql:..." protodb.sqlite
+    python -m protodb.tools.snapshot --db "sqlite:protodb.sqlite" protodb.json
+"""
+
+from datetime import datetime
+import os
+from typing import Dict, Iterable, List
+
+from ..sqlprotocoldatabase import SqlProtocolDatabase
+from ..sqliteprotocoldatabase import SqliteProtocolDatabase
+
+BATCH_SIZE = 1000
+
+# Tables not (fully) covered by the changelog. Copied whole on every refresh.
+UNTRACKED_TABLES = ['package', 'bus', 'node', 'node_bus', 'enum_type', 'enum_item', 'message_node']
+
+
+def copy_to_sqlite(source: SqlProtocolDatabase, dest: SqliteProtocolDatabase, full: bool = False) -> Dict[str, int]:
+    """
+    Copy the source database into `dest`, incrementally if `dest` already contains a snapshot
+
+    :param full: if True, always copy everything
+    :return: number of rows copied per table
+    """
+
+    # A single transaction gives a consistent view of the source (assuming REPEATABLE READ) and makes the update
+    # atomic for readers of the destination
+    source.transaction_begin()
+    dest.transaction_begin()
+
+    dest_cursor = dest._make_cursor()
+    dest_cursor.execute('CREATE TABLE IF NOT EXISTS snapshot_meta (`key` TEXT PRIMARY KEY, `value`)')
+    dest_cursor.execute("SELECT `value` FROM snapshot_meta WHERE `key` = 'changelog_id'")
+    row = dest_cursor.fetchone()
+
+    if row is None:
+        full = True
+    else:
+        last_changelog_id, = row
+
+    cursor = source._make_cursor()
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM changelog')
+    changelog_id, = cursor.fetchone()
+
+    rows_copied = {}
+
+    if full:
+        for table in UNTRACKED_TABLES + ['message', 'message_field', 'changelog']:
+            dest_cursor.execute(f'DELETE FROM `{table}`')
+            rows_copied[table] = _copy_rows(source, dest, table)
+    else:
+        for table in UNTRACKED_TABLES:
+            dest_cursor.execute(f'DELETE FROM `{table}`')
+            rows_copied[table] = _copy_rows(source, dest, table)
+
+        # Deleting a node also soft-deletes its messages, but only the node is logged
+        cursor.execute("SELECT id FROM message WHERE "
+                       "id IN (SELECT `row` FROM changelog WHERE `table` = 'message' AND id > %s AND id <= %s) OR "
+                       "node_id IN (SELECT `row` FROM changelog WHERE `table` = 'node' AND id > %s AND id <= %s)",
+                       (last_changelog_id, changelog_id, last_changelog_id, changelog_id))
+        changed_message_ids = [row for row, in cursor]
+
+        rows_copied['changelog'] = _copy_rows(source, dest, 'changelog', 'id > %s AND id <= %s',
+                                              (last_changelog_id, changelog_id))
+
+        # Hard deletes are not logged, so compare the sets of message IDs
+        cursor.execute('SELECT id FROM message')
+        dest_cursor.execute('CREATE TEMPORARY TABLE IF NOT EXISTS snapshot_message_id (id INTEGER PRIMARY KEY)')
+        dest_cursor.execute('DELETE FROM snapshot_message_id')
+
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            dest.conn.executemany('INSERT INTO snapshot_message_id (id) VALUES (?)', rows)
+
+        dest_cursor.execute('DELETE FROM message WHERE id NOT IN (SELECT id FROM snapshot_message_id)')
+        dest_cursor.execute('DELETE FROM message_field WHERE message_id NOT IN (SELECT id FROM snapshot_message_id)')
+        dest_cursor.execute('DROP TABLE snapshot_message_id')
+
+        rows_copied['message'] = 0
+        rows_copied['message_field'] = 0
+
+        for i in range(0, len(changed_message_ids), BATCH_SIZE):
+            batch = changed_message_ids[i:i + BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+
+            dest_cursor.execute(f'DELETE FROM message WHERE id IN ({placeholders})', batch)
+            dest_cursor.execute(f'DELETE FROM message_field WHERE message_id IN ({placeholders})', batch)
+
+            rows_copied['message'] += _copy_rows(source, dest, 'message', f'id IN ({placeholders})', batch)
+            rows_copied['message_field'] += _copy_rows(source, dest, 'message_field',
+                                                       f'message_id IN ({placeholders})', batch)
+
+    dest_cursor.execute("INSERT OR REPLACE INTO snapshot_meta (`key`, `value`) VALUES ('changelog_id', ?)",
+                        (changelog_id,))
+
+    dest.transaction_commit()
+    source.conn.rollback()
+
+    # drop any entities cached before the refresh
+    dest.invalidate()
+
+    return rows_copied
+
+
+def export_json(source: SqlProtocolDatabase, path: str) -> None:
+    from ..export.export_json2 import stream_all_packages
+
+    # write to a temporary file first, so that readers never see a partial snapshot
+    tmp_path = path + '.tmp'
+
+    source.transaction_begin()
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in stream_all_packages(source):
+                f.write(chunk)
+    finally:
+        source.conn.rollback()
+
+    os.replace(tmp_path, path)
+
+
+def _copy_rows(source: SqlProtocolDatabase, dest: SqliteProtocolDatabase, table: str, where: str = '1 = 1',
+               args: Iterable = ()) -> int:
+    # Only copy the columns known to the SQLite schema
+    dest_cursor = dest._make_cursor()
+    dest_cursor.execute(f'PRAGMA table_info(`{table}`)')
+    columns = dest_cursor.fetchall()
+
+    column_names = ', '.join(f'`{column[1]}`' for column in columns)
+    placeholders = ', '.join(['?'] * len(columns))
+    timestamp_columns = [i for i, column in enumerate(columns) if column[2] == 'TIMESTAMP']
+
+    cursor = source._make_cursor()
+    cursor.execute(f'SELECT {column_names} FROM `{table}` WHERE {where}', tuple(args))
+
+    count = 0
+
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+
+        if timestamp_columns:
+            rows = [_convert_timestamps(row, timestamp_columns) for row in rows]
+
+        dest.conn.executemany(f'INSERT INTO `{table}` ({column_names}) VALUES ({placeholders})', rows)
+        count += len(rows)
+
+    return count
+
+
+def _convert_timestamps(row, timestamp_columns: List[int]):
+    # the default sqlite3 adapter for datetime is deprecated since Python 3.12
+    row = list(row)
+
+    for i in timestamp_columns:
+        if isinstance(row[i], datetime):
+            row[i] = row[i].isoformat(' ')
+
+    return row
+
+
+if __name__ == "__main__":
+    import configargparse
+
+    from .. import connect
+
+    parser = configargparse.ArgParser(description='Copy the protocol database to a SQLite file (*.sqlite, *.db) '
+                                                  'or JSON2 model (*.json)')
+    parser.add_argument('--db', dest='conn_string', env_var='PROTODB_CONN_STRING', required=True)
+    parser.add_argument('--full', action='store_true', help='do not refresh incrementally (SQLite only)')
+    parser.add_argument('output', help='a SQLite file is refreshed incrementally; '
+                                       'a JSON model is always exported in full')
+    args = parser.parse_args()
+
+    source = connect(args.conn_string)
+
+    if not isinstance(source, SqlProtocolDatabase):
+        parser.error('source must be a SQL database')
+
+    if args.output.endswith('.json'):
+        export_json(source, args.output)
+    else:
+        dest = SqliteProtocolDatabase(args.output, run_consistency_checks=False)
+        rows_copied = copy_to_sqlite(source, dest, full=args.full)
+
+        print(', '.join(f'{table}: {count}' for table, count in rows_copied.items()))
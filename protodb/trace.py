@@ -0,0 +1,303 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Opt-in instrumentation of ProtocolDatabase instances.
+
+Records calls of public methods and SQL queries (grouped by query shape) with their count, total time, number of
+rows fetched and a latency histogram. Either trace a block of code:
+
+    with trace.tracing(db) as stats:
+        export_buses_of_package(package, db)
+
+    print(stats.to_dict())
+
+or set PROTODB_TRACE=1 to trace every database opened by protodb.connect and dump the statistics to stderr as JSON
+at exit. Any other value of PROTODB_TRACE is used as the path of the dump file.
+"""
+
+import atexit
+from contextlib import contextmanager
+import functools
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from .protocoldatabase import ProtocolDatabase
+
+# Upper bounds of histogram buckets in milliseconds; the last bucket is unbounded
+HISTOGRAM_BOUNDS_MS = (0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000, 3000)
+
+
+class Counter:
+    calls: int
+    rows: int
+    total_time: float
+    histogram: List[int]
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.total_time = 0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add_call(self, elapsed: float) -> None:
+        self.calls += 1
+        self.total_time += elapsed
+
+        elapsed_ms = elapsed * 1000
+        bucket = 0
+
+        while bucket < len(HISTOGRAM_BOUNDS_MS) and elapsed_ms > HISTOGRAM_BOUNDS_MS[bucket]:
+            bucket += 1
+
+        self.histogram[bucket] += 1
+
+    def to_dict(self, with_rows: bool) -> dict:
+        labels = [f'<={bound}' for bound in HISTOGRAM_BOUNDS_MS] + [f'>{HISTOGRAM_BOUNDS_MS[-1]}']
+
+        d = dict(calls=self.calls, total_ms=round(self.total_time * 1000, 3))
+
+        if with_rows:
+            d['rows'] = self.rows
+
+        d['histogram_ms'] = {label: count for label, count in zip(labels, self.histogram) if count}
+        return d
+
+
+class Stats:
+    """
+    Thread-safe collection of counters. Query latency is measured for execute() only; the time spent fetching
+    the rows is added to the total, but not to the histogram.
+    """
+
+    methods: Dict[str, Counter]
+    queries: Dict[str, Counter]
+
+    _lock: threading.Lock
+
+    def __init__(self):
+        self.methods = {}
+        self.queries = {}
+
+        self._lock = threading.Lock()
+
+    def add_method_call(self, name: str, elapsed: float) -> None:
+        with self._lock:
+            self.methods.setdefault(name, Counter()).add_call(elapsed)
+
+    def add_query(self, shape: str, elapsed: float) -> None:
+        with self._lock:
+            self.queries.setdefault(shape, Counter()).add_call(elapsed)
+
+    def add_rows(self, shape: str, rows: int, elapsed: float) -> None:
+        with self._lock:
+            counter = self.queries.setdefault(shape, Counter())
+            counter.rows += rows
+            counter.total_time += elapsed
+
+    def clear(self) -> None:
+        with self._lock:
+            self.methods.clear()
+            self.queries.clear()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return dict(
+                methods={name: counter.to_dict(with_rows=False) for name, counter in sorted(self.methods.items())},
+                queries={shape: counter.to_dict(with_rows=True) for shape, counter in
+                         sorted(self.queries.items(), key=lambda item: -item[1].total_time)},
+            )
+
+
+# Statistics of databases traced because of PROTODB_TRACE; None if not enabled
+global_stats: Optional[Stats] = None
+
+
+class TracingCursor:
+    """
+    Wraps a DB-API cursor (see SqlProtocolDatabase._make_cursor) to record queries
+    """
+
+    def __init__(self, cursor, sinks: List[Stats]):
+        self._cursor = cursor
+        self._shape = None
+        self._sinks = sinks
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        it = iter(self._cursor)
+
+        while True:
+            start = time.perf_counter()
+
+            try:
+                row = next(it)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+
+            self._add_rows(1, elapsed)
+            yield row
+
+    def execute(self, query, *args, **kwargs):
+        self._shape = normalize_query(query)
+
+        start = time.perf_counter()
+        result = self._cursor.execute(query, *args, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        for stats in self._sinks:
+            stats.add_query(self._shape, elapsed)
+
+        return result
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._add_rows(len(rows), time.perf_counter() - start)
+        return rows
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._add_rows(len(rows), time.perf_counter() - start)
+        return rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._add_rows(1 if row is not None else 0, time.perf_counter() - start)
+        return row
+
+    def _add_rows(self, rows: int, elapsed: float) -> None:
+        if self._shape is not None:
+            for stats in self._sinks:
+                stats.add_rows(self._shape, rows, elapsed)
+
+
+def instrument(db: ProtocolDatabase, stats: Stats) -> None:
+    """
+    Start recording calls on `db` into `stats`. A database can be traced into several Stats at once.
+    """
+    sinks = db.__dict__.get('_trace_sinks')
+
+    if sinks is not None:
+        sinks.append(stats)
+        return
+
+    sinks = [stats]
+    db._trace_sinks = sinks
+
+    # Shadow the methods by instance attributes, so that also internal calls are recorded
+    for name, method in inspect.getmembers(db, inspect.ismethod):
+        if not name.startswith('_'):
+            setattr(db, name, _wrap_method(name, method, sinks))
+
+    if hasattr(db, '_make_cursor'):
+        make_cursor = db._make_cursor
+
+        @functools.wraps(make_cursor)
+        def _make_cursor(*args, **kwargs):
+            return TracingCursor(make_cursor(*args, **kwargs), sinks)
+
+        db._make_cursor = _make_cursor
+
+
+def uninstrument(db: ProtocolDatabase, stats: Stats) -> None:
+    sinks = db.__dict__['_trace_sinks']
+    sinks.remove(stats)
+
+    if not sinks:
+        for name, value in list(db.__dict__.items()):
+            if callable(value) and hasattr(value, '__wrapped__'):
+                delattr(db, name)
+
+        del db._trace_sinks
+
+
+@contextmanager
+def tracing(db: ProtocolDatabase, stats: Optional[Stats] = None) -> Iterator[Stats]:
+    if stats is None:
+        stats = Stats()
+
+    instrument(db, stats)
+
+    try:
+        yield stats
+    finally:
+        uninstrument(db, stats)
+
+
+def instrument_from_env(db: ProtocolDatabase) -> None:
+    """
+    Trace `db` into global_stats if PROTODB_TRACE is set
+    """
+    global global_stats
+
+    setting = os.environ.get('PROTODB_TRACE')
+
+    if not setting:
+        return
+
+    if global_stats is None:
+        global_stats = Stats()
+        atexit.register(_dump_global_stats, setting)
+
+    instrument(db, global_stats)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Reduce a query to its shape, so that e.g. IN lists of different length are counted together
+    """
+    query = re.sub(r'\s+', ' ', query).strip()
+    return re.sub(r'%s(, %s)+', '%s, ...', query)
+
+
+def _dump_global_stats(setting: str) -> None:
+    if setting == '1':
+        json.dump(global_stats.to_dict(), sys.stderr, indent=2)
+        sys.stderr.write('\n')
+    else:
+        with open(setting, 'wt') as f:
+            json.dump(global_stats.to_dict(), f, indent=2)
+
+
+def _wrap_method(name: str, method, sinks: List[Stats]):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+
+        try:
+            return method(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+
+            for stats in sinks:
+                stats.add_method_call(name, elapsed)
+
+    return wrapper
@@ -17,6 +17,7 @@
 # along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
 
 from pathlib import Path
+import threading
 
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
@@ -29,3 +30,24 @@ env = Environment(
     trim_blocks=True,
     lstrip_blocks=True,
 )
+
+# env.globals are shared by all templates, so renders with different globals must not run concurrently
+_globals_lock = threading.Lock()
+
+
+def render(template_name: str, data: dict, **kwargs) -> str:
+    """
+    Render a template. The "_globals" key of `data`, if present, is made available to all templates as globals
+    for the duration of the call.
+    """
+    template = env.get_template(template_name)
+
+    with _globals_lock:
+        saved_globals = dict(env.globals)
+
+        try:
+            env.globals.update(data.get("_globals", {}))
+            return template.render(**data, **kwargs)
+        finally:
+            env.globals.clear()
+            env.globals.update(saved_globals)
@@ -18,11 +18,13 @@
 
 from enum import auto, Enum
 import json
+import os
 import re
-from sys import stdin
+import sys
+from typing import Callable, List, Mapping, Optional, TextIO
 
-from .common_jinja_env import env
-from .. import connect, ProtocolDatabase
+from .common_jinja_env import render
+from .. import ProtocolDatabase
 
 
 # https://stackoverflow.com/a/37697078
@@ -103,25 +105,27 @@ def build_search_index(db: ProtocolDatabase):
     return search_data
 
 
-if __name__ == "__main__":
+def main(argv: Optional[List[str]] = None, *, env: Optional[Mapping[str, str]] = None,
+         stdin: Optional[TextIO] = None, stdout: Optional[TextIO] = None,
+         connect: Optional[Callable[[str], ProtocolDatabase]] = None) -> None:
+    """ Entry point, see protodb.worker for the parameters """
     import configargparse
 
+    if connect is None:
+        from .. import connect
+
     parser = configargparse.ArgParser()
     parser.add_argument('--db', dest='conn_string', env_var='PROTODB_CONN_STRING', required=True)
-    args = parser.parse_args()
+    args = parser.parse_args(argv, env_vars=env if env is not None else os.environ)
 
     db = connect(args.conn_string)
 
-    template = env.get_template("dashboard.html")
+    data = json.load(stdin if stdin is not None else sys.stdin)
 
-    data = json.load(stdin)
+    search_data = build_search_index(db)
 
-    try:
-        env.globals.update(data["_globals"])
-    except KeyError:
-        pass
+    print(render("dashboard.html", data, search_data=search_data), file=stdout if stdout is not None else sys.stdout)
 
-    search_data = build_search_index(db)
 
-    print(template.render(**data,
-                          search_data=search_data))
+if __name__ == "__main__":
+    main()
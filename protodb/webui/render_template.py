@@ -20,21 +20,23 @@
 
 import argparse
 import json
-from sys import stdin
+import sys
+from typing import List, Optional, TextIO
 
-from .common_jinja_env import env
+from .common_jinja_env import render
 
-parser = argparse.ArgumentParser()
-parser.add_argument("template_name")
-args = parser.parse_args()
 
-template = env.get_template(args.template_name + ".html")
+def main(argv: Optional[List[str]] = None, *, env=None, stdin: Optional[TextIO] = None,
+         stdout: Optional[TextIO] = None, connect=None) -> None:
+    """ Entry point, see protodb.worker for the parameters """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("template_name")
+    args = parser.parse_args(argv)
 
-data = json.load(stdin)
+    data = json.load(stdin if stdin is not None else sys.stdin)
 
-try:
-    env.globals.update(data["_globals"])
-except KeyError:
-    pass
+    print(render(args.template_name + ".html", data), file=stdout if stdout is not None else sys.stdout)
 
-print(template.render(**data))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#
+# Copyright (C) 2016-2023 Martin Cejp
+#
+# This file is part of ProtoDB.
+#
+# ProtoDB is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ProtoDB is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with ProtoDB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Long-running process serving ProtoDB commands over a Unix socket, so that the web UI does not have to start
+a new Python interpreter (and open a new database connection) for every page.
+
+    python -m protodb.worker --socket /run/protodb-worker/worker.sock
+
+Protocol: the client connects, sends one request as a single line of JSON and reads one line of JSON in response.
+
+    request:  {"argv": ["-m", "protodb.webui.render_template", "bus"], "env": {...}, "stdin": "...", "workdir": null}
+    response: {"status": 0, "stdout": "...", "stderr": ""}
+
+`argv` is the command line as it would be passed to python3; `env` holds variables to add to the environment
+of the worker. If the command is not served by the worker, the response is {"fallback": true} and the client should
+run it as a subprocess instead (see candb/service/pythoninvoker.php).
+
+Served modules expose an entry point
+
+    main(argv, *, env, stdin, stdout, connect)
+
+where `argv` are the arguments following the module name, `env` is the environment to read options from, `stdin` and
+`stdout` are text streams and `connect` opens a database by connection string (like protodb.connect). Any of them can
+be None to use the process defaults. Whatever the command writes to sys.stderr (argparse errors, warnings, diagnostics)
+is returned in the response, too.
+"""
+
+import contextlib
+import importlib
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import traceback
+from types import ModuleType
+from typing import Dict, Iterator, List, Optional, TextIO
+
+from . import connect, ProtocolDatabase
+from .pool import ProtocolDatabasePool
+
+SERVED_MODULES = [
+    'protodb.drc.all_checks',
+    'protodb.export.export_json2',
+    'protodb.tools.frame_id_parser',
+    'protodb.webui.dashboard',
+    'protodb.webui.render_template',
+]
+
+
+class _ThreadStderr:
+    """
+    Stands in for sys.stderr, so that the error output of a request can be captured without mixing in the output of
+    other requests being handled at the same time (unlike contextlib.redirect_stderr, which is process-wide)
+    """
+
+    default: TextIO
+
+    _local: threading.local
+
+    def __init__(self, default: TextIO):
+        self.default = default
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def capture(self, buffer: TextIO) -> Iterator[None]:
+        self._local.buffer = buffer
+
+        try:
+            yield
+        finally:
+            self._local.buffer = None
+
+    def _target(self) -> TextIO:
+        return getattr(self._local, 'buffer', None) or self.default
+
+    def write(self, s: str) -> int:
+        return self._target().write(s)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self._target(), name)
+
+
+_install_lock = threading.Lock()
+
+
+def _install_thread_stderr() -> _ThreadStderr:
+    with _install_lock:
+        if not isinstance(sys.stderr, _ThreadStderr):
+            sys.stderr = _ThreadStderr(sys.stderr)
+
+        return sys.stderr
+
+
+class Worker:
+    keep_cache: bool
+    pool_size: int
+
+    _lock: threading.Lock
+    _modules: Dict[str, ModuleType]
+    _pools: Dict[str, ProtocolDatabasePool]
+
+    def __init__(self, pool_size: int, keep_cache: bool, modules: List[str] = SERVED_MODULES):
+        self.keep_cache = keep_cache
+        self.pool_size = pool_size
+
+        self._lock = threading.Lock()
+        self._pools = {}
+
+        # import everything up front, so that the first requests are not slowed down
+        self._modules = {name: importlib.import_module(name) for name in modules}
+
+    def handle(self, request: dict) -> dict:
+        module_name, argv = _parse_command_line(request['argv'])
+
+        # the working directory is shared by all threads, so commands needing a different one are not served
+        if module_name not in self._modules or request.get('workdir') is not None:
+            return dict(fallback=True)
+
+        env = {**os.environ, **(request.get('env') or {})}
+        stdin = io.StringIO(request.get('stdin') or '')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        checked_out = []
+
+        def connect_pooled(conn_string: str) -> ProtocolDatabase:
+            # the checkout ends any transaction left open by the previous request, see ProtocolDatabase.refresh
+            pool = self._get_pool(conn_string)
+            db = pool.checkout()
+            checked_out.append((pool, db))
+            return db
+
+        try:
+            with _install_thread_stderr().capture(stderr):
+                self._modules[module_name].main(argv, env=env, stdin=stdin, stdout=stdout, connect=connect_pooled)
+            status = 0
+        except SystemExit as ex:
+            status = ex.code if isinstance(ex.code, int) else 1
+
+            if ex.code is not None and not isinstance(ex.code, int):
+                print(ex.code, file=stderr)
+        except BaseException:
+            status = 1
+            stderr.write(traceback.format_exc())
+        finally:
+            for pool, db in checked_out:
+                pool.checkin(db)
+
+        return dict(status=status, stdout=stdout.getvalue(), stderr=stderr.getvalue())
+
+    def _get_pool(self, conn_string: str) -> ProtocolDatabasePool:
+        with self._lock:
+            if conn_string not in self._pools:
+                # The changelog does not track all tables (e.g. enum types, buses), so by default, only the connections
+                # are reused
+                self._pools[conn_string] = ProtocolDatabasePool(conn_string, size=self.pool_size, factory=connect,
+                                                                keep_cache=self.keep_cache)
+
+            return self._pools[conn_string]
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    server: 'WorkerServer'
+
+    def handle(self) -> None:
+        line = self.rfile.readline()
+
+        try:
+            response = self.server.worker.handle(json.loads(line))
+        except Exception:
+            response = dict(status=1, stdout='', stderr=traceback.format_exc())
+
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    worker: Worker
+
+    def __init__(self, socket_path: str, worker: Worker):
+        self.worker = worker
+
+        super().__init__(socket_path, RequestHandler)
+
+
+def _parse_command_line(argv: List[str]):
+    """
+    :return: (module name or None, remaining arguments)
+    """
+    if len(argv) >= 2 and argv[0] == '-m':
+        return argv[1], argv[2:]
+    elif len(argv) >= 1 and argv[0].startswith('-m'):
+        return argv[0][2:], argv[1:]
+    else:
+        return None, argv
+
+
+def serve(socket_path: str, pool_size: int = 4, keep_cache: bool = False, socket_mode: Optional[int] = None) -> None:
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    with WorkerServer(socket_path, Worker(pool_size=pool_size, keep_cache=keep_cache)) as server:
+        if socket_mode is not None:
+            os.chmod(socket_path, socket_mode)
+
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    import configargparse
+
+    parser = configargparse.ArgParser()
+    parser.add_argument('--socket', env_var='PROTODB_WORKER_SOCKET', required=True)
+    parser.add_argument('--socket-mode', type=lambda s: int(s, 8), default=0o660,
+                        help='permissions of the socket file (octal)')
+    parser.add_argument('--pool-size', type=int, default=4, help='maximum database connections per connection string')
+    parser.add_argument('--keep-cache', action='store_true',
+                        help='keep SQL entity caches between requests, relying on the changelog to detect changes')
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.socket)), exist_ok=True)
+    serve(args.socket, pool_size=args.pool_size, keep_cache=args.keep_cache, socket_mode=args.socket_mode)